@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import statistics
+import tempfile
+from database import DataBase
+from costeo import MatrizCostos, calcular_costo_insumo
+from recetario import CacheRecetas, datos_receta, renderizar_receta
+
+# Vocabulario para que los nombres sintéticos se parezcan a un menú real (y la búsqueda tenga algo que encontrar)
+BEBIDAS = ["Capuchino", "Latte", "Americano", "Moka", "Espresso", "Frappé", "Chai", "Matcha", "Macchiato", "Chocolate", "Té", "Smoothie"]
+SABORES = ["Vainilla", "Caramelo", "Avellana", "Canela", "Coco", "Fresa", "Menta", "Almendra", "Miel", "Clásico"]
+INSUMOS = ["Leche", "Café", "Azúcar", "Jarabe", "Crema", "Hielo", "Vaso", "Tapa", "Polvo", "Salsa", "Fruta", "Té"]
+CATEGORIAS = ["Café", "Té", "Fríos", "Calientes", "Postres", "Temporada"]
+TAMANOS = ["Chico", "Mediano", "Grande", "Extra Grande", "Jarra"]
+LOTE = 10000
+
+def en_lotes(db, query, filas):
+    # executemany sobre un generador, un commit cada LOTE filas
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) == LOTE:
+            with db.transaccion(): db.ejecutar_lote(query, bloque)
+            bloque = []
+    if bloque:
+        with db.transaccion(): db.ejecutar_lote(query, bloque)
+
+def generar_catalogo(db, ingredientes=1000, tamanos=3, por_receta=8, pasos=5, semilla=42, preparaciones=20):
+    # Llena el esquema existente; la escala se fija por el total de filas en receta_ingredientes
+    rnd = random.Random(semilla); tamanos = min(tamanos, len(TAMANOS))
+    recetas = max(1, ingredientes // por_receta); productos = max(1, recetas // tamanos); n_insumos = max(20, productos // 2)
+    unidades = [r[0] for r in db.traer_datos("SELECT id FROM unidades")]
+    en_lotes(db, "INSERT INTO categorias (nombre) VALUES (?)", ((c,) for c in CATEGORIAS))
+    cats = [r[0] for r in db.traer_datos("SELECT id FROM categorias")]
+    en_lotes(db, "INSERT INTO subcategorias (nombre, categoria_id) VALUES (?,?)", ((f"{s} {c}", c) for c in cats for s in ("Clásicos", "Especiales", "Ligeros")))
+    subcats = db.traer_datos("SELECT id, categoria_id FROM subcategorias")
+    en_lotes(db, "INSERT INTO tamanos (nombre) VALUES (?)", ((t,) for t in TAMANOS[:tamanos]))
+    tams = [r[0] for r in db.traer_datos("SELECT id FROM tamanos")][:tamanos]
+
+    def filas_insumos():
+        for i in range(n_insumos):
+            uc = rnd.choice(unidades); uu = rnd.choice(unidades); cant = rnd.choice([1, 2, 5, 10]); costo = round(rnd.uniform(10, 500), 2)
+            factor = 1.0 if uc == uu else float(rnd.choice([100, 1000, 3785]))
+            r_r, c_u = calcular_costo_insumo(cant, costo, factor)
+            yield (f"{rnd.choice(INSUMOS)} {rnd.choice(SABORES)} {i}", uc, uu, cant, costo, factor, r_r, c_u)
+    en_lotes(db, "INSERT INTO insumos (nombre, unidad_compra_id, unidad_uso_id, cantidad_envase, costo_envase, factor_conversion, rendimiento_total, costo_unitario) VALUES (?,?,?,?,?,?,?,?)", filas_insumos())
+    ins_min, ins_max = db.traer_datos("SELECT MIN(id), MAX(id) FROM insumos")[0]
+
+    def filas_productos():
+        for i in range(productos):
+            sc, c = rnd.choice(subcats); yield (f"{rnd.choice(BEBIDAS)} {rnd.choice(SABORES)} {i}", c, sc)
+    en_lotes(db, "INSERT INTO productos (nombre, categoria_id, subcategoria_id) VALUES (?,?,?)", filas_productos())
+    prod_min, prod_max = db.traer_datos("SELECT MIN(id), MAX(id) FROM productos")[0]
+    en_lotes(db, "INSERT INTO receta_pasos (producto_id, orden, descripcion) VALUES (?,?,?)", ((p, o, f"Paso {o} del producto {p}") for p in range(prod_min, prod_max + 1) for o in range(1, pasos + 1)))
+    en_lotes(db, "INSERT OR IGNORE INTO receta_config (producto_id, tamano_id) VALUES (?,?)", ((p, t) for p in range(prod_min, prod_max + 1) for t in tams))
+    rc_min, rc_max = db.traer_datos("SELECT MIN(id), MAX(id) FROM receta_config")[0]
+    en_lotes(db, "INSERT INTO receta_ingredientes (receta_config_id, insumo_id, cantidad_necesaria) VALUES (?,?,?)",
+             ((rc, rnd.randint(ins_min, ins_max), round(rnd.uniform(1, 300), 1)) for rc in range(rc_min, rc_max + 1) for _ in range(por_receta)))
+    # Las primeras recetas pasan a ser preparaciones (rinden 1000) y una de cada cuatro recetas restantes usa alguna
+    preparaciones = min(preparaciones, (rc_max - rc_min + 1) // 2); prep_max = rc_min + preparaciones - 1
+    if preparaciones:
+        db.ejecutar("UPDATE receta_config SET rendimiento = 1000, unidad_rendimiento_id = ? WHERE id BETWEEN ? AND ?", (unidades[0], rc_min, prep_max))
+        en_lotes(db, "INSERT INTO receta_ingredientes (receta_config_id, subreceta_id, cantidad_necesaria) VALUES (?,?,?)",
+                 ((rc, rnd.randint(rc_min, prep_max), round(rnd.uniform(10, 200), 1)) for rc in range(prep_max + 1, rc_max + 1) if rnd.random() < 0.25))
+    return {"insumos": n_insumos, "productos": productos, "tamanos": tamanos, "recetas": rc_max - rc_min + 1, "ingredientes": (rc_max - rc_min + 1) * por_receta, "pasos": productos * pasos, "preparaciones": preparaciones}
+
+def medir(nombre, fn, repeticiones):
+    fn()  # Calentamiento (caché de páginas de SQLite, compilación de sentencias)
+    tiempos = []
+    for _ in range(repeticiones):
+        t = time.perf_counter(); fn(); tiempos.append((time.perf_counter() - t) * 1000)
+    r = {"nombre": nombre, "repeticiones": repeticiones, "ms_min": min(tiempos), "ms_mediana": statistics.median(tiempos), "ms_media": statistics.mean(tiempos)}
+    print(f"  {nombre:<42}{r['ms_mediana']:10.3f} ms (min {r['ms_min']:.3f})")
+    return r
+
+def benchmarks_bd(db, rnd, repeticiones):
+    prods = [r[0] for r in db.traer_datos("SELECT id FROM productos")]; tams = [r[0] for r in db.traer_datos("SELECT id FROM tamanos")]
+    def al_azar(): return rnd.choice(prods), rnd.choice(tams)
+    cache = CacheRecetas(db); fijo = al_azar()
+    def guardar_pasos(): db.guardar_pasos(fijo[0], [f"Paso {i}" for i in range(20)])
+    base = db.traer_datos("SELECT ri.insumo_id FROM receta_ingredientes ri JOIN receta_config rc ON ri.receta_config_id = rc.id WHERE rc.rendimiento > 0 AND ri.insumo_id IS NOT NULL LIMIT 1")
+    def precio_insumo():
+        if base: db.ejecutar("UPDATE insumos SET costo_unitario = costo_unitario * 1.001 WHERE id=?", base[0])
+    def clonar():
+        db.ejecutar("DELETE FROM receta_config WHERE producto_id=? AND tamano_id=?", (fijo[0], tams[-1])); db.clonar_receta(fijo[0], tams[0], tams[-1])
+    return [
+        medir("tabla insumos (consulta completa)", lambda: db.traer_datos('SELECT i.id, i.nombre, (i.cantidad_envase || " " || u1.nombre), i.costo_envase, i.factor_conversion, (i.rendimiento_total || " " || u2.nombre), i.costo_unitario FROM insumos i JOIN unidades u1 ON i.unidad_compra_id = u1.id JOIN unidades u2 ON i.unidad_uso_id = u2.id ORDER BY i.id DESC'), repeticiones),
+        medir("lista de productos", lambda: db.traer_datos("SELECT id, nombre FROM productos ORDER BY nombre"), repeticiones),
+        medir("buscar_insumos('lec')", lambda: db.buscar_insumos("lec"), repeticiones),
+        medir("buscar_productos('capu')", lambda: db.buscar_productos("capu"), repeticiones),
+        medir("buscar_productos('café')", lambda: db.buscar_productos("café"), repeticiones),
+        medir("costeo catálogo completo", lambda: MatrizCostos.calcular(db), max(1, repeticiones // 10)),
+        medir("costo_receta (persistido)", lambda: db.costo_receta(*al_azar()), repeticiones),
+        medir("receta visor (consulta + HTML)", lambda: renderizar_receta(*datos_receta(db, *al_azar())), repeticiones),
+        medir("receta visor (caché)", lambda: cache.obtener(*fijo), repeticiones),
+        medir("guardar producto con 20 pasos", guardar_pasos, repeticiones),
+        medir("clonar receta entre tamaños", clonar, repeticiones),
+        medir("precio de insumo de una preparación", precio_insumo, repeticiones),
+    ]
+
+def benchmarks_qt(db, repeticiones):
+    # Poblado de tablas sin pantalla; se omite si PyQt5 no está instalado
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+        from main import TablaConsulta
+    except ImportError:
+        print("  (PyQt5 no disponible: se omiten las mediciones de tablas)"); return []
+    app = QApplication.instance() or QApplication([]); tabla = TablaConsulta(db, ["ID", "Insumo", "Costo"]); tabla.resize(800, 600)
+    def poblar():
+        tabla.cargar("SELECT id, nombre, costo_unitario FROM insumos ORDER BY id DESC"); tabla.show(); app.processEvents()
+    return [medir("tabla insumos (modelo perezoso)", poblar, repeticiones)]
+
+def comparar(actual, ruta_anterior):
+    with open(ruta_anterior, encoding="utf-8") as f: anterior = {r["nombre"]: r for r in json.load(f)["resultados"]}
+    print("Comparación con", ruta_anterior)
+    for r in actual["resultados"]:
+        a = anterior.get(r["nombre"])
+        if a: print(f"  {r['nombre']:<42}{a['ms_mediana']:10.3f} -> {r['ms_mediana']:10.3f} ms  (x{r['ms_mediana'] / a['ms_mediana'] if a['ms_mediana'] else 0:.2f})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catálogo sintético y mediciones de las rutas críticas.")
+    parser.add_argument("--ingredientes", type=int, default=10000, help="Filas de receta_ingredientes a generar (100 a 1000000)")
+    parser.add_argument("--tamanos", type=int, default=3)
+    parser.add_argument("--por-receta", type=int, default=8, help="Ingredientes por receta")
+    parser.add_argument("--preparaciones", type=int, default=20, help="Recetas que se usan como subreceta de otras")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--bd", help="Usar (o generar, si está vacía) esta BD en lugar de una temporal")
+    parser.add_argument("--sin-qt", action="store_true", help="No medir el poblado de tablas Qt")
+    parser.add_argument("--salida", help="Guardar los resultados en JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    args = parser.parse_args(argv)
+
+    ruta = args.bd or os.path.join(tempfile.mkdtemp(prefix="recetario_bench_"), "bench.db")
+    db = DataBase(ruta); escala = None
+    if not db.traer_datos("SELECT 1 FROM receta_ingredientes LIMIT 1"):
+        t = time.perf_counter(); escala = generar_catalogo(db, args.ingredientes, args.tamanos, args.por_receta, semilla=args.semilla, preparaciones=args.preparaciones)
+        escala["segundos_generacion"] = round(time.perf_counter() - t, 3); print(f"Catálogo generado en {ruta}: {escala}")
+    print("Mediciones (mediana):")
+    resultados = benchmarks_bd(db, random.Random(args.semilla), args.repeticiones)
+    if not args.sin_qt: resultados += benchmarks_qt(db, max(1, args.repeticiones // 10))
+    actual = {"fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "plataforma": platform.platform(),
+              "parametros": vars(args), "escala": escala, "resultados": resultados}
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f: json.dump(actual, f, indent=2, ensure_ascii=False)
+    if args.comparar: comparar(actual, args.comparar)
+
+if __name__ == '__main__':
+    sys.exit(main())
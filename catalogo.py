@@ -0,0 +1,45 @@
+# Listas de referencia que comparten varias pestañas: consulta y tablas de las que depende cada una
+LISTAS = {
+    "unidades": ("SELECT id, nombre FROM unidades", ("unidades",)),
+    "categorias": ("SELECT id, nombre FROM categorias", ("categorias",)),
+    "tamanos": ("SELECT id, nombre FROM tamanos", ("tamanos",)),
+    "subcategorias": ("SELECT s.id, s.nombre, c.nombre, c.id FROM subcategorias s LEFT JOIN categorias c ON s.categoria_id = c.id", ("subcategorias", "categorias")),
+    "productos": ("SELECT id, nombre FROM productos ORDER BY nombre", ("productos",)),
+    "insumos": ("SELECT i.id, i.nombre, u.nombre FROM insumos i JOIN unidades u ON i.unidad_uso_id = u.id", ("insumos", "unidades")),
+    "subrecetas": ("""SELECT rc.id, p.nombre || ' (' || t.nombre || ')', COALESCE(u.nombre, 'u.') FROM receta_config rc JOIN productos p ON rc.producto_id = p.id JOIN tamanos t ON rc.tamano_id = t.id
+        LEFT JOIN unidades u ON rc.unidad_rendimiento_id = u.id WHERE rc.rendimiento > 0 ORDER BY p.nombre, t.id""", ("receta_config", "productos", "tamanos", "unidades")),
+}
+
+def tablas_de(nombres):
+    # Acepta nombres de listas o de tablas sueltas
+    return tuple(sorted({t for n in nombres for t in (LISTAS[n][1] if n in LISTAS else (n,))}))
+
+class Catalogo:
+    # Caché de lectura compartida por toda la app: cada lista se consulta una sola vez y se descarta cuando DataBase avisa
+    # que se modificó alguna de sus tablas; los contadores de versión cubren además los commits de otras conexiones
+    def __init__(self, db):
+        self.db = db; self.entradas = {}; self.mostradas = {}; self.aciertos = 0; self.fallos = 0; db.suscribir(self.invalidar)
+
+    def invalidar(self, tablas):
+        for nombre in [n for n in self.entradas if tablas.intersection(LISTAS[n][1])]: del self.entradas[nombre]
+
+    def version(self, *nombres):
+        return self.db.version(*tablas_de(nombres)) + (self.db.version_externa(),)
+
+    def obtener(self, nombre):
+        version = self.version(nombre); entrada = self.entradas.get(nombre)
+        if entrada and entrada[0] == version:
+            self.aciertos += 1
+            return entrada[1]
+        self.fallos += 1; filas = self.db.traer_datos(LISTAS[nombre][0]); self.entradas[nombre] = (version, filas)
+        return filas
+
+    def cambio(self, clave, *nombres, filtro=None):
+        # True si lo que muestra el widget 'clave' quedó viejo (y lo da por actualizado); False si puede quedar como está
+        estado = (filtro, self.version(*nombres))
+        if self.mostradas.get(clave) == estado: return False
+        self.mostradas[clave] = estado
+        return True
+
+    def limpiar(self):
+        self.entradas.clear(); self.mostradas.clear()
@@ -0,0 +1,283 @@
+import sys
+import csv
+import math
+import argparse
+import datetime
+from database import DataBase, COSTO_RECETA_SQL
+
+# Una sola pasada sobre todo el catálogo; el costo sale de {costos}: receta_costos (ya incluye las subrecetas propagadas en orden)
+# o temp.costos_fecha para una fecha pasada
+CONSULTA_MATRIZ = """
+    SELECT rc.producto_id, p.nombre, rc.tamano_id, t.nombre, COUNT(ri.id), COALESCE(rco.costo, 0)
+    FROM receta_config rc
+    JOIN productos p ON rc.producto_id = p.id
+    JOIN tamanos t ON rc.tamano_id = t.id
+    LEFT JOIN receta_ingredientes ri ON ri.receta_config_id = rc.id
+    LEFT JOIN {costos} rco ON rco.receta_config_id = rc.id
+    GROUP BY rc.id
+    ORDER BY p.nombre, t.id
+"""
+
+def calcular_costo_insumo(cantidad_envase, costo_envase, factor_conversion):
+    # Rendimiento en unidades de uso por envase y costo por unidad de uso; (0, None) si el envase no rinde
+    rendimiento = math.floor(cantidad_envase * factor_conversion)
+    return (rendimiento, costo_envase / rendimiento) if rendimiento else (0, None)
+
+# Precio vigente de cada insumo usado por las recetas de temp.costos_conjunto: la última fila del historial <= fecha, una búsqueda
+# por índice (insumo_id, fecha) por insumo; si la fecha es anterior al historial se toma el precio más antiguo conocido (ver costos_a_fecha)
+CONSULTA_PRECIOS_FECHA = """
+    INSERT INTO temp.precios_fecha (id, costo_unitario)
+    SELECT u.insumo_id, COALESCE(
+        (SELECT h.costo_unitario FROM insumo_precios h WHERE h.insumo_id = u.insumo_id AND h.fecha <= :fecha ORDER BY h.fecha DESC, h.id DESC LIMIT 1),
+        (SELECT h.costo_unitario FROM insumo_precios h WHERE h.insumo_id = u.insumo_id ORDER BY h.fecha, h.id LIMIT 1))
+    FROM (SELECT DISTINCT ri.insumo_id FROM receta_ingredientes ri JOIN temp.costos_conjunto s ON s.id = ri.receta_config_id WHERE ri.insumo_id IS NOT NULL) u
+"""
+
+def fecha_limite(fecha, fin_del_dia=True):
+    """Fecha de corte en el formato del historial ("AAAA-MM-DD HH:MM:SS", hora local).
+
+    Acepta datetime, date o texto ISO ("AAAA-MM-DD", "AAAA-MM-DD HH:MM[:SS]", con "T" o zona horaria); una fecha sola cubre el día
+    completo, o su inicio con fin_del_dia=False. Cualquier otra cosa levanta ValueError: compararla como texto con el historial daría
+    un costo sin sentido.
+    """
+    if not isinstance(fecha, datetime.datetime):
+        if not isinstance(fecha, datetime.date):
+            texto = str(fecha).strip()
+            try: fecha = datetime.date.fromisoformat(texto)
+            except ValueError:
+                try: fecha = datetime.datetime.fromisoformat(texto)
+                except ValueError: raise ValueError(f"Fecha inválida: {texto!r} (se espera AAAA-MM-DD o AAAA-MM-DD HH:MM:SS)") from None
+        if not isinstance(fecha, datetime.datetime): fecha = datetime.datetime.combine(fecha, datetime.time(23, 59, 59) if fin_del_dia else datetime.time())
+    if fecha.tzinfo is not None: fecha = fecha.astimezone().replace(tzinfo=None)
+    return fecha.strftime("%Y-%m-%d %H:%M:%S")
+
+def preparar_costos_a_fecha(db, fecha, recetas=None):
+    # Llena temp.costos_fecha (receta_config_id, costo) con los precios vigentes a esa fecha; recetas: ids de receta_config (None = todo el catálogo)
+    # Cambian solo los precios, la composición de las recetas es la actual. Va dentro de una transacción
+    limite = fecha_limite(fecha)
+    db.ejecutar("CREATE TEMP TABLE IF NOT EXISTS costos_conjunto (id INTEGER PRIMARY KEY)")
+    db.ejecutar("CREATE TEMP TABLE IF NOT EXISTS precios_fecha (id INTEGER PRIMARY KEY, costo_unitario REAL)")
+    db.ejecutar("CREATE TEMP TABLE IF NOT EXISTS costos_fecha (receta_config_id INTEGER PRIMARY KEY, costo REAL)")
+    for t in ("costos_conjunto", "precios_fecha", "costos_fecha"): db.ejecutar(f"DELETE FROM temp.{t}")
+    if recetas is None: db.ejecutar("INSERT INTO temp.costos_conjunto (id) SELECT id FROM receta_config")
+    else:
+        db.ejecutar_lote("INSERT OR IGNORE INTO temp.costos_conjunto (id) VALUES (?)", [(r,) for r in recetas])
+        # Más sus subrecetas, recursivamente: solo se costea lo que hace falta
+        db.ejecutar('''INSERT OR IGNORE INTO temp.costos_conjunto (id) WITH RECURSIVE sub(id) AS (SELECT id FROM temp.costos_conjunto
+            UNION SELECT ri.subreceta_id FROM receta_ingredientes ri JOIN sub ON ri.receta_config_id = sub.id WHERE ri.subreceta_id IS NOT NULL) SELECT id FROM sub''')
+    db.ejecutar(CONSULTA_PRECIOS_FECHA, {"fecha": limite})
+    costo = COSTO_RECETA_SQL.format(rc="costos_nivel.id", precios="temp.precios_fecha", costos="temp.costos_fecha")
+    db.calcular_por_niveles("temp.costos_conjunto", f"INSERT INTO temp.costos_fecha (receta_config_id, costo) SELECT id, {costo} FROM temp.costos_nivel")
+
+def costos_a_fecha(db, fecha, recetas=None):
+    """{receta_config_id: costo} con los precios vigentes a esa fecha (ver fecha_limite; ValueError si no es válida).
+
+    Cada insumo toma su último precio registrado hasta la fecha. Si la fecha es anterior al primer registro de un insumo (se agregó
+    después) se usa su precio más antiguo conocido, no 0: el costo es una estimación para esos insumos. La composición de las recetas
+    es la actual. recetas: ids de receta_config (None = todo el catálogo).
+    """
+    with db.transaccion():
+        preparar_costos_a_fecha(db, fecha, recetas); costos = dict(db.traer_datos("SELECT receta_config_id, costo FROM temp.costos_fecha"))
+    return costos if recetas is None else {r: costos.get(r, 0.0) for r in recetas}
+
+def costo_receta_a_fecha(db, producto_id, tamano_id, fecha):
+    """Costo de una receta producto x tamaño a esa fecha, con las mismas reglas que costos_a_fecha; 0.0 si no hay receta."""
+    rc = db.traer_datos("SELECT id FROM receta_config WHERE producto_id=? AND tamano_id=?", (producto_id, tamano_id))
+    return costos_a_fecha(db, fecha, [rc[0][0]])[rc[0][0]] if rc else 0.0
+
+def serie_precios(db, insumo_id, desde=None, hasta=None):
+    # Evolución del precio de un insumo: [(fecha, costo_envase, costo_unitario)], rango sobre el mismo índice
+    return db.traer_datos("SELECT fecha, costo_envase, costo_unitario FROM insumo_precios WHERE insumo_id = ? AND fecha >= ? AND fecha <= ? ORDER BY fecha, id",
+                          (insumo_id, fecha_limite(desde, False) if desde else "", fecha_limite(hasta) if hasta else "9999"))
+
+COLUMNAS_CSV = ["producto_id", "producto", "tamano_id", "tamano", "ingredientes", "costo"]
+
+class MatrizCostos:
+    def __init__(self, filas):
+        # filas: (producto_id, producto, tamano_id, tamano, ingredientes, costo)
+        self.filas = {(f[0], f[2]): tuple(f) for f in filas}
+
+    @classmethod
+    def calcular(cls, db, fecha=None):
+        if fecha is None: return cls(db.traer_datos(CONSULTA_MATRIZ.format(costos="receta_costos")))
+        with db.transaccion():
+            preparar_costos_a_fecha(db, fecha); return cls(db.traer_datos(CONSULTA_MATRIZ.format(costos="temp.costos_fecha")))
+
+    @classmethod
+    def desde_csv(cls, ruta):
+        with open(ruta, newline="", encoding="utf-8") as f:
+            return cls((int(r["producto_id"]), r["producto"], int(r["tamano_id"]), r["tamano"], int(r["ingredientes"]), float(r["costo"])) for r in csv.DictReader(f))
+
+    def __len__(self):
+        return len(self.filas)
+
+    def __iter__(self):
+        return iter(self.filas.values())
+
+    def costo(self, producto_id, tamano_id):
+        fila = self.filas.get((producto_id, tamano_id))
+        return fila[5] if fila else None
+
+    def costos_producto(self, producto_id):
+        return {f[2]: f[5] for f in self.filas.values() if f[0] == producto_id}
+
+    def costos_tamano(self, tamano_id):
+        return {f[0]: f[5] for f in self.filas.values() if f[2] == tamano_id}
+
+    def exportar_csv(self, ruta):
+        with open(ruta, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f); w.writerow(COLUMNAS_CSV)
+            for fila in self.filas.values(): w.writerow(fila[:5] + (f"{fila[5]:.4f}",))
+
+    def diferencia(self, otra, tolerancia=0.005):
+        # Devuelve (producto, tamaño, costo_antes, costo_despues) de lo que cambió; None = receta nueva o eliminada
+        cambios = []
+        for clave in sorted(self.filas.keys() | otra.filas.keys()):
+            antes = otra.filas.get(clave); despues = self.filas.get(clave); ref = despues or antes
+            c_a = antes[5] if antes else None; c_d = despues[5] if despues else None
+            if c_a is None or c_d is None or abs(c_a - c_d) > tolerancia: cambios.append((ref[1], ref[3], c_a, c_d))
+        return cambios
+
+# Pedidos agrupados por receta y expandidos por subrecetas (en tandas de su rendimiento) en temp.demanda_explosion; una subreceta sin
+# rendimiento no se puede expandir y queda en CONSULTA_OMITIDAS
+CONSULTA_DEMANDA = """
+    INSERT INTO temp.demanda_explosion (receta_config_id, cantidad)
+    WITH RECURSIVE pedidos AS (SELECT producto_id, tamano_id, SUM(cantidad) AS cantidad FROM temp.pedidos_explosion GROUP BY producto_id, tamano_id),
+    demanda(receta_config_id, cantidad) AS (
+        SELECT rc.id, pe.cantidad FROM pedidos pe JOIN receta_config rc ON rc.producto_id = pe.producto_id AND rc.tamano_id = pe.tamano_id
+        UNION ALL
+        SELECT ri.subreceta_id, d.cantidad * ri.cantidad_necesaria / sr.rendimiento
+        FROM demanda d
+        JOIN receta_ingredientes ri ON ri.receta_config_id = d.receta_config_id
+        JOIN receta_config sr ON sr.id = ri.subreceta_id AND sr.rendimiento > 0
+    )
+    SELECT receta_config_id, SUM(cantidad) FROM demanda GROUP BY receta_config_id
+"""
+
+# Requerimiento total por insumo; sin factor de conversión no hay cantidad de compra y el insumo queda en CONSULTA_OMITIDAS
+CONSULTA_EXPLOSION = """
+    WITH requerido AS (
+        SELECT ri.insumo_id, SUM(d.cantidad * ri.cantidad_necesaria) AS total
+        FROM temp.demanda_explosion d
+        JOIN receta_ingredientes ri ON ri.receta_config_id = d.receta_config_id
+        WHERE ri.insumo_id IS NOT NULL
+        GROUP BY ri.insumo_id
+    )
+    SELECT i.id, i.nombre, r.total, uu.nombre, r.total / i.factor_conversion, uc.nombre, i.cantidad_envase, i.costo_envase
+    FROM requerido r
+    JOIN insumos i ON i.id = r.insumo_id
+    LEFT JOIN unidades uu ON i.unidad_uso_id = uu.id
+    LEFT JOIN unidades uc ON i.unidad_compra_id = uc.id
+    WHERE i.factor_conversion > 0
+    ORDER BY i.nombre
+"""
+
+# Líneas de las recetas pedidas que no entran en el plan: (receta, ingrediente, motivo)
+CONSULTA_OMITIDAS = """
+    SELECT p.nombre || ' (' || t.nombre || ')', sp.nombre || ' (' || st.nombre || ')', 'subreceta sin rendimiento'
+    FROM temp.demanda_explosion d
+    JOIN receta_config rc ON rc.id = d.receta_config_id JOIN productos p ON p.id = rc.producto_id JOIN tamanos t ON t.id = rc.tamano_id
+    JOIN receta_ingredientes ri ON ri.receta_config_id = d.receta_config_id
+    JOIN receta_config sr ON sr.id = ri.subreceta_id JOIN productos sp ON sp.id = sr.producto_id JOIN tamanos st ON st.id = sr.tamano_id
+    WHERE NOT COALESCE(sr.rendimiento > 0, 0)
+    UNION
+    SELECT p.nombre || ' (' || t.nombre || ')', i.nombre, 'insumo sin factor de conversión'
+    FROM temp.demanda_explosion d
+    JOIN receta_config rc ON rc.id = d.receta_config_id JOIN productos p ON p.id = rc.producto_id JOIN tamanos t ON t.id = rc.tamano_id
+    JOIN receta_ingredientes ri ON ri.receta_config_id = d.receta_config_id
+    JOIN insumos i ON i.id = ri.insumo_id
+    WHERE NOT COALESCE(i.factor_conversion > 0, 0)
+    ORDER BY 1, 2
+"""
+
+CONSULTA_SIN_RECETA = """
+    SELECT COUNT(*) FROM temp.pedidos_explosion pe
+    WHERE NOT EXISTS (SELECT 1 FROM receta_config rc WHERE rc.producto_id = pe.producto_id AND rc.tamano_id = pe.tamano_id)
+"""
+
+COLUMNAS_COMPRA = ["insumo_id", "insumo", "cantidad_uso", "unidad_uso", "cantidad_compra", "unidad_compra", "envases", "costo"]
+
+class PlanCompra:
+    def __init__(self, lineas, sin_receta=0, omitidas=()):
+        # lineas: (insumo_id, insumo, cantidad_uso, unidad_uso, cantidad_compra, unidad_compra, envases, costo)
+        # omitidas: (receta, ingrediente, motivo) de lo que no se pudo llevar a cantidades de compra
+        self.lineas = lineas; self.sin_receta = sin_receta; self.omitidas = list(omitidas); self.total = sum(l[7] for l in lineas)
+
+    @classmethod
+    def calcular(cls, db, pedidos):
+        # pedidos: iterable de (producto_id, tamano_id, cantidad); se cargan con executemany en una tabla temporal
+        with db.transaccion():
+            db.ejecutar("CREATE TEMP TABLE IF NOT EXISTS pedidos_explosion (producto_id INTEGER, tamano_id INTEGER, cantidad REAL)")
+            db.ejecutar("CREATE TEMP TABLE IF NOT EXISTS demanda_explosion (receta_config_id INTEGER PRIMARY KEY, cantidad REAL)")
+            for t in ("pedidos_explosion", "demanda_explosion"): db.ejecutar(f"DELETE FROM temp.{t}")
+            db.ejecutar_lote("INSERT INTO temp.pedidos_explosion (producto_id, tamano_id, cantidad) VALUES (?,?,?)", pedidos)
+            db.ejecutar(CONSULTA_DEMANDA)
+            filas = db.traer_datos(CONSULTA_EXPLOSION); omitidas = db.traer_datos(CONSULTA_OMITIDAS); sin_receta = db.traer_datos(CONSULTA_SIN_RECETA)[0][0]
+            for t in ("pedidos_explosion", "demanda_explosion"): db.ejecutar(f"DELETE FROM temp.{t}")
+        lineas = []
+        for ins_id, nombre, total, u_uso, compra, u_compra, cant_envase, costo_envase in filas:
+            envases = math.ceil(round(compra / cant_envase, 9)) if cant_envase else 0  # Redondeo previo para no pedir un envase de más por error de coma flotante
+            lineas.append((ins_id, nombre, total, u_uso, compra, u_compra, envases, envases * (costo_envase or 0)))
+        return cls(lineas, sin_receta, omitidas)
+
+    def exportar_csv(self, ruta):
+        with open(ruta, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f); w.writerow(COLUMNAS_COMPRA)
+            for l in self.lineas: w.writerow(l[:2] + (f"{l[2]:.4f}", l[3], f"{l[4]:.4f}", l[5], l[6], f"{l[7]:.2f}"))
+
+def leer_pedidos(db, ruta):
+    # CSV con columnas producto, tamano, cantidad (por nombre); se traduce a ids con un diccionario por tabla
+    # Los diccionarios se arman antes de devolver el generador: executemany no permite consultar mientras lo consume
+    # Un nombre que no existe (un error de tipeo) da id None: la línea no aporta insumos pero se cuenta en sin_receta
+    productos = {n: i for i, n in db.traer_datos("SELECT id, nombre FROM productos")}; tamanos = {n: i for i, n in db.traer_datos("SELECT id, nombre FROM tamanos")}
+    def filas():
+        with open(ruta, newline="", encoding="utf-8-sig") as f:
+            for r in csv.DictReader(f):
+                p = productos.get((r.get("producto") or "").strip()); t = tamanos.get((r.get("tamano") or "").strip())
+                yield p, t, float(r["cantidad"])
+    return filas()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reporte de costos de todas las recetas (producto x tamaño).")
+    parser.add_argument("--bd", default="db_recetario.db", help="Ruta a la base de datos")
+    parser.add_argument("--csv", help="Exportar la matriz de costos a este archivo CSV")
+    parser.add_argument("--comparar", help="CSV de un reporte anterior para mostrar las diferencias")
+    parser.add_argument("--fecha", help="Costear con los precios vigentes a esta fecha (AAAA-MM-DD) en lugar de los actuales")
+    parser.add_argument("--comparar-fecha", help="Mostrar las diferencias contra los costos a esta fecha (AAAA-MM-DD)")
+    parser.add_argument("--historial", help="Nombre de un insumo: muestra la evolución de su precio")
+    parser.add_argument("--pedidos", help="CSV de pedidos (producto, tamano, cantidad): calcula la lista de compras en lugar del reporte de costos")
+    args = parser.parse_args(argv)
+    for f in (args.fecha, args.comparar_fecha):
+        try:
+            if f: fecha_limite(f)
+        except ValueError as e: parser.error(str(e))
+    db = DataBase(args.bd)
+    if args.historial:
+        ins = db.traer_datos("SELECT id FROM insumos WHERE nombre = ?", (args.historial,))
+        if not ins: return print(f"No existe el insumo {args.historial}.")
+        anterior = None
+        for fecha, c_e, c_u in serie_precios(db, ins[0][0], hasta=args.fecha):
+            var = f" ({(c_u / anterior - 1) * 100:+.1f}%)" if anterior and c_u is not None else ""
+            print(f"{fecha}: envase ${c_e or 0:.2f}, por uso ${c_u or 0:.4f}{var}"); anterior = c_u
+        return
+    if args.pedidos:
+        plan = PlanCompra.calcular(db, leer_pedidos(db, args.pedidos))
+        if args.csv: plan.exportar_csv(args.csv)
+        else:
+            for _, ins, uso, u_uso, compra, u_compra, envases, costo in plan.lineas: print(f"{ins}: {uso:.2f} {u_uso} = {compra:.3f} {u_compra} -> {envases} envases, ${costo:.2f}")
+        for receta, ingrediente, motivo in plan.omitidas: print(f"Omitido: {ingrediente} en {receta} ({motivo}).")
+        if plan.sin_receta: print(f"{plan.sin_receta} líneas de pedido sin receta para ese tamaño o con un producto/tamaño inexistente.")
+        return print(f"Total de compra: ${plan.total:.2f}")
+    matriz = MatrizCostos.calcular(db, args.fecha)
+    if args.csv: matriz.exportar_csv(args.csv)
+    if args.comparar or args.comparar_fecha:
+        otra = MatrizCostos.desde_csv(args.comparar) if args.comparar else MatrizCostos.calcular(db, args.comparar_fecha)
+        for prod, tam, antes, despues in matriz.diferencia(otra):
+            a = f"${antes:.2f}" if antes is not None else "-"; d = f"${despues:.2f}" if despues is not None else "-"
+            print(f"{prod} ({tam}): {a} -> {d}")
+    elif not args.csv:
+        for _, prod, _, tam, n, costo in matriz: print(f"{prod} ({tam}): {n} ingredientes, ${costo:.2f}")
+    print(f"{len(matriz)} recetas costeadas.")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,456 @@
+import re
+import time
+import sqlite3
+from contextlib import contextmanager
+from instrumentacion import Instrumentacion
+
+# Costo de una receta_config a partir de sus ingredientes; {rc} es la expresión con el id de la receta
+# Una subreceta aporta su costo ya calculado ({costos}) dividido por su rendimiento; {precios} da el costo_unitario de cada insumo por id
+COSTO_RECETA_SQL = """COALESCE((SELECT SUM(ri.cantidad_necesaria * COALESCE(i.costo_unitario, sc.costo / sr.rendimiento)) FROM receta_ingredientes ri
+    LEFT JOIN {precios} i ON ri.insumo_id = i.id LEFT JOIN receta_config sr ON ri.subreceta_id = sr.id LEFT JOIN {costos} sc ON sc.receta_config_id = sr.id
+    WHERE ri.receta_config_id = {rc}), 0)"""
+
+# Ingredientes de una receta (insumos o subrecetas) con nombre, unidad y costo por unidad
+CONSULTA_INGREDIENTES = """
+    SELECT ri.id, ri.insumo_id, ri.subreceta_id, COALESCE(i.nombre, sp.nombre || ' (' || st.nombre || ')'), ri.cantidad_necesaria,
+           COALESCE(u.nombre, su.nombre, 'u.'), COALESCE(i.costo_unitario, sc.costo / sr.rendimiento, 0)
+    FROM receta_ingredientes ri
+    JOIN receta_config rc ON ri.receta_config_id = rc.id
+    LEFT JOIN insumos i ON ri.insumo_id = i.id
+    LEFT JOIN unidades u ON i.unidad_uso_id = u.id
+    LEFT JOIN receta_config sr ON ri.subreceta_id = sr.id
+    LEFT JOIN productos sp ON sr.producto_id = sp.id
+    LEFT JOIN tamanos st ON sr.tamano_id = st.id
+    LEFT JOIN unidades su ON sr.unidad_rendimiento_id = su.id
+    LEFT JOIN receta_costos sc ON sc.receta_config_id = sr.id
+    WHERE rc.producto_id = ? AND rc.tamano_id = ?
+    ORDER BY ri.id
+"""
+
+# Tablas con índice de texto completo (FTS5) sobre su columna nombre
+TABLAS_BUSQUEDA = ("productos", "categorias", "subcategorias", "insumos")
+
+def expresion_busqueda(texto):
+    # Cada palabra se busca como prefijo ("capu" encuentra "Capuchino"); None si no hay nada que buscar
+    palabras = re.findall(r"\w+", texto or "")
+    return " ".join(f'"{p}"*' for p in palabras) if palabras else None
+
+def consulta_productos(texto):
+    # Coincidencias por nombre de producto primero, luego por categoría o subcategoría; dentro de cada nivel por relevancia (bm25)
+    expr = expresion_busqueda(texto)
+    if expr is None: return "SELECT id, nombre FROM productos ORDER BY nombre", ()
+    query = '''
+        SELECT p.id, p.nombre FROM (
+            SELECT rowid AS pid, 0 AS nivel, rank AS r FROM productos_fts WHERE productos_fts MATCH :q
+            UNION ALL
+            SELECT p.id, 1, f.rank FROM categorias_fts f JOIN productos p ON p.categoria_id = f.rowid WHERE categorias_fts MATCH :q
+            UNION ALL
+            SELECT p.id, 1, f.rank FROM subcategorias_fts f JOIN productos p ON p.subcategoria_id = f.rowid WHERE subcategorias_fts MATCH :q
+        ) m JOIN productos p ON p.id = m.pid
+        GROUP BY p.id
+        ORDER BY MIN(m.nivel), MIN(m.r), p.nombre
+    '''
+    return query, {"q": expr}
+
+# Se incrementa cada vez que se agrega un paso a DataBase.migrar
+VERSION_ESQUEMA = 4
+
+MODOS_SINCRONIZACION = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# Tabla afectada por una sentencia de escritura, y las que cambian en cascada (ON DELETE CASCADE / triggers)
+PATRON_ESCRITURA = re.compile(r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)", re.IGNORECASE)
+CASCADAS = {
+    "productos": ("receta_pasos", "receta_config", "receta_ingredientes", "receta_costos"),
+    "receta_config": ("receta_ingredientes", "receta_costos"),
+    "receta_ingredientes": ("receta_costos",),
+    "insumos": ("receta_costos", "insumo_precios"),
+}
+
+class SimulacionClonado(Exception):
+    # Aborta (rollback) un clonado en lote de prueba, después de calcular sus costos
+    pass
+
+class DataBase:
+    def __init__(self, db_name="db_recetario.db", sincronizacion="NORMAL"):
+        if sincronizacion.upper() not in MODOS_SINCRONIZACION: raise ValueError(f"Modo de sincronización inválido: {sincronizacion}")
+        self.db_name = db_name; self.conn = sqlite3.connect(db_name); self.nivel_transaccion = 0
+        self.versiones = {}; self.tablas_modificadas = set(); self.suscriptores = []
+        self.instrumentacion = None; self.contexto = None  # contexto: quién origina las consultas (p. ej. la pestaña activa)
+        self.conn.execute("PRAGMA foreign_keys = 1")
+        # WAL: lectores y escritor no se bloquean; con NORMAL el fsync se hace en los checkpoints y no en cada commit
+        self.conn.execute("PRAGMA journal_mode = WAL"); self.conn.execute(f"PRAGMA synchronous = {sincronizacion.upper()}")
+        self.cursor = self.conn.cursor()
+        # Las migraciones solo corren si la BD es de una versión anterior del esquema
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]; self.migrada = version < VERSION_ESQUEMA
+        if self.migrada: self.migrar(version)
+
+    def migrar(self, version):
+        if version < 1:
+            self.migracion_inicial()
+            self.crear_tablas()
+            self.crear_costos_recetas()
+            self.crear_busqueda()
+        if version < 2:
+            self.crear_subrecetas()
+        if version < 3:
+            self.crear_historial_precios()
+        if version < 4:
+            self.crear_versiones_receta()
+        self.conn.execute(f"PRAGMA user_version = {VERSION_ESQUEMA}"); self.conn.commit()
+
+    def migracion_inicial(self):
+        try:
+            self.cursor.execute("SELECT id FROM receta_ingredientes LIMIT 1")
+        except sqlite3.OperationalError:
+            print("Actualizando estructura de tabla ingredientes...")
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS receta_ingredientes_new (id INTEGER PRIMARY KEY AUTOINCREMENT, receta_config_id INTEGER, insumo_id INTEGER, cantidad_necesaria REAL)")
+            try:
+                self.cursor.execute("INSERT INTO receta_ingredientes_new (receta_config_id, insumo_id, cantidad_necesaria) SELECT receta_config_id, insumo_id, cantidad_necesaria FROM receta_ingredientes")
+                self.cursor.execute("DROP TABLE receta_ingredientes")
+            except: pass
+            self.cursor.execute("ALTER TABLE receta_ingredientes_new RENAME TO receta_ingredientes")
+            self.conn.commit()
+
+    def crear_tablas(self):
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS categorias (id INTEGER PRIMARY KEY, nombre TEXT)''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS tamanos (id INTEGER PRIMARY KEY, nombre TEXT)''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS unidades (id INTEGER PRIMARY KEY, nombre TEXT)''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS subcategorias (id INTEGER PRIMARY KEY, nombre TEXT, categoria_id INTEGER, FOREIGN KEY(categoria_id) REFERENCES categorias(id))''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS insumos (id INTEGER PRIMARY KEY, nombre TEXT, unidad_compra_id INTEGER, unidad_uso_id INTEGER, cantidad_envase REAL, costo_envase REAL, factor_conversion REAL, rendimiento_total REAL, costo_unitario REAL, FOREIGN KEY(unidad_compra_id) REFERENCES unidades(id), FOREIGN KEY(unidad_uso_id) REFERENCES unidades(id))''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS productos (id INTEGER PRIMARY KEY, nombre TEXT, instrucciones TEXT, categoria_id INTEGER, subcategoria_id INTEGER, FOREIGN KEY(categoria_id) REFERENCES categorias(id), FOREIGN KEY(subcategoria_id) REFERENCES subcategorias(id))''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS receta_pasos (id INTEGER PRIMARY KEY, producto_id INTEGER, orden INTEGER, descripcion TEXT, FOREIGN KEY(producto_id) REFERENCES productos(id) ON DELETE CASCADE)''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS receta_config (id INTEGER PRIMARY KEY, producto_id INTEGER, tamano_id INTEGER, UNIQUE(producto_id, tamano_id), FOREIGN KEY(producto_id) REFERENCES productos(id) ON DELETE CASCADE, FOREIGN KEY(tamano_id) REFERENCES tamanos(id))''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS receta_ingredientes (id INTEGER PRIMARY KEY AUTOINCREMENT, receta_config_id INTEGER, insumo_id INTEGER, cantidad_necesaria REAL, FOREIGN KEY(receta_config_id) REFERENCES receta_config(id) ON DELETE CASCADE, FOREIGN KEY(insumo_id) REFERENCES insumos(id))''')
+        # Búsquedas por nombre (importación con upsert) y pasos por producto
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_insumos_nombre ON insumos(nombre)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos(nombre)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_receta_pasos_producto ON receta_pasos(producto_id, orden)")
+        
+        self.cursor.execute("SELECT count(*) FROM unidades")
+        if self.cursor.fetchone()[0] == 0:
+            unidades_base = ["Pieza", "Litro", "Galón", "Onza (oz)", "Gramo (gr)", "Mililitro (ml)", "Kilogramo (kg)"]
+            for u in unidades_base: self.cursor.execute("INSERT INTO unidades (nombre) VALUES (?)", (u,))
+        self.conn.commit()
+
+    def crear_costos_recetas(self):
+        # Tabla de costos persistida; la mantienen los triggers de crear_subrecetas y propagar_costos
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS receta_costos (receta_config_id INTEGER PRIMARY KEY, costo REAL NOT NULL DEFAULT 0)''')
+        # Índice inverso insumo -> recetas que lo usan
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_receta_ingredientes_insumo ON receta_ingredientes(insumo_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_receta_ingredientes_config ON receta_ingredientes(receta_config_id)")
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_costo_config_delete AFTER DELETE ON receta_config BEGIN
+            DELETE FROM receta_costos WHERE receta_config_id = OLD.id; END''')
+        self.conn.commit()
+
+    def crear_subrecetas(self):
+        # Preparaciones (jarabes, bases, masas): una receta con rendimiento se puede usar como ingrediente de otras
+        columnas = lambda tabla: {r[1] for r in self.cursor.execute(f"PRAGMA table_info({tabla})").fetchall()}
+        if "subreceta_id" not in columnas("receta_ingredientes"): self.cursor.execute("ALTER TABLE receta_ingredientes ADD COLUMN subreceta_id INTEGER REFERENCES receta_config(id)")
+        if "rendimiento" not in columnas("receta_config"): self.cursor.execute("ALTER TABLE receta_config ADD COLUMN rendimiento REAL")
+        if "unidad_rendimiento_id" not in columnas("receta_config"): self.cursor.execute("ALTER TABLE receta_config ADD COLUMN unidad_rendimiento_id INTEGER REFERENCES unidades(id)")
+        # Índice inverso subreceta -> recetas que la usan (propagación y control de ciclos)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_receta_ingredientes_subreceta ON receta_ingredientes(subreceta_id)")
+        # Los triggers ya no calculan: marcan la receta como pendiente y propagar_costos la recalcula antes del commit
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS costos_pendientes (receta_config_id INTEGER PRIMARY KEY)")
+        for t in ("trg_costo_ingrediente_insert", "trg_costo_ingrediente_update", "trg_costo_ingrediente_delete", "trg_costo_insumo_update"): self.cursor.execute(f"DROP TRIGGER IF EXISTS {t}")
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_pendiente_ingrediente_insert AFTER INSERT ON receta_ingredientes BEGIN
+            INSERT OR IGNORE INTO costos_pendientes (receta_config_id) VALUES (NEW.receta_config_id); END''')
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_pendiente_ingrediente_update AFTER UPDATE OF receta_config_id, insumo_id, subreceta_id, cantidad_necesaria ON receta_ingredientes BEGIN
+            INSERT OR IGNORE INTO costos_pendientes (receta_config_id) VALUES (OLD.receta_config_id);
+            INSERT OR IGNORE INTO costos_pendientes (receta_config_id) VALUES (NEW.receta_config_id); END''')
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_pendiente_ingrediente_delete AFTER DELETE ON receta_ingredientes BEGIN
+            INSERT OR IGNORE INTO costos_pendientes (receta_config_id) VALUES (OLD.receta_config_id); END''')
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_pendiente_insumo_update AFTER UPDATE OF costo_unitario ON insumos WHEN NEW.costo_unitario IS NOT OLD.costo_unitario BEGIN
+            INSERT OR IGNORE INTO costos_pendientes (receta_config_id) SELECT receta_config_id FROM receta_ingredientes WHERE insumo_id = NEW.id; END''')
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_pendiente_rendimiento AFTER UPDATE OF rendimiento ON receta_config WHEN NEW.rendimiento IS NOT OLD.rendimiento BEGIN
+            INSERT OR IGNORE INTO costos_pendientes (receta_config_id) VALUES (NEW.id); END''')
+        self.recalcular_costos()
+
+    def recalcular_costos(self):
+        # Reconstrucción completa (migración o verificación): todas las recetas quedan pendientes y se recalculan en orden
+        self.cursor.execute("DELETE FROM receta_costos")
+        self.cursor.execute("INSERT OR IGNORE INTO costos_pendientes (receta_config_id) SELECT id FROM receta_config")
+        self.propagar_costos(); self.conn.commit()
+
+    def propagar_costos(self):
+        # Recalcula las recetas pendientes y, hacia arriba, las que las usan como subreceta
+        c = self.conn.cursor()  # Cursor propio: no pisar lastrowid/rowcount de self.cursor
+        if not c.execute("SELECT 1 FROM costos_pendientes LIMIT 1").fetchone(): return
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS costos_afectados (id INTEGER PRIMARY KEY)"); c.execute("DELETE FROM temp.costos_afectados")
+        c.execute('''INSERT INTO temp.costos_afectados (id) WITH RECURSIVE afectadas(id) AS (
+            SELECT cp.receta_config_id FROM costos_pendientes cp JOIN receta_config rc ON rc.id = cp.receta_config_id
+            UNION SELECT ri.receta_config_id FROM receta_ingredientes ri JOIN afectadas a ON ri.subreceta_id = a.id)
+            SELECT id FROM afectadas''')
+        costo = COSTO_RECETA_SQL.format(rc="costos_nivel.id", precios="insumos", costos="receta_costos")
+        self.calcular_por_niveles("temp.costos_afectados", f"INSERT OR REPLACE INTO receta_costos (receta_config_id, costo) SELECT id, {costo} FROM temp.costos_nivel")
+        c.execute("DELETE FROM costos_pendientes")
+
+    def calcular_por_niveles(self, tabla, sentencia):
+        # Orden topológico por niveles de las recetas en tabla (columna id): cada nivel solo usa subrecetas de niveles anteriores,
+        # así cada receta se calcula una sola vez y lee el costo ya guardado (memo) de sus subrecetas.
+        # sentencia se ejecuta una vez por nivel con las recetas del nivel en temp.costos_nivel
+        c = self.conn.cursor(); c.execute("CREATE TEMP TABLE IF NOT EXISTS costos_nivel (id INTEGER PRIMARY KEY)")
+        faltan = {r[0]: 0 for r in c.execute(f"SELECT id FROM {tabla}")}; dependientes = {}
+        for rc_id, sub_id in c.execute(f'''SELECT DISTINCT ri.receta_config_id, ri.subreceta_id FROM receta_ingredientes ri
+                JOIN {tabla} a ON a.id = ri.receta_config_id JOIN {tabla} b ON b.id = ri.subreceta_id'''):
+            faltan[rc_id] += 1; dependientes.setdefault(sub_id, []).append(rc_id)
+        nivel = [r for r, n in faltan.items() if n == 0]; calculadas = 0
+        while nivel:
+            c.execute("DELETE FROM temp.costos_nivel"); c.executemany("INSERT INTO temp.costos_nivel (id) VALUES (?)", ((r,) for r in nivel)); c.execute(sentencia)
+            calculadas += len(nivel); siguiente = []
+            for r in nivel:
+                for d in dependientes.get(r, ()):
+                    faltan[d] -= 1
+                    if faltan[d] == 0: siguiente.append(d)
+            nivel = siguiente
+        if calculadas < len(faltan): raise sqlite3.IntegrityError("Ciclo entre subrecetas: una receta no puede contenerse a sí misma")
+
+    def crea_ciclo(self, receta_config_id, subreceta_id):
+        # True si receta_config_id ya forma parte (directa o indirectamente) de subreceta_id, o es la misma receta
+        return bool(self.traer_datos('''WITH RECURSIVE usadas(id) AS (SELECT ? UNION SELECT ri.subreceta_id FROM receta_ingredientes ri JOIN usadas u ON ri.receta_config_id = u.id WHERE ri.subreceta_id IS NOT NULL)
+            SELECT 1 FROM usadas WHERE id = ? LIMIT 1''', (subreceta_id, receta_config_id)))
+
+    def crear_historial_precios(self):
+        # Historial de precios de solo agregado: cada alta o cambio de costo de un insumo deja una fila con su fecha
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS insumo_precios (id INTEGER PRIMARY KEY, insumo_id INTEGER NOT NULL, fecha TEXT NOT NULL, costo_envase REAL, costo_unitario REAL,
+            FOREIGN KEY(insumo_id) REFERENCES insumos(id) ON DELETE CASCADE)''')
+        # Precio vigente a una fecha = última fila <= fecha: una búsqueda en este índice, sin recorrer el historial
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_insumo_precios_insumo_fecha ON insumo_precios(insumo_id, fecha)")
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_precio_insumo_insert AFTER INSERT ON insumos BEGIN
+            INSERT INTO insumo_precios (insumo_id, fecha, costo_envase, costo_unitario) VALUES (NEW.id, datetime('now', 'localtime'), NEW.costo_envase, NEW.costo_unitario); END''')
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS trg_precio_insumo_update AFTER UPDATE OF costo_envase, costo_unitario ON insumos
+            WHEN NEW.costo_envase IS NOT OLD.costo_envase OR NEW.costo_unitario IS NOT OLD.costo_unitario BEGIN
+            INSERT INTO insumo_precios (insumo_id, fecha, costo_envase, costo_unitario) VALUES (NEW.id, datetime('now', 'localtime'), NEW.costo_envase, NEW.costo_unitario); END''')
+        # El historial arranca con el precio actual de cada insumo
+        self.cursor.execute("INSERT INTO insumo_precios (insumo_id, fecha, costo_envase, costo_unitario) SELECT id, datetime('now', 'localtime'), costo_envase, costo_unitario FROM insumos WHERE NOT EXISTS (SELECT 1 FROM insumo_precios)")
+        self.conn.commit()
+
+    def crear_versiones_receta(self):
+        # Versión por producto (nombre, categoría, pasos) y por receta (sus ingredientes y lo que muestra de cada uno: nombre, unidad,
+        # costo); la suben los triggers, también ante commits de otras conexiones, y la usa CacheRecetas para invalidar solo lo que cambió
+        columnas = lambda tabla: {r[1] for r in self.cursor.execute(f"PRAGMA table_info({tabla})").fetchall()}
+        for tabla in ("productos", "receta_config"):
+            if "version" not in columnas(tabla): self.cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        sube_receta = "UPDATE receta_config SET version = version + 1 WHERE id IN"
+        # Recetas que usan como ingrediente una preparación que cumple la condición
+        sube_usuarias = lambda cond: f"{sube_receta} (SELECT ri.receta_config_id FROM receta_ingredientes ri JOIN receta_config s ON ri.subreceta_id = s.id WHERE {cond})"
+        triggers = {
+            # Al dar de alta, versión al azar: un id reutilizado no coincide con la versión en caché del registro borrado
+            "trg_version_producto_alta": "AFTER INSERT ON productos BEGIN UPDATE productos SET version = abs(random() % 1000000000000) WHERE id = NEW.id; END",
+            "trg_version_receta_alta": "AFTER INSERT ON receta_config BEGIN UPDATE receta_config SET version = abs(random() % 1000000000000) WHERE id = NEW.id; END",
+            "trg_version_producto": f"AFTER UPDATE OF nombre, categoria_id ON productos BEGIN UPDATE productos SET version = version + 1 WHERE id = NEW.id; {sube_usuarias('s.producto_id = NEW.id')}; END",
+            "trg_version_categoria": "AFTER UPDATE OF nombre ON categorias BEGIN UPDATE productos SET version = version + 1 WHERE categoria_id = NEW.id; END",
+            "trg_version_paso_insert": "AFTER INSERT ON receta_pasos BEGIN UPDATE productos SET version = version + 1 WHERE id = NEW.producto_id; END",
+            "trg_version_paso_update": "AFTER UPDATE ON receta_pasos BEGIN UPDATE productos SET version = version + 1 WHERE id IN (OLD.producto_id, NEW.producto_id); END",
+            "trg_version_paso_delete": "AFTER DELETE ON receta_pasos BEGIN UPDATE productos SET version = version + 1 WHERE id = OLD.producto_id; END",
+            "trg_version_ingrediente_insert": f"AFTER INSERT ON receta_ingredientes BEGIN {sube_receta} (NEW.receta_config_id); END",
+            "trg_version_ingrediente_update": f"AFTER UPDATE ON receta_ingredientes BEGIN {sube_receta} (OLD.receta_config_id, NEW.receta_config_id); END",
+            "trg_version_ingrediente_delete": f"AFTER DELETE ON receta_ingredientes BEGIN {sube_receta} (OLD.receta_config_id); END",
+            "trg_version_insumo": f"AFTER UPDATE OF nombre, unidad_uso_id, costo_unitario ON insumos BEGIN {sube_receta} (SELECT receta_config_id FROM receta_ingredientes WHERE insumo_id = NEW.id); END",
+            "trg_version_unidad": f"""AFTER UPDATE OF nombre ON unidades BEGIN
+                {sube_receta} (SELECT ri.receta_config_id FROM receta_ingredientes ri JOIN insumos i ON ri.insumo_id = i.id WHERE i.unidad_uso_id = NEW.id);
+                {sube_usuarias('s.unidad_rendimiento_id = NEW.id')}; END""",
+            "trg_version_tamano": f"AFTER UPDATE OF nombre ON tamanos BEGIN {sube_usuarias('s.tamano_id = NEW.id')}; END",
+            "trg_version_rendimiento": f"AFTER UPDATE OF rendimiento, unidad_rendimiento_id ON receta_config BEGIN {sube_usuarias('s.id = NEW.id')}; END",
+            # propagar_costos escribe con INSERT OR REPLACE: un costo recalculado cambia el costo por unidad que muestran las recetas que lo usan
+            "trg_version_costo_insert": f"AFTER INSERT ON receta_costos BEGIN {sube_usuarias('s.id = NEW.receta_config_id')}; END",
+            "trg_version_costo_update": f"AFTER UPDATE OF costo ON receta_costos BEGIN {sube_usuarias('s.id = NEW.receta_config_id')}; END",
+        }
+        for nombre, cuerpo in triggers.items(): self.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {nombre} {cuerpo}")
+        self.conn.commit()
+
+    def costo_receta(self, producto_id, tamano_id):
+        self.propagar_costos()  # Dentro de una transacción puede haber recetas pendientes
+        r = self.cursor.execute("SELECT rco.costo FROM receta_config rc JOIN receta_costos rco ON rco.receta_config_id = rc.id WHERE rc.producto_id = ? AND rc.tamano_id = ?", (producto_id, tamano_id)).fetchone()
+        return r[0] if r else 0.0
+
+    def crear_busqueda(self):
+        # Índices FTS5 de contenido externo, sincronizados por triggers; remove_diacritics ignora acentos
+        for tabla in TABLAS_BUSQUEDA:
+            fts = f"{tabla}_fts"
+            nueva = not self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name=?", (fts,)).fetchone()
+            self.cursor.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(nombre, content='{tabla}', content_rowid='id', tokenize="unicode61 remove_diacritics 2")''')
+            self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {tabla} BEGIN
+                INSERT INTO {fts} (rowid, nombre) VALUES (NEW.id, NEW.nombre); END''')
+            self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {tabla} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, nombre) VALUES ('delete', OLD.id, OLD.nombre); END''')
+            self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF nombre ON {tabla} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, nombre) VALUES ('delete', OLD.id, OLD.nombre);
+                INSERT INTO {fts} (rowid, nombre) VALUES (NEW.id, NEW.nombre); END''')
+            if nueva: self.cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_categoria ON productos(categoria_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_subcategoria ON productos(subcategoria_id)")
+        self.conn.commit()
+
+    @contextmanager
+    def transaccion(self):
+        # Unidad de trabajo: un solo commit al salir del bloque más externo, rollback si algo falla
+        self.nivel_transaccion += 1
+        try:
+            yield self
+        except BaseException:
+            self.nivel_transaccion -= 1
+            if self.nivel_transaccion == 0: self.conn.rollback(); self.notificar_cambios(revertidos=True)
+            raise
+        self.nivel_transaccion -= 1
+        if self.nivel_transaccion == 0:
+            try: self.confirmar()
+            except BaseException: self.conn.rollback(); self.notificar_cambios(revertidos=True); raise
+            self.notificar_cambios()
+
+    def activar_instrumentacion(self, umbral_ms=50, ruta_log=None):
+        # Opcional: latencias por sentencia, tiempo de commit y log de consultas lentas con su plan
+        self.instrumentacion = Instrumentacion(self.conn, umbral_ms, ruta_log)
+        return self.instrumentacion
+
+    def confirmar(self):
+        self.propagar_costos()
+        if self.instrumentacion is None: return self.conn.commit()
+        t = time.perf_counter(); self.conn.commit(); self.instrumentacion.registrar_commit((time.perf_counter() - t) * 1000)
+
+    def medir(self, ejecutar, query, params, filas_de):
+        # Ejecuta y registra la latencia; filas_de(resultado) da la cantidad de filas leídas o modificadas
+        if self.instrumentacion is None: return ejecutar()
+        t = time.perf_counter()
+        try: resultado = ejecutar()
+        except sqlite3.Error as e: self.instrumentacion.registrar_error(self.contexto, query, e); raise
+        self.instrumentacion.registrar(self.contexto, query, params, (time.perf_counter() - t) * 1000, filas_de(resultado), self.conn)
+        return resultado
+
+    def abrir_cursor(self, query, params=()):
+        # Cursor propio para recorrer resultados grandes por partes (modelos perezosos, exportación)
+        return self.medir(lambda: self.conn.execute(query, params), query, params, lambda c: -1)
+
+    def suscribir(self, callback):
+        # callback(tablas) se llama después de cada commit con el conjunto de tablas modificadas
+        self.suscriptores.append(callback)
+
+    def version(self, *tablas):
+        return tuple(self.versiones.get(t, 0) for t in tablas)
+
+    def version_externa(self):
+        # Cambia cuando otra conexión (otra terminal, un importador) hace commit sobre el mismo archivo
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def registrar_cambio(self, query):
+        m = PATRON_ESCRITURA.match(query)
+        if not m: return
+        tabla = m.group(1).lower()
+        for t in (tabla,) + CASCADAS.get(tabla, ()):
+            self.versiones[t] = self.versiones.get(t, 0) + 1; self.tablas_modificadas.add(t)
+
+    def notificar_cambios(self, revertidos=False):
+        tablas = self.tablas_modificadas; self.tablas_modificadas = set()
+        if revertidos:  # Lo leído durante la transacción ya no vale
+            for t in tablas: self.versiones[t] = self.versiones.get(t, 0) + 1
+        if tablas:
+            for callback in self.suscriptores: callback(tablas)
+
+    def ejecutar(self, query, params=()):
+        try:
+            self.medir(lambda: self.cursor.execute(query, params), query, params, lambda c: c.rowcount); self.registrar_cambio(query)
+            if not self.nivel_transaccion: self.confirmar(); self.notificar_cambios()
+            return self.cursor
+        except sqlite3.Error as e:
+            if self.nivel_transaccion: raise  # Dentro de una transacción el error la aborta completa
+            self.conn.rollback()  # La sentencia pudo aplicarse y fallar recién al propagar costos
+            print(f"Error BD: {e}")
+            return None
+
+    def ejecutar_lote(self, query, filas):
+        try:
+            if self.instrumentacion is not None and not isinstance(filas, list): filas = list(filas)
+            ejemplo = filas[0] if self.instrumentacion is not None and filas else ()
+            self.medir(lambda: self.cursor.executemany(query, filas), query, ejemplo, lambda c: c.rowcount); self.registrar_cambio(query)
+            if not self.nivel_transaccion: self.confirmar(); self.notificar_cambios()
+            return self.cursor
+        except sqlite3.Error as e:
+            if self.nivel_transaccion: raise
+            self.conn.rollback()
+            print(f"Error BD: {e}")
+            return None
+
+    def guardar_pasos(self, producto_id, pasos):
+        with self.transaccion():
+            self.ejecutar("DELETE FROM receta_pasos WHERE producto_id=?", (producto_id,))
+            self.ejecutar_lote("INSERT INTO receta_pasos (producto_id, orden, descripcion) VALUES (?,?,?)", [(producto_id, i+1, p) for i, p in enumerate(pasos)])
+
+    def clonar_receta(self, producto_id, desde_tamano_id, hasta_tamano_id, multiplicador=1.0):
+        return self.clonar_recetas(desde_tamano_id, {hasta_tamano_id: multiplicador}, productos=[producto_id], reemplazar=True)
+
+    def clonar_recetas(self, desde_tamano_id, tamanos, multiplicador=1.0, ajustes=None, productos=None, categoria_id=None, subcategoria_id=None, reemplazar=False, simular=False):
+        # Clona y escala la receta de un tamaño hacia varios tamaños en todos los productos del alcance, con INSERT ... SELECT en una transacción.
+        # tamanos: ids destino (todos con multiplicador) o {tamano_id: multiplicador}; ajustes: {insumo_id: multiplicador} que reemplaza al del tamaño.
+        # Sin reemplazar se saltean las recetas destino que ya tienen ingredientes; con simular se calcula todo y se deshace.
+        # Devuelve [(producto_id, producto, tamano_id, tamano, costo_antes, costo_nuevo)] por receta escrita (costo_antes None si no existía)
+        if simular and self.nivel_transaccion: raise ValueError("La simulación tiene que ser la transacción más externa")
+        tamanos = dict(tamanos) if isinstance(tamanos, dict) else {t: multiplicador for t in tamanos}; tamanos.pop(desde_tamano_id, None); ajustes = ajustes or {}
+        if any(m is None or m <= 0 for m in list(tamanos.values()) + list(ajustes.values())): raise ValueError("Los multiplicadores deben ser mayores a 0")
+        alcance = '''FROM productos p JOIN receta_config rc ON rc.producto_id = p.id AND rc.tamano_id = :desde
+            WHERE EXISTS (SELECT 1 FROM receta_ingredientes ri WHERE ri.receta_config_id = rc.id) AND (:cat IS NULL OR p.categoria_id = :cat) AND (:sub IS NULL OR p.subcategoria_id = :sub)'''
+        params = {"desde": desde_tamano_id, "cat": categoria_id, "sub": subcategoria_id}
+        try:
+            with self.transaccion():
+                self.ejecutar("CREATE TEMP TABLE IF NOT EXISTS clonado_productos (id INTEGER PRIMARY KEY)")
+                self.ejecutar("CREATE TEMP TABLE IF NOT EXISTS clonado_tamanos (id INTEGER PRIMARY KEY, multiplicador REAL)")
+                self.ejecutar("CREATE TEMP TABLE IF NOT EXISTS clonado_ajustes (insumo_id INTEGER PRIMARY KEY, multiplicador REAL)")
+                self.ejecutar("CREATE TEMP TABLE IF NOT EXISTS clonado_destinos (producto_id INTEGER, tamano_id INTEGER, multiplicador REAL, costo_antes REAL, PRIMARY KEY (producto_id, tamano_id))")
+                for t in ("clonado_productos", "clonado_tamanos", "clonado_ajustes", "clonado_destinos"): self.ejecutar(f"DELETE FROM temp.{t}")
+                # Productos del alcance con receta en el tamaño origen
+                if productos is None: self.ejecutar(f"INSERT INTO temp.clonado_productos (id) SELECT p.id {alcance}", params)
+                else: self.ejecutar_lote(f"INSERT OR IGNORE INTO temp.clonado_productos (id) SELECT p.id {alcance} AND p.id = :p", [dict(params, p=p) for p in productos])
+                self.ejecutar_lote("INSERT INTO temp.clonado_tamanos (id, multiplicador) VALUES (?,?)", list(tamanos.items()))
+                self.ejecutar_lote("INSERT INTO temp.clonado_ajustes (insumo_id, multiplicador) VALUES (?,?)", list(ajustes.items()))
+                self.ejecutar('''INSERT INTO temp.clonado_destinos (producto_id, tamano_id, multiplicador, costo_antes)
+                    SELECT p.id, t.id, t.multiplicador, rco.costo FROM temp.clonado_productos p CROSS JOIN temp.clonado_tamanos t
+                    LEFT JOIN receta_config dst ON dst.producto_id = p.id AND dst.tamano_id = t.id LEFT JOIN receta_costos rco ON rco.receta_config_id = dst.id
+                    WHERE :reemplazar OR NOT EXISTS (SELECT 1 FROM receta_ingredientes ri WHERE ri.receta_config_id = dst.id)''', {"reemplazar": int(reemplazar)})
+                if reemplazar: self.ejecutar("DELETE FROM receta_ingredientes WHERE receta_config_id IN (SELECT rc.id FROM temp.clonado_destinos d JOIN receta_config rc ON rc.producto_id = d.producto_id AND rc.tamano_id = d.tamano_id)")
+                # Una preparación clonada rinde en proporción, también si el destino ya existía; sin rendimiento en el origen se deja el del destino.
+                # INSERT OR IGNORE + UPDATE en vez de un upsert: con ON CONFLICT afuera, el INSERT OR IGNORE de los triggers de pendientes aborta
+                self.ejecutar('''INSERT OR IGNORE INTO receta_config (producto_id, tamano_id, rendimiento, unidad_rendimiento_id)
+                    SELECT d.producto_id, d.tamano_id, src.rendimiento * d.multiplicador, src.unidad_rendimiento_id FROM temp.clonado_destinos d
+                    JOIN receta_config src ON src.producto_id = d.producto_id AND src.tamano_id = ?''', (desde_tamano_id,))
+                self.ejecutar('''UPDATE receta_config AS dst SET rendimiento = src.rendimiento * d.multiplicador, unidad_rendimiento_id = src.unidad_rendimiento_id
+                    FROM temp.clonado_destinos d JOIN receta_config src ON src.producto_id = d.producto_id AND src.tamano_id = ?
+                    WHERE dst.producto_id = d.producto_id AND dst.tamano_id = d.tamano_id AND src.rendimiento > 0''', (desde_tamano_id,))
+                self.ejecutar('''INSERT INTO receta_ingredientes (receta_config_id, insumo_id, subreceta_id, cantidad_necesaria)
+                    SELECT dst.id, ri.insumo_id, ri.subreceta_id, ri.cantidad_necesaria * COALESCE(a.multiplicador, d.multiplicador)
+                    FROM temp.clonado_destinos d
+                    JOIN receta_config src ON src.producto_id = d.producto_id AND src.tamano_id = ?
+                    JOIN receta_ingredientes ri ON ri.receta_config_id = src.id
+                    JOIN receta_config dst ON dst.producto_id = d.producto_id AND dst.tamano_id = d.tamano_id
+                    LEFT JOIN temp.clonado_ajustes a ON a.insumo_id = ri.insumo_id
+                    ORDER BY dst.id, ri.id''', (desde_tamano_id,))
+                self.propagar_costos()
+                resultado = self.traer_datos('''SELECT d.producto_id, p.nombre, d.tamano_id, t.nombre, d.costo_antes, COALESCE(rco.costo, 0) FROM temp.clonado_destinos d
+                    JOIN productos p ON p.id = d.producto_id JOIN tamanos t ON t.id = d.tamano_id
+                    JOIN receta_config rc ON rc.producto_id = d.producto_id AND rc.tamano_id = d.tamano_id LEFT JOIN receta_costos rco ON rco.receta_config_id = rc.id
+                    ORDER BY p.nombre, t.id''')
+                if simular: raise SimulacionClonado()
+        except SimulacionClonado: pass
+        return resultado
+
+    def traer_datos(self, query, params=()):
+        if self.instrumentacion is None: return self.cursor.execute(query, params).fetchall()
+        return self.medir(lambda: self.cursor.execute(query, params).fetchall(), query, params, len)
+
+    def buscar_insumos(self, texto):
+        expr = expresion_busqueda(texto)
+        if expr is None: return self.traer_datos("SELECT i.id, i.nombre, u.nombre FROM insumos i JOIN unidades u ON i.unidad_uso_id = u.id")
+        query = "SELECT i.id, i.nombre, u.nombre FROM insumos_fts f JOIN insumos i ON i.id = f.rowid JOIN unidades u ON i.unidad_uso_id = u.id WHERE insumos_fts MATCH ? ORDER BY f.rank"
+        return self.traer_datos(query, (expr,))
+
+    def buscar_productos(self, texto):
+        return self.traer_datos(*consulta_productos(texto))
+
+    def buscar_subrecetas(self, texto):
+        # Recetas con rendimiento definido (las que se pueden usar como ingrediente), filtradas por nombre de producto
+        query = "SELECT rc.id, p.nombre || ' (' || t.nombre || ')', COALESCE(u.nombre, 'u.') FROM receta_config rc JOIN productos p ON rc.producto_id = p.id JOIN tamanos t ON rc.tamano_id = t.id LEFT JOIN unidades u ON rc.unidad_rendimiento_id = u.id WHERE rc.rendimiento > 0"
+        expr = expresion_busqueda(texto)
+        if expr is None: return self.traer_datos(query + " ORDER BY p.nombre, t.id")
+        return self.traer_datos(query + " AND rc.producto_id IN (SELECT rowid FROM productos_fts WHERE productos_fts MATCH ?) ORDER BY p.nombre, t.id", (expr,))
+
+    def ingredientes_receta(self, producto_id, tamano_id):
+        # (id, insumo_id, subreceta_id, nombre, cantidad, unidad, costo por unidad)
+        return self.traer_datos(CONSULTA_INGREDIENTES, (producto_id, tamano_id))
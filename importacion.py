@@ -0,0 +1,192 @@
+import sys
+import csv
+import json
+import math
+import sqlite3
+import argparse
+from itertools import islice
+from database import DataBase
+from costeo import calcular_costo_insumo
+
+LOTE = 1000
+
+# Columnas de cada entidad; son las mismas para importar y exportar (CSV con encabezado o JSON Lines)
+COLUMNAS = {
+    "insumos": ["nombre", "costo_envase", "cantidad_envase", "unidad_compra", "unidad_uso", "factor_conversion"],
+    "productos": ["nombre", "categoria", "subcategoria"],
+    "pasos": ["producto", "orden", "descripcion"],
+    "recetas": ["producto", "tamano", "rendimiento", "unidad_rendimiento"],
+    # Cada línea lleva un insumo o una subreceta (producto y tamaño de la preparación)
+    "ingredientes": ["producto", "tamano", "insumo", "cantidad", "subreceta", "subreceta_tamano"],
+}
+
+CONSULTAS_EXPORTAR = {
+    "insumos": "SELECT i.nombre, i.costo_envase, i.cantidad_envase, uc.nombre, uu.nombre, i.factor_conversion FROM insumos i LEFT JOIN unidades uc ON i.unidad_compra_id = uc.id LEFT JOIN unidades uu ON i.unidad_uso_id = uu.id ORDER BY i.id",
+    "productos": "SELECT p.nombre, c.nombre, s.nombre FROM productos p LEFT JOIN categorias c ON p.categoria_id = c.id LEFT JOIN subcategorias s ON p.subcategoria_id = s.id ORDER BY p.id",
+    "pasos": "SELECT p.nombre, rp.orden, rp.descripcion FROM receta_pasos rp JOIN productos p ON rp.producto_id = p.id ORDER BY p.id, rp.orden",
+    "recetas": "SELECT p.nombre, t.nombre, rc.rendimiento, u.nombre FROM receta_config rc JOIN productos p ON rc.producto_id = p.id JOIN tamanos t ON rc.tamano_id = t.id LEFT JOIN unidades u ON rc.unidad_rendimiento_id = u.id ORDER BY p.id, t.id",
+    # Una línea por receta e ingrediente (la clave del upsert al importar): si un insumo aparece dos veces en la receta se suman las cantidades
+    "ingredientes": """SELECT p.nombre, t.nombre, i.nombre, SUM(ri.cantidad_necesaria), sp.nombre, st.nombre FROM receta_ingredientes ri JOIN receta_config rc ON ri.receta_config_id = rc.id
+        JOIN productos p ON rc.producto_id = p.id JOIN tamanos t ON rc.tamano_id = t.id LEFT JOIN insumos i ON ri.insumo_id = i.id
+        LEFT JOIN receta_config sr ON ri.subreceta_id = sr.id LEFT JOIN productos sp ON sr.producto_id = sp.id LEFT JOIN tamanos st ON sr.tamano_id = st.id
+        GROUP BY rc.id, ri.insumo_id, ri.subreceta_id ORDER BY p.id, t.id, MIN(ri.id)""",
+}
+
+ID_PRODUCTO = "(SELECT id FROM productos WHERE nombre = :producto)"
+ID_TAMANO = "(SELECT id FROM tamanos WHERE nombre = :tamano)"
+ID_CATEGORIA = "(SELECT id FROM categorias WHERE nombre = :categoria)"
+ID_SUBCATEGORIA = f"(SELECT id FROM subcategorias WHERE nombre = :subcategoria AND categoria_id IS {ID_CATEGORIA})"
+ID_INSUMO = "(SELECT id FROM insumos WHERE nombre = :insumo)"
+ID_SUBRECETA = "(SELECT id FROM receta_config WHERE producto_id = (SELECT id FROM productos WHERE nombre = :subreceta) AND tamano_id = (SELECT id FROM tamanos WHERE nombre = :subreceta_tamano))"
+
+def es_jsonl(ruta):
+    return ruta.lower().endswith((".jsonl", ".ndjson"))
+
+def leer_filas(ruta):
+    # Generador: nunca se carga el archivo completo en memoria
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        if es_jsonl(ruta):
+            for linea in f:
+                if linea.strip(): yield json.loads(linea)
+        else: yield from csv.DictReader(f)
+
+def texto(fila, campo):
+    valor = fila.get(campo)
+    if valor is None: return None
+    return str(valor).strip() or None
+
+def asegurar_nombres(db, tabla, nombres):
+    db.ejecutar_lote(f"INSERT INTO {tabla} (nombre) SELECT :n WHERE NOT EXISTS (SELECT 1 FROM {tabla} WHERE nombre = :n)", [{"n": n} for n in nombres if n])
+
+def lote_insumos(db, filas):
+    datos = {}; omitidas = 0
+    for f in filas:
+        try:
+            nombre = texto(f, "nombre"); uc = texto(f, "unidad_compra"); uu = texto(f, "unidad_uso")
+            c_e = float(f["costo_envase"]); cant_e = float(f["cantidad_envase"]); factor = float(f.get("factor_conversion") or 1) if uc != uu else 1.0
+        except (KeyError, TypeError, ValueError): omitidas += 1; continue
+        r_r, c_u = calcular_costo_insumo(cant_e, c_e, factor)
+        if not nombre or not uc or not uu or r_r == 0: omitidas += 1; continue
+        datos[nombre] = {"nombre": nombre, "uc": uc, "uu": uu, "cant": cant_e, "costo": c_e, "factor": factor, "rend": r_r, "cu": c_u}
+    asegurar_nombres(db, "unidades", {d["uc"] for d in datos.values()} | {d["uu"] for d in datos.values()})
+    valores = list(datos.values())
+    actualizadas = db.ejecutar_lote("""UPDATE insumos SET unidad_compra_id = (SELECT id FROM unidades WHERE nombre = :uc), unidad_uso_id = (SELECT id FROM unidades WHERE nombre = :uu),
+        cantidad_envase = :cant, costo_envase = :costo, factor_conversion = :factor, rendimiento_total = :rend, costo_unitario = :cu WHERE nombre = :nombre""", valores).rowcount
+    insertadas = db.ejecutar_lote("""INSERT INTO insumos (nombre, unidad_compra_id, unidad_uso_id, cantidad_envase, costo_envase, factor_conversion, rendimiento_total, costo_unitario)
+        SELECT :nombre, (SELECT id FROM unidades WHERE nombre = :uc), (SELECT id FROM unidades WHERE nombre = :uu), :cant, :costo, :factor, :rend, :cu
+        WHERE NOT EXISTS (SELECT 1 FROM insumos WHERE nombre = :nombre)""", valores).rowcount
+    return actualizadas, insertadas, omitidas, []
+
+def lote_productos(db, filas):
+    datos = {}; omitidas = 0
+    for f in filas:
+        nombre = texto(f, "nombre")
+        if not nombre: omitidas += 1; continue
+        cat = texto(f, "categoria"); datos[nombre] = {"nombre": nombre, "categoria": cat, "subcategoria": texto(f, "subcategoria") if cat else None}
+    valores = list(datos.values())
+    asegurar_nombres(db, "categorias", {d["categoria"] for d in valores})
+    db.ejecutar_lote(f"INSERT INTO subcategorias (nombre, categoria_id) SELECT :subcategoria, {ID_CATEGORIA} WHERE NOT EXISTS {ID_SUBCATEGORIA}", [d for d in valores if d["subcategoria"]])
+    actualizadas = db.ejecutar_lote(f"UPDATE productos SET categoria_id = {ID_CATEGORIA}, subcategoria_id = {ID_SUBCATEGORIA} WHERE nombre = :nombre", valores).rowcount
+    insertadas = db.ejecutar_lote(f"INSERT INTO productos (nombre, categoria_id, subcategoria_id) SELECT :nombre, {ID_CATEGORIA}, {ID_SUBCATEGORIA} WHERE NOT EXISTS (SELECT 1 FROM productos WHERE nombre = :nombre)", valores).rowcount
+    return actualizadas, insertadas, omitidas, []
+
+def lote_pasos(db, filas):
+    datos = {}; omitidas = 0
+    for f in filas:
+        try: prod = texto(f, "producto"); orden = int(f["orden"]); desc = texto(f, "descripcion")
+        except (KeyError, TypeError, ValueError): omitidas += 1; continue
+        if not prod or not desc: omitidas += 1; continue
+        datos[(prod, orden)] = {"producto": prod, "orden": orden, "descripcion": desc}
+    valores = list(datos.values())
+    actualizadas = db.ejecutar_lote(f"UPDATE receta_pasos SET descripcion = :descripcion WHERE producto_id = {ID_PRODUCTO} AND orden = :orden", valores).rowcount
+    insertadas = db.ejecutar_lote(f"""INSERT INTO receta_pasos (producto_id, orden, descripcion) SELECT p.id, :orden, :descripcion FROM productos p
+        WHERE p.id = {ID_PRODUCTO} AND NOT EXISTS (SELECT 1 FROM receta_pasos WHERE producto_id = p.id AND orden = :orden)""", valores).rowcount
+    return actualizadas, insertadas, omitidas + len(valores) - actualizadas - insertadas, []
+
+def lote_recetas(db, filas):
+    # Rendimiento y unidad de cada receta producto x tamaño (vacío: no es preparación); la receta se crea si no existe.
+    # Mismas reglas que guardar_rendimiento: el rendimiento debe ser mayor a 0 y no se le puede quitar a una preparación que otra receta usa
+    datos = {}; omitidas = 0; errores = []
+    for f in filas:
+        prod = texto(f, "producto"); tam = texto(f, "tamano"); rend = texto(f, "rendimiento")
+        try: rend = float(rend) if rend else None
+        except ValueError: omitidas += 1; continue
+        if not prod or not tam: omitidas += 1; continue
+        if rend is not None and not (math.isfinite(rend) and rend > 0): errores.append(f"{prod} ({tam}): el rendimiento debe ser mayor a 0"); datos.pop((prod, tam), None); continue
+        datos[(prod, tam)] = {"producto": prod, "tamano": tam, "rendimiento": rend, "unidad": texto(f, "unidad_rendimiento")}
+    usada = f"SELECT 1 FROM receta_ingredientes ri JOIN receta_config rc ON ri.subreceta_id = rc.id WHERE rc.producto_id = {ID_PRODUCTO} AND rc.tamano_id = {ID_TAMANO} LIMIT 1"
+    for clave, d in list(datos.items()):
+        if d["rendimiento"] is None and db.traer_datos(usada, d): errores.append(f"{clave[0]} ({clave[1]}): sin rendimiento, pero se usa como preparación en otras recetas"); del datos[clave]
+    valores = list(datos.values())
+    asegurar_nombres(db, "tamanos", {d["tamano"] for d in valores}); asegurar_nombres(db, "unidades", {d["unidad"] for d in valores})
+    insertadas = db.ejecutar_lote(f"INSERT OR IGNORE INTO receta_config (producto_id, tamano_id) SELECT {ID_PRODUCTO}, {ID_TAMANO} WHERE {ID_PRODUCTO} IS NOT NULL", valores).rowcount
+    actualizadas = db.ejecutar_lote(f"""UPDATE receta_config SET rendimiento = :rendimiento, unidad_rendimiento_id = (SELECT id FROM unidades WHERE nombre = :unidad)
+        WHERE producto_id = {ID_PRODUCTO} AND tamano_id = {ID_TAMANO}""", valores).rowcount
+    return actualizadas - insertadas, insertadas, omitidas + len(valores) - actualizadas, errores
+
+def lote_ingredientes(db, filas):
+    # La subreceta tiene que existir y tener rendimiento (se importa antes con recetas): sin él su costo por unidad no existe
+    datos = {}; omitidas = 0; errores = []
+    for f in filas:
+        try: prod = texto(f, "producto"); tam = texto(f, "tamano"); ins = texto(f, "insumo"); sub = texto(f, "subreceta"); sub_t = texto(f, "subreceta_tamano"); cant = float(f["cantidad"])
+        except (KeyError, TypeError, ValueError): omitidas += 1; continue
+        if not prod or not tam or bool(ins) == bool(sub) or (sub and not sub_t): omitidas += 1; continue
+        datos[(prod, tam, ins, sub, sub_t)] = {"producto": prod, "tamano": tam, "insumo": ins, "subreceta": sub, "subreceta_tamano": sub_t, "cantidad": cant}
+    for clave, d in list(datos.items()):
+        if d["subreceta"] and not db.traer_datos(f"SELECT 1 FROM receta_config WHERE id = {ID_SUBRECETA} AND rendimiento > 0", d):
+            errores.append(f"{d['producto']} ({d['tamano']}): la subreceta {d['subreceta']} ({d['subreceta_tamano']}) no existe o no tiene rendimiento"); del datos[clave]
+    valores = list(datos.values())
+    asegurar_nombres(db, "tamanos", {d["tamano"] for d in valores})
+    db.ejecutar_lote(f"INSERT OR IGNORE INTO receta_config (producto_id, tamano_id) SELECT {ID_PRODUCTO}, {ID_TAMANO} WHERE {ID_PRODUCTO} IS NOT NULL",
+                     [{"producto": p, "tamano": t} for p, t in {(d["producto"], d["tamano"]) for d in valores}])
+    config = f"(SELECT id FROM receta_config WHERE producto_id = {ID_PRODUCTO} AND tamano_id = {ID_TAMANO})"
+    # Una línea es de insumo o de subreceta: la otra referencia queda en NULL (IS compara también los NULL). El + deja afuera los índices
+    # de insumo_id/subreceta_id: con IS NULL recorrerían todas las líneas de insumo; se busca por receta_config_id
+    actualizadas = db.ejecutar_lote(f"UPDATE receta_ingredientes SET cantidad_necesaria = :cantidad WHERE receta_config_id = {config} AND +insumo_id IS {ID_INSUMO} AND +subreceta_id IS {ID_SUBRECETA}", valores).rowcount
+    insertadas = db.ejecutar_lote(f"""INSERT INTO receta_ingredientes (receta_config_id, insumo_id, subreceta_id, cantidad_necesaria) SELECT rc.id, {ID_INSUMO}, {ID_SUBRECETA}, :cantidad FROM receta_config rc
+        WHERE rc.id = {config} AND ({ID_INSUMO} IS NULL) <> ({ID_SUBRECETA} IS NULL)
+        AND NOT EXISTS (SELECT 1 FROM receta_ingredientes WHERE receta_config_id = rc.id AND +insumo_id IS {ID_INSUMO} AND +subreceta_id IS {ID_SUBRECETA})""", valores).rowcount
+    return actualizadas, insertadas, omitidas + len(valores) - actualizadas - insertadas, errores
+
+IMPORTADORES = {"insumos": lote_insumos, "productos": lote_productos, "pasos": lote_pasos, "recetas": lote_recetas, "ingredientes": lote_ingredientes}
+
+def importar(db, entidad, ruta, lote=LOTE):
+    # Upsert por nombre, por lotes: cada lote es una transacción con executemany.
+    # omitidas: filas mal formadas; errores: mensajes de las filas bien formadas que se rechazaron por dejar el catálogo inconsistente
+    procesar = IMPORTADORES[entidad]; filas = leer_filas(ruta); total = {"actualizadas": 0, "insertadas": 0, "omitidas": 0, "errores": []}
+    while True:
+        bloque = list(islice(filas, lote))
+        if not bloque: return total
+        with db.transaccion(): a, i, o, e = procesar(db, bloque)
+        total["actualizadas"] += a; total["insertadas"] += i; total["omitidas"] += o; total["errores"] += e
+
+def exportar(db, entidad, ruta):
+    columnas = COLUMNAS[entidad]; n = 0
+    with open(ruta, "w", newline="", encoding="utf-8") as f:
+        w = None if es_jsonl(ruta) else csv.writer(f)
+        if w: w.writerow(columnas)
+        for fila in db.abrir_cursor(CONSULTAS_EXPORTAR[entidad]):
+            if w: w.writerow(fila)
+            else: f.write(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importación y exportación masiva (CSV o JSON Lines).", epilog="Para importar un catálogo completo: insumos, productos, pasos, recetas e ingredientes, en ese orden.")
+    parser.add_argument("accion", choices=["importar", "exportar"])
+    parser.add_argument("entidad", choices=list(COLUMNAS))
+    parser.add_argument("archivo")
+    parser.add_argument("--bd", default="db_recetario.db", help="Ruta a la base de datos")
+    parser.add_argument("--lote", type=int, default=LOTE, help="Filas por transacción al importar")
+    args = parser.parse_args(argv)
+    db = DataBase(args.bd)
+    if args.accion == "importar":
+        try: r = importar(db, args.entidad, args.archivo, args.lote)
+        except sqlite3.IntegrityError as e: raise SystemExit(f"{args.entidad}: lote rechazado, sin cambios en ese lote ({e}).")
+        for e in r["errores"]: print(f"Error: {e}", file=sys.stderr)
+        print(f"{args.entidad}: {r['insertadas']} nuevos, {r['actualizadas']} actualizados, {r['omitidas']} filas omitidas, {len(r['errores'])} con error.")
+        if r["errores"]: return 1
+    else: print(f"{args.entidad}: {exportar(db, args.entidad, args.archivo)} filas exportadas.")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import re
+import json
+import time
+import bisect
+import threading
+
+# Límites superiores (ms) de los cubos del histograma de latencias
+CUBOS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+PATRON_TEXTO = re.compile(r"'(?:[^']|'')*'")
+PATRON_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+PATRON_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+PATRON_ESPACIOS = re.compile(r"\s+")
+
+def normalizar_sql(sql):
+    # Misma clave para sentencias que solo difieren en literales o espacios
+    sql = PATRON_TEXTO.sub("?", sql); sql = PATRON_NUMERO.sub("?", sql); sql = PATRON_LISTA.sub("(?, ...)", sql)
+    return PATRON_ESPACIOS.sub(" ", sql).strip()
+
+class Estadistica:
+    def __init__(self):
+        self.llamadas = 0; self.total_ms = 0.0; self.max_ms = 0.0; self.filas = 0; self.errores = 0; self.histograma = [0] * (len(CUBOS_MS) + 1)
+
+    def agregar(self, ms, filas):
+        self.llamadas += 1; self.total_ms += ms; self.max_ms = max(self.max_ms, ms); self.filas += max(filas, 0)
+        self.histograma[bisect.bisect_left(CUBOS_MS, ms)] += 1
+
+    def a_dict(self):
+        return {"llamadas": self.llamadas, "total_ms": round(self.total_ms, 3), "media_ms": round(self.total_ms / self.llamadas, 3) if self.llamadas else 0,
+                "max_ms": round(self.max_ms, 3), "filas": self.filas, "errores": self.errores,
+                "histograma": {(f"<={c}ms" if i < len(CUBOS_MS) else f">{CUBOS_MS[-1]}ms"): n for i, (c, n) in enumerate(zip(CUBOS_MS + (None,), self.histograma)) if n}}
+
+class Instrumentacion:
+    # Estadísticas por (contexto, SQL normalizado); el contexto lo fija la app (p. ej. la pestaña activa). La pueden compartir conexiones
+    # de otros hilos (el buscador del visor): cada una pasa la suya para el plan, y el candado protege los contadores
+    def __init__(self, conn, umbral_ms=50, ruta_log=None):
+        self.conn = conn; self.umbral_ms = umbral_ms; self.ruta_log = ruta_log; self.candado = threading.Lock()
+        self.consultas = {}; self.commits = Estadistica(); self.planes = {}; self.lentas = 0; self.inicio = time.time()
+
+    def estadistica(self, contexto, sql):
+        clave = (contexto, normalizar_sql(sql)); e = self.consultas.get(clave)
+        if e is None: e = self.consultas[clave] = Estadistica()
+        return clave[1], e
+
+    def registrar(self, contexto, sql, params, ms, filas, conn=None):
+        with self.candado:
+            norm, e = self.estadistica(contexto, sql); e.agregar(ms, filas)
+            if ms >= self.umbral_ms: self.lentas += 1
+        if ms >= self.umbral_ms: self.registrar_lenta(contexto, norm, sql, params, ms, conn)
+
+    def registrar_error(self, contexto, sql, error):
+        with self.candado: self.estadistica(contexto, sql)[1].errores += 1
+
+    def registrar_commit(self, ms):
+        with self.candado: self.commits.agregar(ms, 0)
+
+    def plan(self, sql, params, conn=None):
+        # Se obtiene una sola vez por sentencia normalizada, con la conexión que la ejecutó (una conexión sqlite3 no se usa desde otro hilo)
+        norm = normalizar_sql(sql)
+        if norm not in self.planes:
+            try: self.planes[norm] = [r[3] for r in (conn or self.conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+            except Exception as e: self.planes[norm] = [f"(sin plan: {e})"]
+        return self.planes[norm]
+
+    def registrar_lenta(self, contexto, norm, sql, params, ms, conn=None):
+        if not self.ruta_log: return
+        entrada = {"fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), "contexto": contexto, "ms": round(ms, 3), "sql": norm, "plan": self.plan(sql, params, conn)}
+        with self.candado, open(self.ruta_log, "a", encoding="utf-8") as f: f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+
+    def volcar(self):
+        with self.candado: consultas = [dict(contexto=c, sql=s, **e.a_dict()) for (c, s), e in self.consultas.items()]; commits = self.commits.a_dict()
+        consultas.sort(key=lambda r: r["total_ms"], reverse=True)
+        return {"desde": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.inicio)), "umbral_ms": self.umbral_ms, "lentas": self.lentas,
+                "commits": commits, "consultas": consultas}
+
+    def exportar(self, ruta):
+        with open(ruta, "w", encoding="utf-8") as f: json.dump(self.volcar(), f, indent=2, ensure_ascii=False)
+
+    def reporte(self, top=15):
+        datos = self.volcar(); c = datos["commits"]
+        lineas = [f"Consultas lentas (>= {self.umbral_ms} ms): {self.lentas} | Commits: {c['llamadas']} ({c['total_ms']} ms)"]
+        for r in datos["consultas"][:top]:
+            lineas.append(f"  {r['total_ms']:10.1f} ms {r['llamadas']:7d}x  max {r['max_ms']:8.1f}  [{r['contexto'] or '-'}] {r['sql'][:100]}")
+        return "\n".join(lineas)
+
+    def reiniciar(self):
+        with self.candado: self.consultas.clear(); self.commits = Estadistica(); self.lentas = 0; self.inicio = time.time()
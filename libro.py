@@ -0,0 +1,202 @@
+import os
+import sys
+import html
+import time
+import argparse
+import re
+import tempfile
+from collections import deque
+from itertools import groupby, islice
+from concurrent.futures import ProcessPoolExecutor
+from database import DataBase, expresion_busqueda
+from recetario import renderizar_receta
+
+# Todo el libro en una sola consulta ordenada: una fila por ingrediente (tipo 0) y por paso (tipo 1) de cada receta producto x tamaño
+CONSULTA_LIBRO = """
+    SELECT p.id, p.nombre, c.nombre, t.id, t.nombre, 0 AS tipo, ri.id AS orden,
+           COALESCE(i.nombre, sp.nombre || ' (' || st.nombre || ')'), ri.cantidad_necesaria, COALESCE(u.nombre, su.nombre, 'u.'), COALESCE(i.costo_unitario, sc.costo / sr.rendimiento, 0)
+    FROM receta_config rc
+    JOIN productos p ON rc.producto_id = p.id
+    JOIN tamanos t ON rc.tamano_id = t.id
+    LEFT JOIN categorias c ON p.categoria_id = c.id
+    LEFT JOIN receta_ingredientes ri ON ri.receta_config_id = rc.id
+    LEFT JOIN insumos i ON ri.insumo_id = i.id
+    LEFT JOIN unidades u ON i.unidad_uso_id = u.id
+    LEFT JOIN receta_config sr ON ri.subreceta_id = sr.id
+    LEFT JOIN productos sp ON sr.producto_id = sp.id
+    LEFT JOIN tamanos st ON sr.tamano_id = st.id
+    LEFT JOIN unidades su ON sr.unidad_rendimiento_id = su.id
+    LEFT JOIN receta_costos sc ON sc.receta_config_id = sr.id
+    WHERE {filtro}
+    UNION ALL
+    SELECT p.id, p.nombre, c.nombre, t.id, t.nombre, 1, rp.orden, rp.descripcion, NULL, NULL, NULL
+    FROM receta_config rc
+    JOIN productos p ON rc.producto_id = p.id
+    JOIN tamanos t ON rc.tamano_id = t.id
+    LEFT JOIN categorias c ON p.categoria_id = c.id
+    JOIN receta_pasos rp ON rp.producto_id = p.id
+    WHERE {filtro}
+    ORDER BY 3, 2, 1, 4, 6, 7
+"""
+
+FILTRO = "(:cat IS NULL OR p.categoria_id = :cat) AND (:sub IS NULL OR p.subcategoria_id = :sub) AND (:tam IS NULL OR t.id = :tam)"
+
+ENCABEZADO = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{titulo}</title>
+<style>body {{ font-family: sans-serif; margin: 2em; }} section.receta {{ page-break-after: always; }}</style>
+</head><body>
+"""
+
+def consulta_libro(categoria_id=None, subcategoria_id=None, tamano_id=None, buscar=None):
+    filtro = FILTRO; params = {"cat": categoria_id, "sub": subcategoria_id, "tam": tamano_id}; expr = expresion_busqueda(buscar)
+    if expr: filtro += " AND p.id IN (SELECT rowid FROM productos_fts WHERE productos_fts MATCH :q)"; params["q"] = expr
+    return CONSULTA_LIBRO.format(filtro=filtro), params
+
+def documentos(filas):
+    # Agrupa las filas ya ordenadas en los argumentos de renderizar_receta; solo hay en memoria una receta a la vez
+    for _, grupo in groupby(filas, key=lambda r: (r[0], r[3])):
+        grupo = list(grupo); r = grupo[0]
+        ings = [(f[7], f[8], f[9], f[10]) for f in grupo if f[5] == 0 and f[7] is not None]; pasos = [f[7] for f in grupo if f[5] == 1]
+        yield f"{r[1]} ({r[4]})", r[2], ings, pasos
+
+def renderizar_lote(lote):
+    return [renderizar_receta(*d) for d in lote]
+
+def pintar_lote(lote, ruta_pdf, titulo):
+    # Corre en los procesos del pool: el HTML es barato, lo caro es maquetar y pintar, así que cada proceso escribe su propio PDF parcial
+    htmls = renderizar_lote(lote); pdf = EscritorPDF(ruta_pdf, titulo)
+    try:
+        for h in htmls: pdf.agregar(h)
+    finally:
+        pdf.cerrar()
+    return htmls
+
+class EscritorHTML:
+    def __init__(self, ruta, titulo):
+        self.f = open(ruta, "w", encoding="utf-8"); self.f.write(ENCABEZADO.format(titulo=html.escape(titulo)))
+
+    def agregar(self, documento):
+        self.f.write(f"<section class=\"receta\">{documento}</section>\n")
+
+    def cerrar(self):
+        self.f.write("</body></html>\n"); self.f.close()
+
+class EscritorPDF:
+    # Cada receta se maqueta con QTextDocument y se pinta en páginas nuevas del QPdfWriter; sin pantalla (offscreen)
+    def __init__(self, ruta, titulo):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        from PyQt5.QtGui import QPdfWriter, QPainter, QPageSize, QPageLayout, QTextDocument
+        from PyQt5.QtCore import QMarginsF, QSizeF, QRectF
+        self.app = QApplication.instance() or QApplication([]); self.QTextDocument = QTextDocument; self.QSizeF = QSizeF; self.QRectF = QRectF
+        self.pdf = QPdfWriter(ruta); self.pdf.setTitle(titulo); self.pdf.setPageSize(QPageSize(QPageSize.A4)); self.pdf.setPageMargins(QMarginsF(15, 15, 15, 15), QPageLayout.Millimeter); self.pdf.setResolution(150)
+        self.painter = QPainter(self.pdf); self.primera = True
+
+    def agregar(self, documento):
+        doc = self.QTextDocument(); doc.documentLayout().setPaintDevice(self.pdf); ancho, alto = self.pdf.width(), self.pdf.height()
+        doc.setPageSize(self.QSizeF(ancho, alto)); doc.setHtml(documento)
+        for pagina in range(doc.pageCount()):
+            if not self.primera: self.pdf.newPage()
+            self.primera = False; self.painter.save(); self.painter.translate(0, -pagina * alto)
+            doc.drawContents(self.painter, self.QRectF(0, pagina * alto, ancho, alto)); self.painter.restore()
+
+    def cerrar(self):
+        self.painter.end()
+
+class UnionPDF:
+    # Concatena en orden los PDF parciales que escribe QPdfWriter en los procesos (PDF 1.4 con tabla xref clásica, un solo nodo /Pages):
+    # copia cada objeto tal cual renumerando las referencias del diccionario (los streams no se tocan), cuelga sus páginas de un
+    # /Pages único y descarta su catálogo e /Info. Se escribe a medida que llegan los parciales; en memoria quedan solo las posiciones
+    def __init__(self, ruta, titulo):
+        self.f = open(ruta, "wb"); self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"); self.posiciones = {}; self.paginas = []; self.siguiente = 4
+        self.objeto(1, b"<<\n/Type /Catalog\n/Pages 2 0 R\n>>")
+        self.objeto(3, b"<<\n/Title <feff" + titulo.encode("utf-16-be").hex().encode() + b">\n/Producer (libro.py)\n>>")
+
+    def objeto(self, numero, cuerpo):
+        self.posiciones[numero] = self.f.tell(); self.f.write(b"%d 0 obj\n%s\nendobj\n" % (numero, cuerpo))
+
+    def agregar(self, ruta_parcial):
+        with open(ruta_parcial, "rb") as f: datos = f.read()
+        os.remove(ruta_parcial)
+        xref = int(datos[datos.rindex(b"startxref") + 9:].split()[0]); encabezado, _, tabla = datos[xref:].partition(b"\n")[2].partition(b"\n")
+        cantidad = int(encabezado.split()[1]); entradas = tabla[:20 * cantidad]
+        posiciones = {n: int(entradas[20 * n:20 * n + 10]) for n in range(1, cantidad) if entradas[20 * n + 17:20 * n + 18] == b"n"}
+        trailer = datos[xref + 20 * cantidad:]; info = int(re.search(rb"/Info (\d+) 0 R", trailer).group(1)); raiz = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+        # Cada objeto termina donde empieza el siguiente (o la xref): así un "endobj" dentro de un stream comprimido no confunde el corte
+        orden = sorted(posiciones, key=posiciones.get); fin = dict(zip(orden, [posiciones[n] for n in orden[1:]] + [xref]))
+        cuerpo = lambda n: datos[datos.index(b"obj", posiciones[n]) + 3:fin[n]].strip().removesuffix(b"endobj").strip()
+        paginas = int(re.search(rb"/Pages (\d+) 0 R", cuerpo(raiz)).group(1)); base = self.siguiente
+        nuevo = lambda n: 2 if n == paginas else base + n
+        renumerar = lambda texto: re.sub(rb"(\d+) 0 R\b", lambda m: b"%d 0 R" % nuevo(int(m.group(1))), texto)
+        for n in orden:
+            if n in (info, raiz, paginas): continue
+            dic, marca, resto = cuerpo(n).partition(b"stream\n")
+            self.objeto(nuevo(n), renumerar(dic) + marca + resto)
+        kids = re.search(rb"/Kids\s*\[(.*?)\]", cuerpo(paginas), re.S).group(1)
+        self.paginas += [nuevo(int(n)) for n in re.findall(rb"(\d+) 0 R", kids)]; self.siguiente = base + cantidad
+
+    def cerrar(self):
+        self.objeto(2, b"<<\n/Type /Pages\n/Kids [%s]\n/Count %d\n>>" % (b" ".join(b"%d 0 R" % p for p in self.paginas), len(self.paginas)))
+        xref = self.f.tell(); self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.siguiente)
+        self.f.write(b"".join(b"%010d 00000 n \n" % self.posiciones[n] if n in self.posiciones else b"0000000000 65535 f \n" for n in range(1, self.siguiente)))
+        self.f.write(b"trailer\n<<\n/Size %d\n/Info 3 0 R\n/Root 1 0 R\n>>\nstartxref\n%d\n%%%%EOF\n" % (self.siguiente, xref)); self.f.close()
+
+def generar_libro(db, ruta_html=None, ruta_pdf=None, procesos=None, lote=128, titulo="Recetario", **filtros):
+    # Las recetas se leen de un cursor y se procesan por lotes. El HTML sale barato y se escribe acá; lo caro es maquetar y pintar el PDF,
+    # así que con varios procesos cada uno pinta un PDF parcial por lote y acá se unen en orden apenas están listos, con una
+    # ventana de lotes pendientes que acota la memoria. Con un solo proceso el PDF se pinta acá mismo
+    procesos = procesos or os.cpu_count() or 1; docs = documentos(db.abrir_cursor(*consulta_libro(**filtros))); n = 0
+    partes = bool(ruta_pdf) and procesos > 1
+    escritores = ([EscritorHTML(ruta_html, titulo)] if ruta_html else []) + ([EscritorPDF(ruta_pdf, titulo)] if ruta_pdf and not partes else [])
+    union = UnionPDF(ruta_pdf, titulo) if partes else None; temporal = tempfile.TemporaryDirectory() if partes else None
+    def escribir(htmls, parcial=None):
+        if parcial: union.agregar(parcial)
+        for h in htmls:
+            for e in escritores: e.agregar(h)
+        return len(htmls)
+    lotes = iter(lambda: list(islice(docs, lote)), [])
+    try:
+        if not partes:
+            for l in lotes: n += escribir(renderizar_lote(l))
+        else:
+            with ProcessPoolExecutor(procesos) as pool:
+                pendientes = deque()
+                for i, l in enumerate(lotes):
+                    parcial = os.path.join(temporal.name, f"{i}.pdf"); pendientes.append((pool.submit(pintar_lote, l, parcial, titulo), parcial))
+                    if len(pendientes) >= 2 * procesos: futuro, parcial = pendientes.popleft(); n += escribir(futuro.result(), parcial)
+                while pendientes: futuro, parcial = pendientes.popleft(); n += escribir(futuro.result(), parcial)
+            union.cerrar()
+    finally:
+        for e in escritores: e.cerrar()
+        if temporal: temporal.cleanup()
+    return n
+
+def id_por_nombre(db, tabla, nombre):
+    if nombre is None: return None
+    r = db.traer_datos(f"SELECT id FROM {tabla} WHERE nombre = ?", (nombre,))
+    if not r: raise SystemExit(f"No existe {nombre} en {tabla}.")
+    return r[0][0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Libro de recetas imprimible (HTML y/o PDF) de todo el menú o de una parte.")
+    parser.add_argument("html", nargs="?", help="Archivo HTML de salida")
+    parser.add_argument("--pdf", help="Archivo PDF de salida (requiere PyQt5)")
+    parser.add_argument("--bd", default="db_recetario.db", help="Ruta a la base de datos")
+    parser.add_argument("--categoria"); parser.add_argument("--subcategoria"); parser.add_argument("--tamano")
+    parser.add_argument("--buscar", help="Solo productos cuyo nombre coincida (misma búsqueda que el recetario)")
+    parser.add_argument("--procesos", type=int, help="Procesos que maquetan y pintan el PDF en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument("--lote", type=int, default=128, help="Recetas por PDF parcial que pinta cada proceso")
+    args = parser.parse_args(argv)
+    if not args.html and not args.pdf: parser.error("indicar un archivo HTML y/o --pdf")
+    db = DataBase(args.bd); t = time.perf_counter()
+    cat = id_por_nombre(db, "categorias", args.categoria)
+    sub = None
+    if args.subcategoria:
+        r = db.traer_datos("SELECT id FROM subcategorias WHERE nombre = ? AND (? IS NULL OR categoria_id = ?)", (args.subcategoria, cat, cat))
+        if not r: raise SystemExit(f"No existe la subcategoría {args.subcategoria}.")
+        sub = r[0][0]
+    n = generar_libro(db, args.html, args.pdf, args.procesos, args.lote, categoria_id=cat, subcategoria_id=sub, tamano_id=id_por_nombre(db, "tamanos", args.tamano), buscar=args.buscar)
+    print(f"{n} recetas en {time.perf_counter() - t:.1f} s.")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,77 +1,163 @@
+import os
 import sys
+import time
 import sqlite3
-import math
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QLineEdit, QPushButton, 
                              QTableWidget, QTableWidgetItem, QTabWidget, 
                              QComboBox, QMessageBox, QHeaderView, QSplitter,
                              QFormLayout, QGroupBox, QListWidget, QAbstractItemView, 
-                             QTextEdit, QDialog, QGridLayout, QFrame, QInputDialog)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont, QColor
+                             QTextEdit, QDialog, QGridLayout, QFrame, QInputDialog,
+                             QTableView, QShortcut, QListWidgetItem, QCheckBox)
+from PyQt5.QtCore import (Qt, QAbstractTableModel, QModelIndex, QObject,
+                          QThread, QTimer, pyqtSignal)
+from PyQt5.QtGui import QFont, QColor, QKeySequence
+from database import DataBase
+from costeo import calcular_costo_insumo
+from recetario import CacheRecetas, TABLAS_RECETA
+from catalogo import Catalogo
+
+class ModeloConsulta(QAbstractTableModel):
+    # Modelo sobre una consulta de la BD: trae páginas de filas a medida que la vista las necesita. Entre página y página no queda ningún
+    # cursor abierto, que retendría una instantánea de lectura del WAL. Sin orden ni filtro se pagina la consulta tal cual (LIMIT/OFFSET).
+    # Ordenar y filtrar se resuelven en SQLite sobre los valores tipados, así alcanzan a todas las filas y no solo a las ya traídas: el
+    # resultado se ordena una sola vez en una tabla temporal numerada por posición y cada página es un rango de esa clave, sin volver a
+    # ordenar ni saltear las filas anteriores; la primera columna (el id) desempata el orden
+    LOTE = 256; instancias = 0
+
+    def __init__(self, db, columnas, formatos=None):
+        super().__init__()
+        self.db = db; self.columnas = columnas; self.formatos = formatos or {}; self.filas = []; self.query = None; self.params = ()
+        self.orden = None; self.filtro = ("", -1); self.quedan = False; self.materializada = False
+        ModeloConsulta.instancias += 1; self.tabla = f"temp.vista_{ModeloConsulta.instancias}"
+
+    def cargar(self, query, params=()):
+        self.query = query; self.params = tuple(params); self.recargar()
+
+    def recargar(self):
+        self.beginResetModel(); self.filas = []; self.quedan = self.query is not None; self.endResetModel(); self.materializar(); self.fetchMore()
+
+    def materializar(self):
+        texto, columna = self.filtro; cols = ", ".join(f"c{i}" for i in range(len(self.columnas)))
+        if self.materializada: self.db.ejecutar(f"DROP TABLE IF EXISTS {self.tabla}")
+        self.materializada = self.query is not None and (bool(texto) or self.orden is not None)
+        if not self.materializada: return
+        sql = f"WITH q({cols}) AS ({self.query}) SELECT * FROM q"; params = self.params
+        if texto:
+            indices = range(len(self.columnas)) if columna < 0 else [columna]; patron = "%" + texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            sql += " WHERE " + " OR ".join(f"c{i} LIKE ? ESCAPE '\\'" for i in indices); params += (patron,) * len(indices)
+        if self.orden is not None: sql += f" ORDER BY c{self.orden[0]} {'DESC' if self.orden[1] == Qt.DescendingOrder else 'ASC'}, c0"
+        # Las filas se numeran en el orden en que las entrega el SELECT
+        self.db.ejecutar(f"CREATE TABLE {self.tabla} (pos INTEGER PRIMARY KEY, {cols})"); self.db.ejecutar(f"INSERT INTO {self.tabla} ({cols}) {sql}", params)
+
+    def consulta_pagina(self):
+        if not self.materializada: return self.query + " LIMIT ? OFFSET ?", self.params + (self.LOTE, len(self.filas))
+        cols = ", ".join(f"c{i}" for i in range(len(self.columnas)))
+        return f"SELECT {cols} FROM {self.tabla} WHERE pos > ? ORDER BY pos LIMIT ?", (len(self.filas), self.LOTE)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.filas)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columnas)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole: return None
+        valor = self.filas[index.row()][index.column()]; fmt = self.formatos.get(index.column())
+        return fmt(valor) if fmt else ("" if valor is None else str(valor))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal: return self.columnas[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.quedan
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.quedan: return
+        lote = self.db.traer_datos(*self.consulta_pagina()); self.quedan = len(lote) == self.LOTE
+        if lote:
+            self.beginInsertRows(QModelIndex(), len(self.filas), len(self.filas) + len(lote) - 1); self.filas.extend(lote); self.endInsertRows()
+
+    def sort(self, columna, orden=Qt.AscendingOrder):
+        self.orden = (columna, orden) if columna >= 0 else None
+        if self.query is not None: self.recargar()
+
+    def filtrar(self, texto, columna=-1):
+        self.filtro = (texto, columna)
+        if self.query is not None: self.recargar()
+
+class TablaConsulta(QTableView):
+    # Vista de solo lectura; ordenar por columna y filtrar los resuelve el modelo en la BD
+    def __init__(self, db, columnas, formatos=None):
+        super().__init__()
+        self.modelo = ModeloConsulta(db, columnas, formatos); self.setModel(self.modelo)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows); self.setSelectionMode(QAbstractItemView.SingleSelection); self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.verticalHeader().setVisible(False)
+        self.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder); self.setSortingEnabled(True)  # Respeta el ORDER BY de la consulta hasta que el usuario ordene
 
-class NumericTableWidgetItem(QTableWidgetItem):
-    def __lt__(self, other):
-        try:
-            val1 = float(self.text().replace('$', '').replace(',', ''))
-            val2 = float(other.text().replace('$', '').replace(',', ''))
-            return val1 < val2
-        except ValueError:
-            return super().__lt__(other)
-
-class DataBase:
-    def __init__(self, db_name="db_recetario.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.conn.execute("PRAGMA foreign_keys = 1")
-        self.cursor = self.conn.cursor()
-        self.migracion_inicial()
-        self.crear_tablas()
-
-    def migracion_inicial(self):
-        try:
-            self.cursor.execute("SELECT id FROM receta_ingredientes LIMIT 1")
-        except sqlite3.OperationalError:
-            print("Actualizando estructura de tabla ingredientes...")
-            self.cursor.execute("CREATE TABLE IF NOT EXISTS receta_ingredientes_new (id INTEGER PRIMARY KEY AUTOINCREMENT, receta_config_id INTEGER, insumo_id INTEGER, cantidad_necesaria REAL)")
-            try:
-                self.cursor.execute("INSERT INTO receta_ingredientes_new (receta_config_id, insumo_id, cantidad_necesaria) SELECT receta_config_id, insumo_id, cantidad_necesaria FROM receta_ingredientes")
-                self.cursor.execute("DROP TABLE receta_ingredientes")
-            except: pass
-            self.cursor.execute("ALTER TABLE receta_ingredientes_new RENAME TO receta_ingredientes")
-            self.conn.commit()
-
-    def crear_tablas(self):
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS categorias (id INTEGER PRIMARY KEY, nombre TEXT)''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS tamanos (id INTEGER PRIMARY KEY, nombre TEXT)''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS unidades (id INTEGER PRIMARY KEY, nombre TEXT)''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS subcategorias (id INTEGER PRIMARY KEY, nombre TEXT, categoria_id INTEGER, FOREIGN KEY(categoria_id) REFERENCES categorias(id))''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS insumos (id INTEGER PRIMARY KEY, nombre TEXT, unidad_compra_id INTEGER, unidad_uso_id INTEGER, cantidad_envase REAL, costo_envase REAL, factor_conversion REAL, rendimiento_total REAL, costo_unitario REAL, FOREIGN KEY(unidad_compra_id) REFERENCES unidades(id), FOREIGN KEY(unidad_uso_id) REFERENCES unidades(id))''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS productos (id INTEGER PRIMARY KEY, nombre TEXT, instrucciones TEXT, categoria_id INTEGER, subcategoria_id INTEGER, FOREIGN KEY(categoria_id) REFERENCES categorias(id), FOREIGN KEY(subcategoria_id) REFERENCES subcategorias(id))''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS receta_pasos (id INTEGER PRIMARY KEY, producto_id INTEGER, orden INTEGER, descripcion TEXT, FOREIGN KEY(producto_id) REFERENCES productos(id) ON DELETE CASCADE)''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS receta_config (id INTEGER PRIMARY KEY, producto_id INTEGER, tamano_id INTEGER, UNIQUE(producto_id, tamano_id), FOREIGN KEY(producto_id) REFERENCES productos(id) ON DELETE CASCADE, FOREIGN KEY(tamano_id) REFERENCES tamanos(id))''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS receta_ingredientes (id INTEGER PRIMARY KEY AUTOINCREMENT, receta_config_id INTEGER, insumo_id INTEGER, cantidad_necesaria REAL, FOREIGN KEY(receta_config_id) REFERENCES receta_config(id) ON DELETE CASCADE, FOREIGN KEY(insumo_id) REFERENCES insumos(id))''')
-        
-        self.cursor.execute("SELECT count(*) FROM unidades")
-        if self.cursor.fetchone()[0] == 0:
-            unidades_base = ["Pieza", "Litro", "Galón", "Onza (oz)", "Gramo (gr)", "Mililitro (ml)", "Kilogramo (kg)"]
-            for u in unidades_base: self.cursor.execute("INSERT INTO unidades (nombre) VALUES (?)", (u,))
-        self.conn.commit()
+    def cargar(self, query, params=()):
+        self.modelo.cargar(query, params)
 
-    def ejecutar(self, query, params=()):
-        try:
-            self.cursor.execute(query, params)
-            self.conn.commit()
-            return self.cursor
-        except sqlite3.Error as e:
-            print(f"Error BD: {e}")
-            return None
+    def filtrar(self, texto, columna=-1):
+        self.modelo.filtrar(texto, columna)
+
+    def fila_seleccionada(self):
+        filas = self.selectionModel().selectedRows()
+        return self.modelo.filas[filas[0].row()] if filas else None
 
-    def traer_datos(self, query, params=()):
-        return self.cursor.execute(query, params).fetchall()
+class TrabajadorBusqueda(QObject):
+    # Vive en el hilo del buscador con su propia conexión, abierta una sola vez; cada búsqueda se aborta si llegó una tecla más nueva.
+    # Si la app mide las consultas, las del buscador van a la misma instrumentación, atribuidas a "Visor (búsqueda)"
+    terminada = pyqtSignal(int, str, list)
 
-    def buscar_insumos(self, texto):
-        query = "SELECT i.id, i.nombre, u.nombre FROM insumos i JOIN unidades u ON i.unidad_uso_id = u.id WHERE i.nombre LIKE ?"
-        return self.traer_datos(query, (f'%{texto}%',))
+    def __init__(self, buscador):
+        super().__init__()
+        self.buscador = buscador; self.db = None
+
+    def buscar(self, generacion, texto):
+        obsoleta = lambda: generacion != self.buscador.generacion
+        if obsoleta(): return
+        if self.db is None:
+            self.db = DataBase(self.buscador.db_name); self.db.instrumentacion = self.buscador.instrumentacion; self.db.contexto = "Visor (búsqueda)"
+        self.db.conn.set_progress_handler(lambda: 1 if obsoleta() else 0, 1000)  # Distinto de 0 interrumpe la consulta
+        try: filas = self.db.buscar_productos(texto)
+        except sqlite3.OperationalError: return  # Interrumpida (o BD ocupada): la búsqueda siguiente la reemplaza
+        finally: self.db.conn.set_progress_handler(None, 0)
+        self.terminada.emit(generacion, texto, filas)
+
+    def cerrar(self):
+        if self.db is not None: self.db.conn.close(); self.db = None
+
+class BuscadorVisor(QObject):
+    # Debounce de la búsqueda del recetario; solo se entrega el resultado de la última tecla
+    pedir = pyqtSignal(int, str)
+    resultados = pyqtSignal(str, list)
+
+    def __init__(self, db_name, retardo_ms=250, instrumentacion=None):
+        super().__init__()
+        self.db_name = db_name; self.instrumentacion = instrumentacion; self.generacion = 0; self.texto = ""
+        self.hilo = QThread(); self.trabajador = TrabajadorBusqueda(self); self.trabajador.moveToThread(self.hilo)
+        self.pedir.connect(self.trabajador.buscar); self.trabajador.terminada.connect(self.entregar)
+        self.hilo.finished.connect(self.trabajador.cerrar); self.hilo.start()  # finished se emite en el hilo del trabajador: la conexión se cierra donde se abrió
+        self.timer = QTimer(self); self.timer.setSingleShot(True); self.timer.setInterval(retardo_ms); self.timer.timeout.connect(self.lanzar)
+        app = QApplication.instance()
+        if app: app.aboutToQuit.connect(self.detener)
+
+    def buscar(self, texto):
+        self.texto = texto; self.generacion += 1; self.timer.start()
+
+    def cancelar(self):
+        self.generacion += 1; self.timer.stop()
+
+    def detener(self):
+        self.cancelar(); self.hilo.quit(); self.hilo.wait()
+
+    def lanzar(self):
+        self.pedir.emit(self.generacion, self.texto)
+
+    def entregar(self, generacion, texto, filas):
+        if generacion == self.generacion: self.resultados.emit(texto, filas)
 
 class ABMSimple(QWidget):
     def __init__(self, titulo, tabla, db, callback_cambios=None):
@@ -84,19 +170,16 @@ class ABMSimple(QWidget):
         self.btn_delete = QPushButton("Eliminar"); self.btn_delete.setStyleSheet("background-color: #dc3545;"); self.btn_delete.clicked.connect(self.eliminar); self.btn_delete.setEnabled(False)
         self.btn_clear = QPushButton("Limpiar"); self.btn_clear.setStyleSheet("background-color: #6c757d;"); self.btn_clear.clicked.connect(self.limpiar)
         h_btns.addWidget(self.btn_add); h_btns.addWidget(self.btn_update); h_btns.addWidget(self.btn_delete); h_btns.addWidget(self.btn_clear); vbox.addLayout(h_btns)
-        self.tabla = QTableWidget(); self.tabla.setColumnCount(2); self.tabla.setHorizontalHeaderLabels(["ID", "Nombre"]); self.tabla.setSelectionBehavior(QAbstractItemView.SelectRows)
-        self.tabla.setEditTriggers(QAbstractItemView.NoEditTriggers); self.tabla.hideColumn(0); self.tabla.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.tabla.itemClicked.connect(self.seleccionar)
+        self.tabla = TablaConsulta(db, ["ID", "Nombre"]); self.tabla.hideColumn(0); self.tabla.clicked.connect(self.seleccionar)
         vbox.addWidget(self.tabla); self.group.setLayout(vbox); layout.addWidget(self.group); self.setLayout(layout); self.cargar_datos()
 
     def cargar_datos(self):
-        self.tabla.setRowCount(0)
-        for i, (fid, nom) in enumerate(self.db.traer_datos(f"SELECT id, nombre FROM {self.tabla_bd}")):
-            self.tabla.insertRow(i); self.tabla.setItem(i, 0, QTableWidgetItem(str(fid))); self.tabla.setItem(i, 1, QTableWidgetItem(nom))
+        self.tabla.cargar(f"SELECT id, nombre FROM {self.tabla_bd} ORDER BY id")
 
     def seleccionar(self):
-        row = self.tabla.currentRow()
-        if row >= 0:
-            self.id_seleccionado = self.tabla.item(row, 0).text(); self.txt_nombre.setText(self.tabla.item(row, 1).text())
+        fila = self.tabla.fila_seleccionada()
+        if fila:
+            self.id_seleccionado = fila[0]; self.txt_nombre.setText(fila[1])
             self.btn_add.setEnabled(False); self.btn_update.setEnabled(True); self.btn_delete.setEnabled(True)
 
     def limpiar(self):
@@ -120,40 +203,35 @@ class ABMSimple(QWidget):
                 self.db.ejecutar(f"DELETE FROM {self.tabla_bd} WHERE id=?", (self.id_seleccionado,)); self.limpiar(); self.cargar_datos(); self.notificar()
 
 class ABMSubcategorias(QWidget):
-    def __init__(self, db):
+    def __init__(self, db, catalogo):
         super().__init__()
-        self.db = db; self.id_seleccionado = None; layout = QVBoxLayout(); self.group = QGroupBox("Gestión de Subcategorías"); vbox = QVBoxLayout(); form = QFormLayout()
+        self.db = db; self.catalogo = catalogo; self.id_seleccionado = None; layout = QVBoxLayout(); self.group = QGroupBox("Gestión de Subcategorías"); vbox = QVBoxLayout(); form = QFormLayout()
         self.txt_nombre = QLineEdit(); self.cmb_categoria = QComboBox(); form.addRow("Nombre Subcategoría:", self.txt_nombre); form.addRow("Pertenece a Categoría:", self.cmb_categoria); vbox.addLayout(form)
         h_btns = QHBoxLayout(); self.btn_add = QPushButton("Agregar"); self.btn_add.clicked.connect(self.agregar)
         self.btn_update = QPushButton("Actualizar"); self.btn_update.clicked.connect(self.actualizar); self.btn_update.setEnabled(False)
         self.btn_delete = QPushButton("Eliminar"); self.btn_delete.setStyleSheet("background-color: #dc3545;"); self.btn_delete.clicked.connect(self.eliminar); self.btn_delete.setEnabled(False)
         self.btn_clear = QPushButton("Limpiar"); self.btn_clear.setStyleSheet("background-color: #6c757d;"); self.btn_clear.clicked.connect(self.limpiar)
         h_btns.addWidget(self.btn_add); h_btns.addWidget(self.btn_update); h_btns.addWidget(self.btn_delete); h_btns.addWidget(self.btn_clear); vbox.addLayout(h_btns)
-        self.tabla = QTableWidget(); self.tabla.setColumnCount(4); self.tabla.setHorizontalHeaderLabels(["ID", "Subcategoría", "Categoría", "id_cat"])
-        self.tabla.setSelectionBehavior(QAbstractItemView.SelectRows); self.tabla.setEditTriggers(QAbstractItemView.NoEditTriggers); self.tabla.hideColumn(0); self.tabla.hideColumn(3)
-        self.tabla.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.tabla.itemClicked.connect(self.seleccionar); vbox.addWidget(self.tabla); self.group.setLayout(vbox); layout.addWidget(self.group); self.setLayout(layout)
+        self.tabla = TablaConsulta(db, ["ID", "Subcategoría", "Categoría", "id_cat"], {2: lambda v: v if v else "Sin Cat"}); self.tabla.hideColumn(0); self.tabla.hideColumn(3)
+        self.tabla.clicked.connect(self.seleccionar); vbox.addWidget(self.tabla); self.group.setLayout(vbox); layout.addWidget(self.group); self.setLayout(layout)
         self.cargar_categorias(); self.cargar_datos()
 
     def cargar_categorias(self):
         id_actual = self.cmb_categoria.currentData(); self.cmb_categoria.clear()
-        for c in self.db.traer_datos("SELECT id, nombre FROM categorias"): self.cmb_categoria.addItem(c[1], c[0])
+        for c in self.catalogo.obtener("categorias"): self.cmb_categoria.addItem(c[1], c[0])
         if id_actual:
             idx = self.cmb_categoria.findData(id_actual)
             if idx >= 0: self.cmb_categoria.setCurrentIndex(idx)
 
     def cargar_datos(self):
-        self.tabla.setRowCount(0)
-        query = 'SELECT s.id, s.nombre, c.nombre, c.id FROM subcategorias s LEFT JOIN categorias c ON s.categoria_id = c.id'
-        for i, row in enumerate(self.db.traer_datos(query)):
-            self.tabla.insertRow(i); self.tabla.setItem(i, 0, QTableWidgetItem(str(row[0]))); self.tabla.setItem(i, 1, QTableWidgetItem(row[1]))
-            self.tabla.setItem(i, 2, QTableWidgetItem(row[2] if row[2] else "Sin Cat")); self.tabla.setItem(i, 3, QTableWidgetItem(str(row[3]) if row[3] else ""))
+        self.tabla.cargar('SELECT s.id, s.nombre, c.nombre, c.id FROM subcategorias s LEFT JOIN categorias c ON s.categoria_id = c.id ORDER BY s.id')
 
     def seleccionar(self):
-        row = self.tabla.currentRow()
-        if row >= 0:
-            self.id_seleccionado = self.tabla.item(row, 0).text(); self.txt_nombre.setText(self.tabla.item(row, 1).text())
-            id_cat = self.tabla.item(row, 3).text()
-            if id_cat: self.cmb_categoria.setCurrentIndex(self.cmb_categoria.findData(int(id_cat)))
+        fila = self.tabla.fila_seleccionada()
+        if fila:
+            self.id_seleccionado = fila[0]; self.txt_nombre.setText(fila[1])
+            id_cat = fila[3]
+            if id_cat: self.cmb_categoria.setCurrentIndex(self.cmb_categoria.findData(id_cat))
             self.btn_add.setEnabled(False); self.btn_update.setEnabled(True); self.btn_delete.setEnabled(True)
 
     def limpiar(self):
@@ -175,17 +253,99 @@ class ABMSubcategorias(QWidget):
             if QMessageBox.question(self, "Borrar", "¿Seguro?", QMessageBox.Yes|QMessageBox.No) == QMessageBox.Yes:
                 self.db.ejecutar("DELETE FROM subcategorias WHERE id=?", (self.id_seleccionado,)); self.limpiar(); self.cargar_datos()
 
-class SistemaCafeApp(QMainWindow):
+class DialogoClonado(QDialog):
+    # Clonado en lote: de un tamaño hacia varios, en todo el catálogo o en una categoría/subcategoría, con vista previa de costos
+    def __init__(self, db, catalogo, parent=None):
+        super().__init__(parent)
+        self.db = db; self.catalogo = catalogo; self.aplicado = False; self.setWindowTitle("Clonar recetas en lote"); self.resize(750, 600); layout = QVBoxLayout(); form = QFormLayout()
+        self.cmb_desde = QComboBox(); self.lista_hacia = QListWidget(); self.lista_hacia.setSelectionMode(QAbstractItemView.MultiSelection); self.lista_hacia.setMaximumHeight(110)
+        for t in catalogo.obtener("tamanos"):
+            self.cmb_desde.addItem(t[1], t[0]); item = QListWidgetItem(t[1]); item.setData(Qt.UserRole, t[0]); self.lista_hacia.addItem(item)
+        self.txt_mult = QLineEdit("1"); self.cmb_cat = QComboBox(); self.cmb_sub = QComboBox(); self.cmb_cat.addItem("- Todas -", None)
+        for c in catalogo.obtener("categorias"): self.cmb_cat.addItem(c[1], c[0])
+        self.cmb_cat.currentIndexChanged.connect(self.filtrar_subcats); self.filtrar_subcats()
+        self.txt_ajustes = QLineEdit(); self.txt_ajustes.setPlaceholderText("Vaso=1; Tapa=1  (insumo=multiplicador propio)"); self.chk_reemplazar = QCheckBox("Reemplazar recetas que ya tienen ingredientes")
+        form.addRow("Copiar DESDE:", self.cmb_desde); form.addRow("HACIA tamaños:", self.lista_hacia); form.addRow("Multiplicar cantidades por:", self.txt_mult); form.addRow("Categoría:", self.cmb_cat); form.addRow("Subcategoría:", self.cmb_sub); form.addRow("Ajustes por insumo:", self.txt_ajustes); form.addRow("", self.chk_reemplazar); layout.addLayout(form)
+        self.tabla = QTableWidget(0, 4); self.tabla.setHorizontalHeaderLabels(["Producto", "Tamaño", "Costo actual", "Costo nuevo"]); self.tabla.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.tabla.setEditTriggers(QAbstractItemView.NoEditTriggers); layout.addWidget(self.tabla)
+        self.lbl_resumen = QLabel(""); layout.addWidget(self.lbl_resumen); h_btns = QHBoxLayout()
+        btn_prev = QPushButton("Vista Previa"); btn_prev.setStyleSheet("background-color: #17a2b8; color: white;"); btn_prev.clicked.connect(lambda: self.ejecutar(True))
+        btn_ok = QPushButton("Aplicar"); btn_ok.clicked.connect(self.aplicar); btn_cerrar = QPushButton("Cerrar"); btn_cerrar.setStyleSheet("background-color: #6c757d;"); btn_cerrar.clicked.connect(self.accept)
+        h_btns.addWidget(btn_prev); h_btns.addWidget(btn_ok); h_btns.addWidget(btn_cerrar); layout.addLayout(h_btns); self.setLayout(layout)
+
+    def filtrar_subcats(self):
+        self.cmb_sub.clear(); self.cmb_sub.addItem("- Todas -", None); c_id = self.cmb_cat.currentData()
+        if c_id:
+            for s in self.catalogo.obtener("subcategorias"):
+                if s[3] == c_id: self.cmb_sub.addItem(s[1], s[0])
+
+    def parametros(self):
+        mult = float(self.txt_mult.text()); ajustes = {}
+        for parte in self.txt_ajustes.text().split(";"):
+            if not parte.strip(): continue
+            nombre, _, factor = parte.rpartition("="); ins = self.db.traer_datos("SELECT id FROM insumos WHERE nombre = ?", (nombre.strip(),))
+            if not ins: raise ValueError(f"no existe el insumo '{nombre.strip()}'")
+            ajustes[ins[0][0]] = float(factor)
+        return dict(desde_tamano_id=self.cmb_desde.currentData(), tamanos={i.data(Qt.UserRole): mult for i in self.lista_hacia.selectedItems()}, ajustes=ajustes,
+                    categoria_id=self.cmb_cat.currentData(), subcategoria_id=self.cmb_sub.currentData(), reemplazar=self.chk_reemplazar.isChecked())
+
+    def ejecutar(self, simular):
+        try:
+            p = self.parametros()
+            if not p["tamanos"]: return QMessageBox.warning(self, "Error", "Elegir al menos un tamaño destino.")
+            filas = self.db.clonar_recetas(**p, simular=simular)
+        except ValueError as e: return QMessageBox.warning(self, "Error", f"Revisar los datos: {e}")
+        except sqlite3.Error as e: return QMessageBox.warning(self, "Error", f"No se pudo clonar: {e}")
+        self.tabla.setRowCount(len(filas))
+        for i, (_, prod, _, tam, antes, despues) in enumerate(filas):
+            for j, v in enumerate((prod, tam, f"${antes:.2f}" if antes is not None else "-", f"${despues:.2f}")): self.tabla.setItem(i, j, QTableWidgetItem(v))
+        self.lbl_resumen.setText(f"{len(filas)} recetas {'a escribir (vista previa, sin guardar)' if simular else 'escritas'}")
+        return filas
+
+    def aplicar(self):
+        if QMessageBox.question(self, "Confirmar", "¿Aplicar el clonado en lote?", QMessageBox.Yes|QMessageBox.No) != QMessageBox.Yes: return
+        filas = self.ejecutar(False)
+        if isinstance(filas, list): self.aplicado = True; QMessageBox.information(self, "Listo", f"{len(filas)} recetas clonadas")
+
+class Cronometro:
+    # Tiempos de arranque por etapa; se imprimen con --tiempos o RECETARIO_TIEMPOS=1
     def __init__(self):
+        self.inicio = self.ultimo = time.perf_counter(); self.etapas = []
+
+    def marcar(self, etapa):
+        ahora = time.perf_counter(); self.etapas.append((etapa, (ahora - self.ultimo) * 1000)); self.ultimo = ahora
+
+    def reporte(self):
+        lineas = [f"  {etapa:<40}{ms:9.1f} ms" for etapa, ms in self.etapas]
+        return "\n".join(["Tiempos de arranque:"] + lineas + [f"  {'TOTAL':<40}{(self.ultimo - self.inicio) * 1000:9.1f} ms"])
+
+class SistemaCafeApp(QMainWindow):
+    TABS = ["INSUMOS", "CONFIGURACIÓN", "RECETAS", "RECETARIO"]
+
+    def __init__(self, cronometro=None):
         super().__init__()
-        self.db = DataBase(); self.setWindowTitle("Sistema Café ERP"); self.setGeometry(50, 50, 1300, 850)
+        self.cronometro = cronometro or Cronometro()
+        self.db = DataBase(); self.cronometro.marcar("Base de datos" + (" (migración)" if self.db.migrada else "")); self.activar_instrumentacion(); self.cache_recetas = CacheRecetas(self.db); self.catalogo = Catalogo(self.db); self.setWindowTitle("Sistema Café ERP"); self.setGeometry(50, 50, 1300, 850)
         self.insumo_id_editar = None; self.producto_seleccionado_id = None; self.id_ingrediente_editar = None
         self.tabs = QTabWidget(); self.setCentralWidget(self.tabs)
         self.setStyleSheet("QTabWidget::pane { border: 1px solid #AAA; } QTabBar::tab { background: #EEE; padding: 10px 20px; border-radius: 4px; margin: 1px; } QTabBar::tab:selected { background: #007BFF; color: white; font-weight: bold; } QLabel { font-size: 14px; } QLineEdit, QComboBox, QTableWidget { font-size: 14px; } QPushButton { background-color: #28a745; color: white; padding: 6px; border-radius: 4px; font-weight: bold; } QPushButton:disabled { background-color: #CCC; }")
-        self.init_tab_insumos(); self.init_tab_config(); self.init_tab_productos(); self.init_tab_visor()
-
-    def init_tab_insumos(self):
-        tab = QWidget(); layout = QHBoxLayout(); form_panel = QGroupBox("Gestión de Insumos"); form_layout = QVBoxLayout()
+        # Cada pestaña se construye y carga la primera vez que se activa
+        self.constructores_tabs = [self.init_tab_insumos, self.init_tab_config, self.init_tab_productos, self.init_tab_visor]; self.tabs_construidas = set()
+        for titulo in self.TABS: self.tabs.addTab(QWidget(), titulo)
+        self.tabs.currentChanged.connect(self.al_cambiar_tab); self.al_cambiar_tab(self.tabs.currentIndex())
+
+    def activar_instrumentacion(self):
+        # RECETARIO_INSTRUMENTAR=<umbral en ms> registra todas las consultas; Ctrl+Shift+E exporta las estadísticas
+        umbral = os.environ.get("RECETARIO_INSTRUMENTAR")
+        if not umbral: return
+        self.db.activar_instrumentacion(float(umbral), "consultas_lentas.jsonl")
+        QShortcut(QKeySequence("Ctrl+Shift+E"), self, activated=self.exportar_estadisticas_bd)
+
+    def exportar_estadisticas_bd(self):
+        self.db.instrumentacion.exportar("estadisticas_bd.json"); print(self.db.instrumentacion.reporte())
+        QMessageBox.information(self, "Estadísticas", "Estadísticas de consultas guardadas en estadisticas_bd.json")
+
+    def init_tab_insumos(self, tab):
+        layout = QHBoxLayout(); form_panel = QGroupBox("Gestión de Insumos"); form_layout = QVBoxLayout()
         self.ins_nombre = QLineEdit(); self.ins_costo = QLineEdit(); self.ins_cant_envase = QLineEdit()
         self.cmb_uni_compra = QComboBox(); self.cmb_uni_uso = QComboBox()
         self.cmb_uni_compra.currentIndexChanged.connect(self.verificar_conversion); self.cmb_uni_uso.currentIndexChanged.connect(self.verificar_conversion)
@@ -196,16 +356,17 @@ class SistemaCafeApp(QMainWindow):
         lay_btns = QHBoxLayout(); lay_btns.addWidget(self.btn_guardar); lay_btns.addWidget(self.btn_cancelar)
         fl = QFormLayout(); fl.addRow("Nombre Insumo:", self.ins_nombre); fl.addRow("Costo de Compra ($):", self.ins_costo); fl.addRow("Unidad de Envase (Compra):", self.cmb_uni_compra); fl.addRow("Cantidad en el Envase:", self.ins_cant_envase); fl.addRow("Unidad para Recetas (Uso):", self.cmb_uni_uso)
         form_layout.addLayout(fl); form_layout.addWidget(self.container_factor); form_layout.addLayout(lay_btns); form_layout.addStretch(); form_panel.setLayout(form_layout)
-        right_layout = QVBoxLayout(); self.tabla_insumos = QTableWidget(); cols = ["ID", "Insumo", "Envase", "Costo", "Conv.", "Rendimiento", "Costo Unitario"]
-        self.tabla_insumos.setColumnCount(len(cols)); self.tabla_insumos.setHorizontalHeaderLabels(cols); self.tabla_insumos.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.tabla_insumos.setEditTriggers(QAbstractItemView.NoEditTriggers); self.tabla_insumos.setSelectionBehavior(QAbstractItemView.SelectRows)
+        right_layout = QVBoxLayout(); cols = ["ID", "Insumo", "Envase", "Costo", "Conv.", "Rendimiento", "Costo Unitario"]
+        self.tabla_insumos = TablaConsulta(self.db, cols, {3: lambda v: f"${v:.2f}", 6: lambda v: f"${v:.4f}"})
         hbox_crud = QHBoxLayout(); btn_editar = QPushButton("Editar Seleccionado"); btn_editar.setStyleSheet("background-color: #ffc107; color: black;"); btn_editar.clicked.connect(self.cargar_para_editar)
         btn_eliminar = QPushButton("Eliminar Seleccionado"); btn_eliminar.setStyleSheet("background-color: #dc3545;"); btn_eliminar.clicked.connect(self.eliminar_insumo)
-        hbox_crud.addWidget(btn_editar); hbox_crud.addWidget(btn_eliminar); right_layout.addWidget(self.tabla_insumos); right_layout.addLayout(hbox_crud)
-        layout.addWidget(form_panel, 1); layout.addLayout(right_layout, 2); tab.setLayout(layout); self.tabs.addTab(tab, "INSUMOS"); self.cargar_unidades_combo(); self.cargar_tabla_insumos()
+        self.txt_filtrar_insumos = QLineEdit(); self.txt_filtrar_insumos.setPlaceholderText("Filtrar insumos..."); self.txt_filtrar_insumos.textChanged.connect(lambda t: self.tabla_insumos.filtrar(t, 1))
+        hbox_crud.addWidget(btn_editar); hbox_crud.addWidget(btn_eliminar); right_layout.addWidget(self.txt_filtrar_insumos); right_layout.addWidget(self.tabla_insumos); right_layout.addLayout(hbox_crud)
+        layout.addWidget(form_panel, 1); layout.addLayout(right_layout, 2); tab.setLayout(layout)
 
     def cargar_unidades_combo(self):
         id_c_p = self.cmb_uni_compra.currentData(); id_u_p = self.cmb_uni_uso.currentData(); self.cmb_uni_compra.clear(); self.cmb_uni_uso.clear()
-        for u in self.db.traer_datos("SELECT id, nombre FROM unidades"): self.cmb_uni_compra.addItem(u[1], u[0]); self.cmb_uni_uso.addItem(u[1], u[0])
+        for u in self.catalogo.obtener("unidades"): self.cmb_uni_compra.addItem(u[1], u[0]); self.cmb_uni_uso.addItem(u[1], u[0])
         if id_c_p: self.cmb_uni_compra.setCurrentIndex(self.cmb_uni_compra.findData(id_c_p))
         if id_u_p: self.cmb_uni_uso.setCurrentIndex(self.cmb_uni_uso.findData(id_u_p))
 
@@ -219,74 +380,89 @@ class SistemaCafeApp(QMainWindow):
         self.ins_nombre.clear(); self.ins_costo.clear(); self.ins_cant_envase.clear(); self.ins_factor.clear(); self.insumo_id_editar = None; self.btn_guardar.setText("Guardar Insumo"); self.btn_guardar.setStyleSheet("background-color: #28a745; color: white;"); self.tabla_insumos.clearSelection()
 
     def cargar_para_editar(self):
-        rows = self.tabla_insumos.selectionModel().selectedRows()
-        if not rows: return
-        reg = self.db.traer_datos("SELECT * FROM insumos WHERE id=?", (self.tabla_insumos.item(rows[0].row(), 0).text(),))[0]
+        fila = self.tabla_insumos.fila_seleccionada()
+        if not fila: return
+        reg = self.db.traer_datos("SELECT * FROM insumos WHERE id=?", (fila[0],))[0]
         self.insumo_id_editar = reg[0]; self.ins_nombre.setText(reg[1]); self.cmb_uni_compra.setCurrentIndex(self.cmb_uni_compra.findData(reg[2])); self.cmb_uni_uso.setCurrentIndex(self.cmb_uni_uso.findData(reg[3])); self.ins_cant_envase.setText(str(reg[4])); self.ins_costo.setText(str(reg[5])); self.ins_factor.setText(str(reg[6])); self.btn_guardar.setText("Actualizar Insumo"); self.btn_guardar.setStyleSheet("background-color: #007bff; color: white;")
 
     def eliminar_insumo(self):
-        rows = self.tabla_insumos.selectionModel().selectedRows()
-        if not rows: return
+        fila = self.tabla_insumos.fila_seleccionada()
+        if not fila: return
         if QMessageBox.question(self, "Confirmar", "¿Eliminar insumo?", QMessageBox.Yes|QMessageBox.No) == QMessageBox.Yes:
-            if self.db.ejecutar("DELETE FROM insumos WHERE id=?", (self.tabla_insumos.item(rows[0].row(), 0).text(),)): self.cargar_tabla_insumos(); self.limpiar_formulario_insumos()
+            if self.db.ejecutar("DELETE FROM insumos WHERE id=?", (fila[0],)): self.cargar_tabla_insumos(); self.limpiar_formulario_insumos()
 
     def guardar_insumo(self):
         try:
-            nombre = self.ins_nombre.text(); c_e = float(self.ins_costo.text()); cant_e = float(self.ins_cant_envase.text()); id_c = self.cmb_uni_compra.currentData(); id_u = self.cmb_uni_uso.currentData(); f = float(self.ins_factor.text()) if id_c != id_u else 1.0; r_r = math.floor(cant_e * f)
+            nombre = self.ins_nombre.text(); c_e = float(self.ins_costo.text()); cant_e = float(self.ins_cant_envase.text()); id_c = self.cmb_uni_compra.currentData(); id_u = self.cmb_uni_uso.currentData(); f = float(self.ins_factor.text()) if id_c != id_u else 1.0; r_r, c_u = calcular_costo_insumo(cant_e, c_e, f)
             if r_r == 0: return QMessageBox.warning(self, "Error", "El rendimiento da 0.")
-            c_u = c_e / r_r
             if self.insumo_id_editar is None: self.db.ejecutar('INSERT INTO insumos (nombre, unidad_compra_id, unidad_uso_id, cantidad_envase, costo_envase, factor_conversion, rendimiento_total, costo_unitario) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (nombre, id_c, id_u, cant_e, c_e, f, r_r, c_u))
             else: self.db.ejecutar('UPDATE insumos SET nombre=?, unidad_compra_id=?, unidad_uso_id=?, cantidad_envase=?, costo_envase=?, factor_conversion=?, rendimiento_total=?, costo_unitario=? WHERE id=?', (nombre, id_c, id_u, cant_e, c_e, f, r_r, c_u, self.insumo_id_editar))
             self.limpiar_formulario_insumos(); self.cargar_tabla_insumos(); QMessageBox.information(self, "Listo", f"Operación Exitosa\nCosto por Uso: ${c_u:.4f}")
         except ValueError: QMessageBox.warning(self, "Error", "Revisar los números.")
 
     def cargar_tabla_insumos(self):
-        self.tabla_insumos.setRowCount(0); query = 'SELECT i.id, i.nombre, (i.cantidad_envase || " " || u1.nombre), i.costo_envase, i.factor_conversion, (i.rendimiento_total || " " || u2.nombre), i.costo_unitario FROM insumos i JOIN unidades u1 ON i.unidad_compra_id = u1.id JOIN unidades u2 ON i.unidad_uso_id = u2.id ORDER BY i.id DESC'
-        for r, data in enumerate(self.db.traer_datos(query)):
-            self.tabla_insumos.insertRow(r)
-            for c, val in enumerate(data):
-                txt = f"${val:.4f}" if c == 6 else (f"${val:.2f}" if c == 3 else str(val))
-                self.tabla_insumos.setItem(r, c, NumericTableWidgetItem(txt) if c in [0,3,4,6] else QTableWidgetItem(txt))
-
-    def init_tab_config(self):
-        tab = QWidget(); layout = QGridLayout(); self.abm_subcategorias = ABMSubcategorias(self.db)
-        def cb(): self.abm_subcategorias.cargar_categorias(); self.abm_subcategorias.cargar_datos(); self.cargar_cat_prod()
+        query = 'SELECT i.id, i.nombre, (i.cantidad_envase || " " || u1.nombre), i.costo_envase, i.factor_conversion, (i.rendimiento_total || " " || u2.nombre), i.costo_unitario FROM insumos i JOIN unidades u1 ON i.unidad_compra_id = u1.id JOIN unidades u2 ON i.unidad_uso_id = u2.id ORDER BY i.id DESC'
+        self.tabla_insumos.cargar(query)
+
+    def init_tab_config(self, tab):
+        layout = QGridLayout(); self.abm_subcategorias = ABMSubcategorias(self.db, self.catalogo)
+        def cb():
+            self.abm_subcategorias.cargar_categorias(); self.abm_subcategorias.cargar_datos()
+            if 2 in self.tabs_construidas: self.cargar_cat_prod()
         self.abm_categorias = ABMSimple("Categorías", "categorias", self.db, callback_cambios=cb); self.abm_tamanos = ABMSimple("Tamaños", "tamanos", self.db); self.abm_unidades = ABMSimple("Unidades de Medida", "unidades", self.db)
-        layout.addWidget(self.abm_categorias, 0, 0); layout.addWidget(self.abm_subcategorias, 0, 1); layout.addWidget(self.abm_tamanos, 1, 0); layout.addWidget(self.abm_unidades, 1, 1); tab.setLayout(layout); self.tabs.addTab(tab, "CONFIGURACIÓN")
+        layout.addWidget(self.abm_categorias, 0, 0); layout.addWidget(self.abm_subcategorias, 0, 1); layout.addWidget(self.abm_tamanos, 1, 0); layout.addWidget(self.abm_unidades, 1, 1); tab.setLayout(layout)
 
-    def init_tab_productos(self):
-        tab = QWidget(); layout = QHBoxLayout(); col1 = QGroupBox("1. Seleccionar Producto"); l1 = QVBoxLayout(); self.lista_productos = QTableWidget(); self.lista_productos.setColumnCount(2); self.lista_productos.setHorizontalHeaderLabels(["ID", "Nombre"]); self.lista_productos.hideColumn(0); self.lista_productos.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.lista_productos.setSelectionBehavior(QAbstractItemView.SelectRows); self.lista_productos.setEditTriggers(QAbstractItemView.NoEditTriggers); self.lista_productos.itemClicked.connect(self.seleccionar_producto_crud); l1.addWidget(self.lista_productos); btn_n = QPushButton("Nuevo Producto"); btn_n.clicked.connect(self.limpiar_form_producto); l1.addWidget(btn_n); col1.setLayout(l1)
+    def init_tab_productos(self, tab):
+        layout = QHBoxLayout(); col1 = QGroupBox("1. Seleccionar Producto"); l1 = QVBoxLayout(); self.lista_productos = TablaConsulta(self.db, ["ID", "Nombre"]); self.lista_productos.hideColumn(0); self.lista_productos.clicked.connect(self.seleccionar_producto_crud); l1.addWidget(self.lista_productos); btn_n = QPushButton("Nuevo Producto"); btn_n.clicked.connect(self.limpiar_form_producto); l1.addWidget(btn_n); btn_lote = QPushButton("Clonar Tamaños en Lote"); btn_lote.setStyleSheet("background-color: #17a2b8; color: white;"); btn_lote.clicked.connect(self.clonar_en_lote); l1.addWidget(btn_lote); col1.setLayout(l1)
         col2 = QGroupBox("2. Definir Producto"); l2 = QVBoxLayout(); form_p = QFormLayout(); self.prod_nombre = QLineEdit(); self.prod_cat = QComboBox(); self.prod_subcat = QComboBox(); self.prod_cat.currentIndexChanged.connect(self.filtrar_subcats_prod); form_p.addRow("Nombre:", self.prod_nombre); form_p.addRow("Categoría:", self.prod_cat); form_p.addRow("Subcategoría:", self.prod_subcat); l2.addLayout(form_p); l2.addWidget(QLabel("<b>Pasos de la Receta:</b>")); self.lista_pasos = QListWidget(); l2.addWidget(self.lista_pasos); h_paso = QHBoxLayout(); self.txt_paso = QLineEdit(); self.txt_paso.setPlaceholderText("Describir paso..."); self.txt_paso.returnPressed.connect(self.agregar_paso); btn_ap = QPushButton("+"); btn_ap.setFixedWidth(40); btn_ap.clicked.connect(self.agregar_paso); btn_dp = QPushButton("-"); btn_dp.setFixedWidth(40); btn_dp.clicked.connect(self.borrar_paso); h_paso.addWidget(self.txt_paso); h_paso.addWidget(btn_ap); h_paso.addWidget(btn_dp); l2.addLayout(h_paso); h_bp = QHBoxLayout(); self.btn_guardar_prod = QPushButton("Guardar Producto"); self.btn_guardar_prod.clicked.connect(self.guardar_producto); self.btn_borrar_prod = QPushButton("Eliminar Producto"); self.btn_borrar_prod.setStyleSheet("background-color: #dc3545;"); self.btn_borrar_prod.clicked.connect(self.eliminar_producto); h_bp.addWidget(self.btn_guardar_prod); h_bp.addWidget(self.btn_borrar_prod); l2.addLayout(h_bp); col2.setLayout(l2)
-        col3 = QGroupBox("3. Ingredientes por Tamaño"); l3 = QVBoxLayout(); self.lbl_prod_sel = QLabel("Ningún producto seleccionado"); self.lbl_prod_sel.setStyleSheet("color: gray; font-style: italic;"); l3.addWidget(self.lbl_prod_sel); h_tam = QHBoxLayout(); self.sel_tamano = QComboBox(); btn_ht = QPushButton("Ver Tamaño"); btn_ht.clicked.connect(self.cargar_tabla_receta); h_tam.addWidget(self.sel_tamano); h_tam.addWidget(btn_ht); l3.addLayout(h_tam); self.btn_clonar = QPushButton("Copiar receta de otro tamaño"); self.btn_clonar.setStyleSheet("background-color: #17a2b8; color: white;"); self.btn_clonar.clicked.connect(self.clonar_receta_dialogo); l3.addWidget(self.btn_clonar); l3.addWidget(QLabel("<b>Gestión de Insumo:</b>")); h_ing = QHBoxLayout(); self.txt_buscar_insumo = QLineEdit(); self.txt_buscar_insumo.setPlaceholderText("Filtrar..."); self.txt_buscar_insumo.textChanged.connect(self.filtrar_insumos_receta); self.sel_insumo_receta = QComboBox(); self.sel_insumo_receta.setMinimumWidth(150); self.txt_cant_receta = QLineEdit(); self.txt_cant_receta.setPlaceholderText("Cant."); self.lbl_unidad_insumo = QLabel("u."); self.btn_add_ing = QPushButton("+"); self.btn_add_ing.clicked.connect(self.agregar_ingrediente); h_ing.addWidget(self.txt_buscar_insumo); h_ing.addWidget(self.sel_insumo_receta); h_ing.addWidget(self.txt_cant_receta); h_ing.addWidget(self.lbl_unidad_insumo); h_ing.addWidget(self.btn_add_ing); l3.addLayout(h_ing); self.sel_insumo_receta.currentIndexChanged.connect(self.actualizar_lbl_unidad); self.tabla_receta = QTableWidget(); self.tabla_receta.setColumnCount(5); self.tabla_receta.setHorizontalHeaderLabels(["ID_Ing", "ID_Ins", "Insumo", "Cantidad", "Costo"]); self.tabla_receta.hideColumn(0); self.tabla_receta.hideColumn(1); self.tabla_receta.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.tabla_receta.setSelectionBehavior(QAbstractItemView.SelectRows); self.tabla_receta.setEditTriggers(QAbstractItemView.NoEditTriggers); self.tabla_receta.itemClicked.connect(self.cargar_ingrediente_para_editar); l3.addWidget(self.tabla_receta); btn_di = QPushButton("Quitar Insumo Seleccionado"); btn_di.setStyleSheet("background-color: #ffc107; color: black;"); btn_di.clicked.connect(self.borrar_ingrediente)
-        l3.addWidget(btn_di); col3.setLayout(l3); col3.setEnabled(False); self.panel_ingredientes = col3; layout.addWidget(col1, 1); layout.addWidget(col2, 2); layout.addWidget(col3, 2); tab.setLayout(layout); self.tabs.addTab(tab, "RECETAS"); self.tabs.currentChanged.connect(self.al_cambiar_tab); self.sel_tamano.currentIndexChanged.connect(self.cargar_tabla_receta)
+        col3 = QGroupBox("3. Ingredientes por Tamaño"); l3 = QVBoxLayout(); self.lbl_prod_sel = QLabel("Ningún producto seleccionado"); self.lbl_prod_sel.setStyleSheet("color: gray; font-style: italic;"); l3.addWidget(self.lbl_prod_sel); h_tam = QHBoxLayout(); self.sel_tamano = QComboBox(); btn_ht = QPushButton("Ver Tamaño"); btn_ht.clicked.connect(self.cargar_tabla_receta); h_tam.addWidget(self.sel_tamano); h_tam.addWidget(btn_ht); l3.addLayout(h_tam); h_rend = QHBoxLayout(); self.txt_rendimiento = QLineEdit(); self.txt_rendimiento.setPlaceholderText("Rinde (si es preparación)"); self.cmb_unidad_rend = QComboBox(); btn_rend = QPushButton("Guardar Rendimiento"); btn_rend.clicked.connect(self.guardar_rendimiento); h_rend.addWidget(self.txt_rendimiento); h_rend.addWidget(self.cmb_unidad_rend); h_rend.addWidget(btn_rend); l3.addLayout(h_rend); self.btn_clonar = QPushButton("Copiar receta de otro tamaño"); self.btn_clonar.setStyleSheet("background-color: #17a2b8; color: white;"); self.btn_clonar.clicked.connect(self.clonar_receta_dialogo); l3.addWidget(self.btn_clonar); l3.addWidget(QLabel("<b>Gestión de Insumo o Preparación:</b>")); h_ing = QHBoxLayout(); self.txt_buscar_insumo = QLineEdit(); self.txt_buscar_insumo.setPlaceholderText("Filtrar..."); self.txt_buscar_insumo.textChanged.connect(self.filtrar_insumos_receta); self.sel_insumo_receta = QComboBox(); self.sel_insumo_receta.setMinimumWidth(150); self.txt_cant_receta = QLineEdit(); self.txt_cant_receta.setPlaceholderText("Cant."); self.lbl_unidad_insumo = QLabel("u."); self.btn_add_ing = QPushButton("+"); self.btn_add_ing.clicked.connect(self.agregar_ingrediente); h_ing.addWidget(self.txt_buscar_insumo); h_ing.addWidget(self.sel_insumo_receta); h_ing.addWidget(self.txt_cant_receta); h_ing.addWidget(self.lbl_unidad_insumo); h_ing.addWidget(self.btn_add_ing); l3.addLayout(h_ing); self.sel_insumo_receta.currentIndexChanged.connect(self.actualizar_lbl_unidad); self.tabla_receta = QTableWidget(); self.tabla_receta.setColumnCount(5); self.tabla_receta.setHorizontalHeaderLabels(["ID_Ing", "ID_Ins", "Insumo / Preparación", "Cantidad", "Costo"]); self.tabla_receta.hideColumn(0); self.tabla_receta.hideColumn(1); self.tabla_receta.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch); self.tabla_receta.setSelectionBehavior(QAbstractItemView.SelectRows); self.tabla_receta.setEditTriggers(QAbstractItemView.NoEditTriggers); self.tabla_receta.itemClicked.connect(self.cargar_ingrediente_para_editar); l3.addWidget(self.tabla_receta); btn_di = QPushButton("Quitar Insumo Seleccionado"); btn_di.setStyleSheet("background-color: #ffc107; color: black;"); btn_di.clicked.connect(self.borrar_ingrediente)
+        l3.addWidget(btn_di); col3.setLayout(l3); col3.setEnabled(False); self.panel_ingredientes = col3; layout.addWidget(col1, 1); layout.addWidget(col2, 2); layout.addWidget(col3, 2); tab.setLayout(layout); self.sel_tamano.currentIndexChanged.connect(self.cargar_tabla_receta)
 
     def al_cambiar_tab(self, index):
-        if index == 0: self.cargar_unidades_combo(); self.cargar_tabla_insumos()
-        if index == 1: self.abm_categorias.cargar_datos(); self.abm_tamanos.cargar_datos(); self.abm_unidades.cargar_datos(); self.abm_subcategorias.cargar_categorias(); self.abm_subcategorias.cargar_datos()
-        if index == 2: self.cargar_lista_productos(); self.cargar_cat_prod(); self.cargar_combos_ingredientes()
-        if index == 3: self.recargar_visor()
+        self.db.contexto = self.TABS[index]  # Las consultas quedan atribuidas a la pestaña que las origina
+        nueva = index not in self.tabs_construidas
+        if nueva:
+            self.constructores_tabs[index](self.tabs.widget(index)); self.tabs_construidas.add(index)
+        # Cada widget se vuelve a cargar solo si cambiaron las tablas que muestra desde la última vez; si no, cambiar de pestaña no consulta nada
+        c = self.catalogo
+        if index == 0:
+            if c.cambio("combos_unidades", "unidades"): self.cargar_unidades_combo()
+            if c.cambio("tabla_insumos", "insumos"): self.cargar_tabla_insumos()
+        if index == 1:
+            # Los ABM cargan sus datos al construirse: la primera vez solo se registra lo que muestran
+            for abm in (self.abm_categorias, self.abm_tamanos, self.abm_unidades):
+                if c.cambio(f"abm_{abm.tabla_bd}", abm.tabla_bd) and not nueva: abm.cargar_datos()
+            if c.cambio("abm_subcategorias_combo", "categorias") and not nueva: self.abm_subcategorias.cargar_categorias()
+            if c.cambio("abm_subcategorias", "subcategorias") and not nueva: self.abm_subcategorias.cargar_datos()
+        if index == 2:
+            if c.cambio("lista_productos", "productos"): self.cargar_lista_productos()
+            if c.cambio("categorias_producto", "categorias", "subcategorias"): self.cargar_cat_prod()
+            if c.cambio("combos_ingredientes", "tamanos", "unidades"): self.cargar_combos_ingredientes()
+            else: self.filtrar_insumos_receta()  # No hace nada si la lista de insumos y preparaciones no cambió
+        if index == 3:
+            if c.cambio("visor", "subcategorias", *TABLAS_RECETA): self.recargar_visor()
+        if nueva: self.cronometro.marcar(f"Pestaña {self.TABS[index]}")
 
     def cargar_cat_prod(self):
         self.prod_cat.clear(); self.prod_cat.addItem("- Sin Categoría -", None)
-        for c in self.db.traer_datos("SELECT id, nombre FROM categorias"): self.prod_cat.addItem(c[1], c[0])
+        for c in self.catalogo.obtener("categorias"): self.prod_cat.addItem(c[1], c[0])
         
     def filtrar_subcats_prod(self):
         self.prod_subcat.clear(); self.prod_subcat.addItem("- Sin Subcategoría -", None); c_id = self.prod_cat.currentData()
         if c_id:
-            for s in self.db.traer_datos("SELECT id, nombre FROM subcategorias WHERE categoria_id=?", (c_id,)): self.prod_subcat.addItem(s[1], s[0])
+            for s in self.catalogo.obtener("subcategorias"):
+                if s[3] == c_id: self.prod_subcat.addItem(s[1], s[0])
 
     def cargar_lista_productos(self):
-        self.lista_productos.setRowCount(0)
-        for r, (pid, nom) in enumerate(self.db.traer_datos("SELECT id, nombre FROM productos ORDER BY nombre")):
-            self.lista_productos.insertRow(r); self.lista_productos.setItem(r, 0, QTableWidgetItem(str(pid))); self.lista_productos.setItem(r, 1, QTableWidgetItem(nom))
+        self.lista_productos.cargar("SELECT id, nombre FROM productos ORDER BY nombre")
 
     def limpiar_form_producto(self):
         self.producto_seleccionado_id = None; self.prod_nombre.clear(); self.prod_cat.setCurrentIndex(0); self.prod_subcat.setCurrentIndex(0); self.lista_pasos.clear(); self.lista_productos.clearSelection(); self.panel_ingredientes.setEnabled(False); self.lbl_prod_sel.setText("Nuevo Producto (Sin guardar)"); self.btn_guardar_prod.setText("Crear Producto"); self.btn_borrar_prod.setEnabled(False)
 
     def seleccionar_producto_crud(self):
-        row = self.lista_productos.currentRow()
-        if row < 0: return
-        pid = int(self.lista_productos.item(row, 0).text()); self.producto_seleccionado_id = pid; data = self.db.traer_datos("SELECT nombre, categoria_id, subcategoria_id FROM productos WHERE id=?", (pid,))[0]; self.prod_nombre.setText(data[0]); self.prod_cat.setCurrentIndex(self.prod_cat.findData(data[1])); self.prod_subcat.setCurrentIndex(self.prod_subcat.findData(data[2])); self.lista_pasos.clear()
+        fila = self.lista_productos.fila_seleccionada()
+        if not fila: return
+        pid = fila[0]; self.producto_seleccionado_id = pid; data = self.db.traer_datos("SELECT nombre, categoria_id, subcategoria_id FROM productos WHERE id=?", (pid,))[0]; self.prod_nombre.setText(data[0]); self.prod_cat.setCurrentIndex(self.prod_cat.findData(data[1])); self.prod_subcat.setCurrentIndex(self.prod_subcat.findData(data[2])); self.lista_pasos.clear()
         for p in self.db.traer_datos("SELECT descripcion FROM receta_pasos WHERE producto_id=? ORDER BY orden", (pid,)): self.lista_pasos.addItem(p[0])
         self.panel_ingredientes.setEnabled(True); self.lbl_prod_sel.setText(f"Editando: {data[0]}"); self.btn_guardar_prod.setText("Actualizar Producto"); self.btn_borrar_prod.setEnabled(True); self.cargar_tabla_receta()
 
@@ -299,25 +475,34 @@ class SistemaCafeApp(QMainWindow):
 
     def guardar_producto(self):
         if not self.prod_nombre.text(): return QMessageBox.warning(self, "Error", "Falta el nombre")
-        if self.producto_seleccionado_id is None:
-            self.db.ejecutar("INSERT INTO productos (nombre, categoria_id, subcategoria_id) VALUES (?,?,?)", (self.prod_nombre.text(), self.prod_cat.currentData(), self.prod_subcat.currentData())); self.producto_seleccionado_id = self.db.cursor.lastrowid
-        else: self.db.ejecutar("UPDATE productos SET nombre=?, categoria_id=?, subcategoria_id=? WHERE id=?", (self.prod_nombre.text(), self.prod_cat.currentData(), self.prod_subcat.currentData(), self.producto_seleccionado_id))
-        self.db.ejecutar("DELETE FROM receta_pasos WHERE producto_id=?", (self.producto_seleccionado_id,))
-        for i in range(self.lista_pasos.count()): self.db.ejecutar("INSERT INTO receta_pasos (producto_id, orden, descripcion) VALUES (?,?,?)", (self.producto_seleccionado_id, i+1, self.lista_pasos.item(i).text()))
-        self.cargar_lista_productos(); self.panel_ingredientes.setEnabled(True); self.btn_guardar_prod.setText("Actualizar Producto"); QMessageBox.information(self, "Éxito", "Producto Guardado")
+        pid = self.producto_seleccionado_id
+        try:
+            with self.db.transaccion():  # Producto y pasos en un solo commit
+                if pid is None:
+                    self.db.ejecutar("INSERT INTO productos (nombre, categoria_id, subcategoria_id) VALUES (?,?,?)", (self.prod_nombre.text(), self.prod_cat.currentData(), self.prod_subcat.currentData())); pid = self.db.cursor.lastrowid
+                else: self.db.ejecutar("UPDATE productos SET nombre=?, categoria_id=?, subcategoria_id=? WHERE id=?", (self.prod_nombre.text(), self.prod_cat.currentData(), self.prod_subcat.currentData(), pid))
+                self.db.guardar_pasos(pid, [self.lista_pasos.item(i).text() for i in range(self.lista_pasos.count())])
+        except sqlite3.Error as e: return QMessageBox.warning(self, "Error", f"No se pudo guardar el producto: {e}")
+        self.producto_seleccionado_id = pid; self.cargar_lista_productos(); self.panel_ingredientes.setEnabled(True); self.btn_guardar_prod.setText("Actualizar Producto"); QMessageBox.information(self, "Éxito", "Producto Guardado")
 
     def eliminar_producto(self):
         if self.producto_seleccionado_id and QMessageBox.question(self, "Eliminar", "¿Borrar producto y recetas?", QMessageBox.Yes|QMessageBox.No) == QMessageBox.Yes:
-            self.db.ejecutar("DELETE FROM productos WHERE id=?", (self.producto_seleccionado_id,)); self.limpiar_form_producto(); self.cargar_lista_productos()
+            if not self.db.ejecutar("DELETE FROM productos WHERE id=?", (self.producto_seleccionado_id,)): return QMessageBox.warning(self, "Error", "No se pudo borrar: alguna de sus recetas se usa como preparación en otra.")
+            self.limpiar_form_producto(); self.cargar_lista_productos()
 
     def cargar_combos_ingredientes(self):
-        self.sel_tamano.clear()
-        for t in self.db.traer_datos("SELECT id, nombre FROM tamanos"): self.sel_tamano.addItem(t[1], t[0])
+        self.sel_tamano.clear(); self.cmb_unidad_rend.clear()
+        for t in self.catalogo.obtener("tamanos"): self.sel_tamano.addItem(t[1], t[0])
+        for u in self.catalogo.obtener("unidades"): self.cmb_unidad_rend.addItem(u[1], u[0])
         self.filtrar_insumos_receta()
 
     def filtrar_insumos_receta(self):
-        t = self.txt_buscar_insumo.text(); self.sel_insumo_receta.clear(); ings = self.db.buscar_insumos(t) if len(t) >= 1 else self.db.traer_datos("SELECT i.id, i.nombre, u.nombre FROM insumos i JOIN unidades u ON i.unidad_uso_id = u.id")
-        for i in ings: self.sel_insumo_receta.addItem(i[1], {"id": i[0], "unidad": i[2]})
+        # El combo se reconstruye solo si cambió el filtro o los datos; sin filtro, las listas salen del catálogo compartido
+        t = self.txt_buscar_insumo.text()
+        if not self.catalogo.cambio("selector_insumos", "insumos", "subrecetas", filtro=t): return
+        self.sel_insumo_receta.clear(); ings, subs = (self.db.buscar_insumos(t), self.db.buscar_subrecetas(t)) if t else (self.catalogo.obtener("insumos"), self.catalogo.obtener("subrecetas"))
+        for i in ings: self.sel_insumo_receta.addItem(i[1], {"tipo": "insumo", "id": i[0], "unidad": i[2]})
+        for r in subs: self.sel_insumo_receta.addItem(f"{r[1]} [preparación]", {"tipo": "receta", "id": r[0], "unidad": r[2]})
         self.actualizar_lbl_unidad()
 
     def clonar_receta_dialogo(self):
@@ -325,14 +510,21 @@ class SistemaCafeApp(QMainWindow):
         tamanos = self.db.traer_datos(query, (self.producto_seleccionado_id, t_id))
         if not tamanos: return QMessageBox.information(self, "Aviso", "No hay otras recetas para copiar.")
         items = [t[1] for t in tamanos]; item, ok = QInputDialog.getItem(self, "Clonar", "Copiar DESDE:", items, 0, False)
-        if ok and item: self.ejecutar_clonado(tamanos[items.index(item)][0], t_id)
-
-    def ejecutar_clonado(self, d_id, h_id):
-        self.db.ejecutar("INSERT OR IGNORE INTO receta_config (producto_id, tamano_id) VALUES (?,?)", (self.producto_seleccionado_id, h_id)); c_d = self.db.traer_datos("SELECT id FROM receta_config WHERE producto_id=? AND tamano_id=?", (self.producto_seleccionado_id, d_id))[0][0]; c_h = self.db.traer_datos("SELECT id FROM receta_config WHERE producto_id=? AND tamano_id=?", (self.producto_seleccionado_id, h_id))[0][0]
-        for row in self.db.traer_datos("SELECT insumo_id, cantidad_necesaria FROM receta_ingredientes WHERE receta_config_id=?", (c_d,)):
-            self.db.ejecutar("INSERT INTO receta_ingredientes (receta_config_id, insumo_id, cantidad_necesaria) VALUES (?, ?, ?)", (c_h, row[0], row[1]))
+        if not ok or not item: return
+        mult, ok = QInputDialog.getDouble(self, "Clonar", "Multiplicar cantidades por:", 1.0, 0.001, 1000, 3)
+        if not ok: return
+        if self.tabla_receta.rowCount() > 1 and QMessageBox.question(self, "Clonar", "Este tamaño ya tiene ingredientes. ¿Reemplazarlos?", QMessageBox.Yes|QMessageBox.No) != QMessageBox.Yes: return
+        self.ejecutar_clonado(tamanos[items.index(item)][0], t_id, mult)
+
+    def ejecutar_clonado(self, d_id, h_id, multiplicador=1.0):
+        try: self.db.clonar_receta(self.producto_seleccionado_id, d_id, h_id, multiplicador)
+        except sqlite3.Error as e: QMessageBox.warning(self, "Error", f"No se pudo clonar: {e}")
         self.cargar_tabla_receta()
 
+    def clonar_en_lote(self):
+        dialogo = DialogoClonado(self.db, self.catalogo, self); dialogo.exec_()
+        if dialogo.aplicado and self.producto_seleccionado_id: self.cargar_tabla_receta()
+
     def actualizar_lbl_unidad(self):
         d = self.sel_insumo_receta.currentData()
         if d: self.lbl_unidad_insumo.setText(d["unidad"])
@@ -341,27 +533,47 @@ class SistemaCafeApp(QMainWindow):
         row = self.tabla_receta.currentRow()
         if row < 0 or row >= self.tabla_receta.rowCount() - 1: return
         self.id_ingrediente_editar = int(self.tabla_receta.item(row, 0).text())
-        ins_id = int(self.tabla_receta.item(row, 1).text())
-        cant = self.tabla_receta.item(row, 3).text().split(' ')[0]
-        self.txt_buscar_insumo.setText(self.tabla_receta.item(row, 2).text())
+        tipo, ing_id = self.tabla_receta.item(row, 1).text().split(':'); ing_id = int(ing_id)
+        cant = self.tabla_receta.item(row, 3).text().split(' ')[0]; nombre = self.tabla_receta.item(row, 2).text()
+        self.txt_buscar_insumo.setText(nombre.rsplit(' (', 1)[0] if tipo == "receta" else nombre)  # Las preparaciones se filtran por nombre de producto
         for i in range(self.sel_insumo_receta.count()):
-            if self.sel_insumo_receta.itemData(i)['id'] == ins_id: self.sel_insumo_receta.setCurrentIndex(i); break
+            d = self.sel_insumo_receta.itemData(i)
+            if d['tipo'] == tipo and d['id'] == ing_id: self.sel_insumo_receta.setCurrentIndex(i); break
         self.txt_cant_receta.setText(cant); self.btn_add_ing.setText("Actualizar"); self.btn_add_ing.setStyleSheet("background-color: #007bff;")
 
     def agregar_ingrediente(self):
         if not self.producto_seleccionado_id: return
         t_id = self.sel_tamano.currentData(); d = self.sel_insumo_receta.currentData(); c = self.txt_cant_receta.text()
         if not d or not c: return
-        self.db.ejecutar("INSERT OR IGNORE INTO receta_config (producto_id, tamano_id) VALUES (?,?)", (self.producto_seleccionado_id, t_id)); rc_id = self.db.traer_datos("SELECT id FROM receta_config WHERE producto_id=? AND tamano_id=?", (self.producto_seleccionado_id, t_id))[0][0]
-        
-        if self.id_ingrediente_editar:
-            self.db.ejecutar("UPDATE receta_ingredientes SET insumo_id=?, cantidad_necesaria=? WHERE id=?", (d['id'], float(c), self.id_ingrediente_editar))
-            self.id_ingrediente_editar = None
-        else:
-            self.db.ejecutar("INSERT INTO receta_ingredientes (receta_config_id, insumo_id, cantidad_necesaria) VALUES (?,?,?)", (rc_id, d['id'], float(c)))
+        ins_id, sub_id = (d['id'], None) if d['tipo'] == "insumo" else (None, d['id'])
+        try:
+            with self.db.transaccion():
+                self.db.ejecutar("INSERT OR IGNORE INTO receta_config (producto_id, tamano_id) VALUES (?,?)", (self.producto_seleccionado_id, t_id)); rc_id = self.db.traer_datos("SELECT id FROM receta_config WHERE producto_id=? AND tamano_id=?", (self.producto_seleccionado_id, t_id))[0][0]
+                if sub_id and self.db.crea_ciclo(rc_id, sub_id): raise ValueError("esa preparación ya contiene esta receta.")
+
+                if self.id_ingrediente_editar:
+                    self.db.ejecutar("UPDATE receta_ingredientes SET insumo_id=?, subreceta_id=?, cantidad_necesaria=? WHERE id=?", (ins_id, sub_id, float(c), self.id_ingrediente_editar))
+                    self.id_ingrediente_editar = None
+                else:
+                    self.db.ejecutar("INSERT INTO receta_ingredientes (receta_config_id, insumo_id, subreceta_id, cantidad_necesaria) VALUES (?,?,?,?)", (rc_id, ins_id, sub_id, float(c)))
+        except (ValueError, sqlite3.Error) as e: return QMessageBox.warning(self, "Error", f"No se pudo guardar el ingrediente: {e}")
         
         self.txt_cant_receta.clear(); self.btn_add_ing.setText("+"); self.btn_add_ing.setStyleSheet("background-color: #28a745;"); self.cargar_tabla_receta()
 
+    def guardar_rendimiento(self):
+        # Con rendimiento la receta queda disponible como preparación para otras recetas; vacío la retira
+        if not self.producto_seleccionado_id or not self.sel_tamano.currentData(): return
+        p_id, t_id = self.producto_seleccionado_id, self.sel_tamano.currentData(); t = self.txt_rendimiento.text().strip()
+        try: rend = float(t) if t else None
+        except ValueError: return QMessageBox.warning(self, "Error", "Revisar el rendimiento.")
+        if rend is not None and rend <= 0: return QMessageBox.warning(self, "Error", "El rendimiento debe ser mayor a 0.")
+        if rend is None and self.db.traer_datos("SELECT 1 FROM receta_ingredientes ri JOIN receta_config rc ON ri.subreceta_id = rc.id WHERE rc.producto_id=? AND rc.tamano_id=? LIMIT 1", (p_id, t_id)):
+            return QMessageBox.warning(self, "Error", "Esta preparación se usa en otras recetas.")
+        with self.db.transaccion():
+            self.db.ejecutar("INSERT OR IGNORE INTO receta_config (producto_id, tamano_id) VALUES (?,?)", (p_id, t_id))
+            self.db.ejecutar("UPDATE receta_config SET rendimiento=?, unidad_rendimiento_id=? WHERE producto_id=? AND tamano_id=?", (rend, self.cmb_unidad_rend.currentData() if rend else None, p_id, t_id))
+        self.filtrar_insumos_receta(); QMessageBox.information(self, "Listo", "Rendimiento guardado")
+
     def borrar_ingrediente(self):
         row = self.tabla_receta.currentRow()
         if row >= 0 and row < self.tabla_receta.rowCount() - 1:
@@ -371,25 +583,28 @@ class SistemaCafeApp(QMainWindow):
 
     def cargar_tabla_receta(self):
         self.tabla_receta.setRowCount(0); self.btn_add_ing.setText("+"); self.btn_add_ing.setStyleSheet("background-color: #28a745;"); self.id_ingrediente_editar = None
+        self.txt_rendimiento.clear()
         if not self.producto_seleccionado_id or not self.sel_tamano.currentData(): return
-        query = 'SELECT ri.id, ri.insumo_id, i.nombre, ri.cantidad_necesaria, u.nombre, i.costo_unitario FROM receta_ingredientes ri JOIN insumos i ON ri.insumo_id = i.id JOIN unidades u ON i.unidad_uso_id = u.id JOIN receta_config rc ON ri.receta_config_id = rc.id WHERE rc.producto_id = ? AND rc.tamano_id = ?'
-        datos = self.db.traer_datos(query, (self.producto_seleccionado_id, self.sel_tamano.currentData())); total = 0
+        rend = self.db.traer_datos("SELECT rendimiento, unidad_rendimiento_id FROM receta_config WHERE producto_id=? AND tamano_id=?", (self.producto_seleccionado_id, self.sel_tamano.currentData()))
+        if rend and rend[0][0]: self.txt_rendimiento.setText(f"{rend[0][0]:g}"); self.cmb_unidad_rend.setCurrentIndex(max(0, self.cmb_unidad_rend.findData(rend[0][1])))
+        datos = self.db.ingredientes_receta(self.producto_seleccionado_id, self.sel_tamano.currentData()); total = 0
         for i, row in enumerate(datos):
-            self.tabla_receta.insertRow(i); cp = row[3] * row[5]; total += cp
-            self.tabla_receta.setItem(i, 0, QTableWidgetItem(str(row[0]))); self.tabla_receta.setItem(i, 1, QTableWidgetItem(str(row[1])))
-            self.tabla_receta.setItem(i, 2, QTableWidgetItem(row[2])); self.tabla_receta.setItem(i, 3, QTableWidgetItem(f"{row[3]} {row[4]}")); self.tabla_receta.setItem(i, 4, QTableWidgetItem(f"${cp:.2f}"))
+            self.tabla_receta.insertRow(i); cp = row[4] * row[6]; total += cp; clave = f"insumo:{row[1]}" if row[2] is None else f"receta:{row[2]}"
+            self.tabla_receta.setItem(i, 0, QTableWidgetItem(str(row[0]))); self.tabla_receta.setItem(i, 1, QTableWidgetItem(clave))
+            self.tabla_receta.setItem(i, 2, QTableWidgetItem(row[3])); self.tabla_receta.setItem(i, 3, QTableWidgetItem(f"{row[4]} {row[5]}")); self.tabla_receta.setItem(i, 4, QTableWidgetItem(f"${cp:.2f}"))
         r = self.tabla_receta.rowCount(); self.tabla_receta.insertRow(r); self.tabla_receta.setItem(r, 2, QTableWidgetItem("TOTAL:")); self.tabla_receta.setItem(r, 4, QTableWidgetItem(f"${total:.2f}"))
 
     # --- INICIO DE CAMBIOS EN PESTAÑA RECETARIO ---
-    def init_tab_visor(self):
-        tab = QWidget(); layout = QVBoxLayout()
+    def init_tab_visor(self, tab):
+        layout = QVBoxLayout()
         
         # Panel de búsqueda y filtros con fuentes más grandes
         search_layout = QHBoxLayout()
         self.txt_buscar_visor = QLineEdit()
         self.txt_buscar_visor.setPlaceholderText("Buscar por nombre, categoría o subcategoría...")
         self.txt_buscar_visor.setStyleSheet("font-size: 16px; padding: 8px;")
-        self.txt_buscar_visor.textChanged.connect(self.recargar_visor) # Filtra en tiempo real
+        self.buscador_visor = BuscadorVisor(self.db.db_name, instrumentacion=self.db.instrumentacion); self.buscador_visor.resultados.connect(self.aplicar_busqueda_visor)
+        self.txt_buscar_visor.textChanged.connect(self.buscador_visor.buscar) # Filtra mientras se escribe, fuera del hilo de la interfaz
         
         self.v_prod = QComboBox()
         self.v_tam = QComboBox()
@@ -405,52 +620,37 @@ class SistemaCafeApp(QMainWindow):
         self.v_text.setReadOnly(True)
         f_visor = QFont(); f_visor.setPointSize(16); self.v_text.setFont(f_visor)
         
-        layout.addLayout(search_layout); layout.addWidget(self.v_text); tab.setLayout(layout); self.tabs.addTab(tab, "RECETARIO")
+        layout.addLayout(search_layout); layout.addWidget(self.v_text); tab.setLayout(layout)
         self.v_prod.currentIndexChanged.connect(self.cargar_tams_visor); self.v_tam.currentIndexChanged.connect(self.mostrar_receta_final)
 
     def recargar_visor(self):
         texto = self.txt_buscar_visor.text()
-        self.v_prod.clear()
-        # Query que filtra por nombre del producto, nombre de categoría o nombre de subcategoría
-        query = """
-            SELECT p.id, p.nombre 
-            FROM productos p
-            LEFT JOIN categorias c ON p.categoria_id = c.id
-            LEFT JOIN subcategorias s ON p.subcategoria_id = s.id
-            WHERE p.nombre LIKE ? OR c.nombre LIKE ? OR s.nombre LIKE ?
-            ORDER BY p.nombre
-        """
-        params = (f'%{texto}%', f'%{texto}%', f'%{texto}%')
-        for p in self.db.traer_datos(query, params): 
+        # Búsqueda indexada (FTS5) por nombre del producto, de la categoría o de la subcategoría
+        self.buscador_visor.cancelar(); self.aplicar_busqueda_visor(texto, self.db.buscar_productos(texto))
+
+    def aplicar_busqueda_visor(self, texto, filas):
+        # Se llena el combo sin señales y se dispara una sola carga de tamaños/receta
+        self.v_prod.blockSignals(True); self.v_prod.clear()
+        for p in filas: 
             self.v_prod.addItem(p[1], p[0])
+        self.v_prod.blockSignals(False); self.cargar_tams_visor()
 
     def cargar_tams_visor(self):
-        self.v_tam.clear(); p_id = self.v_prod.currentData()
+        self.v_tam.blockSignals(True); self.v_tam.clear(); p_id = self.v_prod.currentData()
         if p_id:
             for t in self.db.traer_datos("SELECT t.id, t.nombre FROM receta_config rc JOIN tamanos t ON rc.tamano_id = t.id WHERE rc.producto_id=?", (p_id,)): self.v_tam.addItem(t[1], t[0])
+        self.v_tam.blockSignals(False); self.mostrar_receta_final()
 
     def mostrar_receta_final(self):
         p_id = self.v_prod.currentData(); t_id = self.v_tam.currentData()
         if not p_id: return self.v_text.clear()
-        p = self.db.traer_datos("SELECT nombre, (SELECT nombre FROM categorias WHERE id=productos.categoria_id) FROM productos WHERE id=?", (p_id,))[0]
-        
-        # Estilos HTML ajustados para letra más legible
-        html = f"<h1 style='color:#007BFF; font-size: 28px;'>{p[0]}</h1>"
-        html += f"<p style='font-size: 18px;'><b>Categoría:</b> {p[1] if p[1] else 'General'}</p><hr>"
-        
-        if t_id:
-            html += "<h3 style='color:#28a745; font-size: 22px;'>INGREDIENTES:</h3><ul style='font-size: 18px;'>"
-            ings = self.db.traer_datos('SELECT i.nombre, r.cantidad_necesaria, u.nombre, i.costo_unitario FROM receta_ingredientes r JOIN insumos i ON r.insumo_id = i.id JOIN unidades u ON i.unidad_uso_id = u.id JOIN receta_config rc ON r.receta_config_id = rc.id WHERE rc.producto_id = ? AND rc.tamano_id = ?', (p_id, t_id)); costo = 0
-            for ing in ings: 
-                html += f"<li><b>{ing[0]}:</b> {ing[1]} {ing[2]}</li>"; costo += ing[1] * ing[3]
-            html += f"</ul><p style='font-size: 18px;'><i>Costo estimado: ${costo:.2f}</i></p>"
-            
-        html += "<hr><h3 style='color:#17a2b8; font-size: 22px;'>PREPARACIÓN:</h3><ol style='font-size: 18px;'>"
-        pasos = self.db.traer_datos("SELECT descripcion FROM receta_pasos WHERE producto_id=? ORDER BY orden", (p_id,))
-        for paso in pasos: 
-            html += f"<li>{paso[0]}</li>"
-        html += "</ol>"; self.v_text.setHtml(html)
+        # Documento en caché mientras no cambien producto, pasos, ingredientes ni costos
+        self.v_text.setHtml(self.cache_recetas.obtener(p_id, t_id))
     # --- FIN DE CAMBIOS ---
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv); window = SistemaCafeApp(); window.show(); sys.exit(app.exec_())
\ No newline at end of file
+    cronometro = Cronometro(); app = QApplication(sys.argv); cronometro.marcar("QApplication")
+    window = SistemaCafeApp(cronometro); window.show(); cronometro.marcar("Ventana visible")
+    if "--tiempos" in sys.argv or os.environ.get("RECETARIO_TIEMPOS"):
+        QTimer.singleShot(0, lambda: (cronometro.marcar("Primer ciclo de eventos"), print(cronometro.reporte())))
+    sys.exit(app.exec_())
\ No newline at end of file
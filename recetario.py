@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+# Tablas de las que depende el documento de una receta; mientras no cambie ninguna, la versión en caché vale sin consultar la BD
+TABLAS_RECETA = ("productos", "categorias", "tamanos", "receta_pasos", "receta_config", "receta_ingredientes", "receta_costos", "insumos", "unidades")
+
+# Versiones que mantienen los triggers: la del producto y la de su receta para el tamaño (sin receta, id y versión quedan en NULL)
+CONSULTA_VERSION = "SELECT p.version, rc.id, rc.version FROM productos p LEFT JOIN receta_config rc ON rc.producto_id = p.id AND rc.tamano_id = ? WHERE p.id = ?"
+
+def datos_receta(db, p_id, t_id):
+    p = db.traer_datos("SELECT nombre, (SELECT nombre FROM categorias WHERE id=productos.categoria_id) FROM productos WHERE id=?", (p_id,))
+    if not p: return None
+    ings = [r[3:] for r in db.ingredientes_receta(p_id, t_id)] if t_id else None
+    pasos = [r[0] for r in db.traer_datos("SELECT descripcion FROM receta_pasos WHERE producto_id=? ORDER BY orden", (p_id,))]
+    return p[0][0], p[0][1], ings, pasos
+
+def renderizar_receta(nombre, categoria, ings, pasos):
+    # ings es None cuando no hay tamaño seleccionado
+    # Estilos HTML ajustados para letra más legible
+    html = f"<h1 style='color:#007BFF; font-size: 28px;'>{nombre}</h1>"
+    html += f"<p style='font-size: 18px;'><b>Categoría:</b> {categoria if categoria else 'General'}</p><hr>"
+
+    if ings is not None:
+        html += "<h3 style='color:#28a745; font-size: 22px;'>INGREDIENTES:</h3><ul style='font-size: 18px;'>"; costo = 0
+        for ing in ings:
+            html += f"<li><b>{ing[0]}:</b> {ing[1]} {ing[2]}</li>"; costo += ing[1] * ing[3]
+        html += f"</ul><p style='font-size: 18px;'><i>Costo estimado: ${costo:.2f}</i></p>"
+
+    html += "<hr><h3 style='color:#17a2b8; font-size: 22px;'>PREPARACIÓN:</h3><ol style='font-size: 18px;'>"
+    for paso in pasos:
+        html += f"<li>{paso}</li>"
+    return html + "</ol>"
+
+class CacheRecetas:
+    # LRU de documentos ya renderizados por (producto_id, tamano_id). Mientras no cambie ninguna tabla de TABLAS_RECETA la entrada vale sin
+    # consultar nada; si cambió alguna, una consulta trae la versión del producto y la de su receta (ver crear_versiones_receta) y solo se
+    # vuelve a renderizar si cambiaron: dar de alta un insumo o editar otro producto no invalida las demás recetas
+    def __init__(self, db, capacidad=64):
+        self.db = db; self.capacidad = capacidad; self.entradas = OrderedDict(); self.aciertos = 0; self.fallos = 0
+
+    def obtener(self, p_id, t_id):
+        clave = (p_id, t_id); tablas = (self.db.version(*TABLAS_RECETA), self.db.version_externa()); entrada = self.entradas.get(clave)
+        if entrada and entrada[0] != tablas:
+            if entrada[1] == self.db.traer_datos(CONSULTA_VERSION, (t_id, p_id)): entrada[0] = tablas
+            else: entrada = None
+        if entrada:
+            self.entradas.move_to_end(clave); self.aciertos += 1
+            return entrada[2]
+        self.fallos += 1; version = self.db.traer_datos(CONSULTA_VERSION, (t_id, p_id)); datos = datos_receta(self.db, p_id, t_id)
+        html = renderizar_receta(*datos) if datos else ""
+        self.entradas[clave] = [tablas, version, html]; self.entradas.move_to_end(clave)
+        if len(self.entradas) > self.capacidad: self.entradas.popitem(last=False)
+        return html
+
+    def limpiar(self):
+        self.entradas.clear()
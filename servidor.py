@@ -0,0 +1,210 @@
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from database import DataBase
+from recetario import datos_receta
+from costeo import MatrizCostos, PlanCompra, COLUMNAS_CSV, COLUMNAS_COMPRA, calcular_costo_insumo, costo_receta_a_fecha, fecha_limite
+
+ESTADOS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+MAX_CUERPO = 1 << 20
+
+class ErrorHTTP(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje); self.estado = estado
+
+def entero(valor, nombre, minimo=None):
+    try: n = int(valor)
+    except (TypeError, ValueError): raise ErrorHTTP(400, f"{nombre} debe ser un número entero")
+    if minimo is not None and n < minimo: raise ErrorHTTP(400, f"{nombre} no puede ser menor que {minimo}")
+    return n
+
+def fecha_param(params):
+    # ?fecha= opcional; una fecha mal escrita es un 400, no un costo calculado contra un texto sin sentido
+    fecha = params.get("fecha")
+    try:
+        if fecha: fecha_limite(fecha)
+    except ValueError as e: raise ErrorHTTP(400, str(e))
+    return fecha or None
+
+# Cada endpoint recibe (db, parámetros de la URL, cuerpo JSON, *grupos de la ruta) y corre en un hilo con su propia conexión
+def buscar_productos(db, params, datos):
+    limite = entero(params.get("limite", 50), "limite", 0)
+    return [{"id": r[0], "nombre": r[1]} for r in db.buscar_productos(params.get("q", ""))[:limite]]
+
+def buscar_insumos(db, params, datos):
+    limite = entero(params.get("limite", 50), "limite", 0)
+    return [{"id": r[0], "nombre": r[1], "unidad": r[2]} for r in db.buscar_insumos(params.get("q", ""))[:limite]]
+
+def producto(db, params, datos, p_id):
+    p_id = entero(p_id, "producto"); d = datos_receta(db, p_id, None)
+    if not d: raise ErrorHTTP(404, "Producto inexistente")
+    tamanos = db.traer_datos('''SELECT t.id, t.nombre, COALESCE(rco.costo, 0), rc.rendimiento FROM receta_config rc JOIN tamanos t ON rc.tamano_id = t.id
+        LEFT JOIN receta_costos rco ON rco.receta_config_id = rc.id WHERE rc.producto_id = ? ORDER BY t.id''', (p_id,))
+    return {"id": p_id, "nombre": d[0], "categoria": d[1], "pasos": d[3], "tamanos": [{"id": t[0], "nombre": t[1], "costo": t[2], "rendimiento": t[3]} for t in tamanos]}
+
+def receta(db, params, datos, p_id, t_id):
+    p_id = entero(p_id, "producto"); t_id = entero(t_id, "tamaño"); d = datos_receta(db, p_id, None)
+    if not d: raise ErrorHTTP(404, "Producto inexistente")
+    ings = db.ingredientes_receta(p_id, t_id)
+    if not ings and not db.traer_datos("SELECT 1 FROM receta_config WHERE producto_id=? AND tamano_id=?", (p_id, t_id)): raise ErrorHTTP(404, "No hay receta para ese tamaño")
+    fecha = fecha_param(params); costo = costo_receta_a_fecha(db, p_id, t_id, fecha) if fecha else db.costo_receta(p_id, t_id)
+    return {"producto_id": p_id, "tamano_id": t_id, "nombre": d[0], "categoria": d[1], "pasos": d[3], "costo": costo, "fecha": fecha,
+            "ingredientes": [{"nombre": r[3], "cantidad": r[4], "unidad": r[5], "costo_unitario": r[6], "insumo_id": r[1], "subreceta_id": r[2]} for r in ings]}
+
+def costos(db, params, datos):
+    return [dict(zip(COLUMNAS_CSV, f)) for f in MatrizCostos.calcular(db, fecha_param(params))]
+
+def compras(db, params, datos):
+    # Cuerpo: {"pedidos": [{"producto_id": .., "tamano_id": .., "cantidad": ..}, ...]}
+    try: pedidos = [(int(p["producto_id"]), int(p["tamano_id"]), float(p["cantidad"])) for p in (datos or {})["pedidos"]]
+    except (KeyError, TypeError, ValueError): raise ErrorHTTP(400, "Se espera {\"pedidos\": [{\"producto_id\", \"tamano_id\", \"cantidad\"}]}")
+    plan = PlanCompra.calcular(db, pedidos)
+    return {"lineas": [dict(zip(COLUMNAS_COMPRA, l)) for l in plan.lineas], "total": plan.total, "sin_receta": plan.sin_receta,
+            "omitidas": [{"receta": r, "ingrediente": i, "motivo": m} for r, i, m in plan.omitidas]}
+
+def precio_insumo(db, params, datos, ins_id):
+    # Cuerpo: {"costo_envase": .., opcionalmente "cantidad_envase" y "factor_conversion"}; lo no enviado conserva su valor
+    ins_id = entero(ins_id, "insumo"); actual = db.traer_datos("SELECT cantidad_envase, costo_envase, factor_conversion FROM insumos WHERE id=?", (ins_id,))
+    if not actual: raise ErrorHTTP(404, "Insumo inexistente")
+    try: cant_e, c_e, factor = (float((datos or {}).get(k, v)) for k, v in zip(("cantidad_envase", "costo_envase", "factor_conversion"), actual[0]))
+    except (TypeError, ValueError): raise ErrorHTTP(400, "Revisar los números")
+    r_r, c_u = calcular_costo_insumo(cant_e, c_e, factor)
+    if r_r == 0: raise ErrorHTTP(400, "El rendimiento da 0")
+    with db.transaccion():
+        db.ejecutar("UPDATE insumos SET cantidad_envase=?, costo_envase=?, factor_conversion=?, rendimiento_total=?, costo_unitario=? WHERE id=?", (cant_e, c_e, factor, r_r, c_u, ins_id))
+    return {"id": ins_id, "rendimiento_total": r_r, "costo_unitario": c_u}
+
+# (método, ruta, endpoint, escribe)
+RUTAS = [
+    ("GET", re.compile(r"^/productos$"), buscar_productos, False),
+    ("GET", re.compile(r"^/productos/(\d+)$"), producto, False),
+    ("GET", re.compile(r"^/recetas/(\d+)/(\d+)$"), receta, False),
+    ("GET", re.compile(r"^/insumos$"), buscar_insumos, False),
+    ("GET", re.compile(r"^/costos$"), costos, False),
+    ("POST", re.compile(r"^/compras$"), compras, False),
+    ("PUT", re.compile(r"^/insumos/(\d+)/precio$"), precio_insumo, True),
+]
+
+def respuesta(estado, cuerpo=b"", cabeceras=(), cerrar=False):
+    lineas = [f"HTTP/1.1 {estado} {ESTADOS[estado]}"]
+    if estado != 304: lineas += ["Content-Type: application/json; charset=utf-8", f"Content-Length: {len(cuerpo)}"]
+    lineas += list(cabeceras) + ["Connection: close" if cerrar else "Connection: keep-alive"]
+    return ("\r\n".join(lineas) + "\r\n\r\n").encode("latin-1") + (cuerpo if estado != 304 else b"")
+
+def json_bytes(datos):
+    return json.dumps(datos, ensure_ascii=False).encode("utf-8")
+
+class Servidor:
+    # Lecturas en un pool de hilos, cada uno con su conexión (WAL: no bloquean ni son bloqueadas por el escritor);
+    # escrituras en un único hilo con su conexión, de a una. Las respuestas GET se guardan por URL mientras la BD no cambie
+    conexiones = threading.local()
+
+    def __init__(self, ruta, lectores=8, capacidad_cache=1024):
+        self.ruta = ruta; self.capacidad_cache = capacidad_cache; self.respuestas = OrderedDict(); self.aciertos = 0; self.fallos = 0
+        self.lectores = ThreadPoolExecutor(lectores, thread_name_prefix="lector"); self.escritor = ThreadPoolExecutor(1, thread_name_prefix="escritor")
+        self.candado = None; self.vigia = None
+
+    def en_conexion(self, funcion, *args):
+        db = getattr(self.conexiones, "db", None)
+        if db is None: db = self.conexiones.db = DataBase(self.ruta)
+        return funcion(db, *args)
+
+    def revision(self):
+        # data_version de una conexión que nunca escribe: cambia con cada commit de cualquier otra (escritor propio, la app, un importador)
+        return self.vigia.execute("PRAGMA data_version").fetchone()[0]
+
+    async def iniciar(self, host="127.0.0.1", puerto=8765):
+        loop = asyncio.get_running_loop(); self.candado = asyncio.Lock()
+        await loop.run_in_executor(self.escritor, self.en_conexion, lambda db: None)  # La conexión del escritor aplica las migraciones pendientes
+        self.vigia = sqlite3.connect(self.ruta)
+        return await asyncio.start_server(self.atender, host, puerto)
+
+    def cerrar(self):
+        self.lectores.shutdown(); self.escritor.shutdown()
+        if self.vigia: self.vigia.close()
+
+    async def despachar(self, metodo, destino, cabeceras, cuerpo):
+        partes = urlsplit(destino); params = dict(parse_qsl(partes.query)); permitidos = []
+        for m, patron, funcion, escribe in RUTAS:
+            encontrada = patron.match(partes.path)
+            if not encontrada: continue
+            if m != metodo: permitidos.append(m); continue
+            break
+        else:
+            if permitidos: return 405, [f"Allow: {', '.join(permitidos)}"], json_bytes({"error": "Método no permitido"})
+            return 404, [], json_bytes({"error": "Ruta inexistente"})
+        try: datos = json.loads(cuerpo) if cuerpo else None
+        except ValueError: return 400, [], json_bytes({"error": "El cuerpo no es JSON válido"})
+        loop = asyncio.get_running_loop()
+        if escribe:
+            async with self.candado: resultado = await loop.run_in_executor(self.escritor, self.en_conexion, funcion, params, datos, *encontrada.groups())
+            self.respuestas.clear()
+            return 200, [], json_bytes(resultado)
+        if metodo != "GET": return 200, [], json_bytes(await loop.run_in_executor(self.lectores, self.en_conexion, funcion, params, datos, *encontrada.groups()))
+        # GET: misma URL y misma revisión de la BD = misma respuesta; el ETag es el hash del contenido
+        revision = self.revision(); guardada = self.respuestas.get(destino)
+        if guardada and guardada[0] == revision:
+            self.respuestas.move_to_end(destino); self.aciertos += 1; etag, contenido = guardada[1:]
+        else:
+            self.fallos += 1; contenido = json_bytes(await loop.run_in_executor(self.lectores, self.en_conexion, funcion, params, datos, *encontrada.groups()))
+            etag = '"' + hashlib.sha1(contenido).hexdigest()[:20] + '"'; self.respuestas[destino] = (revision, etag, contenido)
+            if len(self.respuestas) > self.capacidad_cache: self.respuestas.popitem(last=False)
+        extra = [f"ETag: {etag}", "Cache-Control: no-cache"]
+        if etag in [e.strip() for e in cabeceras.get("if-none-match", "").split(",")]: return 304, extra, b""
+        return 200, extra, contenido
+
+    async def atender(self, reader, writer):
+        # HTTP/1.1 mínimo con conexiones persistentes: los visores de cocina consultan seguido sobre la misma conexión
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea: break
+                try: metodo, destino, version = linea.decode("latin-1").split()
+                except ValueError: writer.write(respuesta(400, json_bytes({"error": "Petición inválida"}), cerrar=True)); break
+                cabeceras = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""): break
+                    k, _, v = h.decode("latin-1").partition(":"); cabeceras[k.strip().lower()] = v.strip()
+                largo = cabeceras.get("content-length") or "0"
+                if not re.fullmatch(r"[0-9]+", largo): writer.write(respuesta(400, json_bytes({"error": "Content-Length inválido"}), cerrar=True)); break
+                largo = int(largo)
+                if largo > MAX_CUERPO: writer.write(respuesta(413, json_bytes({"error": "Cuerpo demasiado grande"}), cerrar=True)); break
+                cuerpo = await reader.readexactly(largo) if largo else b""
+                cerrar = cabeceras.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                try: estado, extra, contenido = await self.despachar(metodo.upper(), destino, cabeceras, cuerpo)
+                except ErrorHTTP as e: estado, extra, contenido = e.estado, [], json_bytes({"error": str(e)})
+                except sqlite3.OperationalError as e: estado, extra, contenido = 503, ["Retry-After: 1"], json_bytes({"error": f"BD ocupada: {e}"})
+                except Exception as e: estado, extra, contenido = 500, [], json_bytes({"error": f"{type(e).__name__}: {e}"})
+                writer.write(respuesta(estado, contenido, extra, cerrar)); await writer.drain()
+                if cerrar: break
+        except (ConnectionError, asyncio.IncompleteReadError): pass
+        finally: writer.close()
+
+async def servir(ruta, host, puerto, lectores):
+    servidor = Servidor(ruta, lectores); s = await servidor.iniciar(host, puerto)
+    print(f"Sirviendo {ruta} en http://{host}:{puerto} ({lectores} lectores)")
+    try:
+        async with s: await s.serve_forever()
+    finally: servidor.cerrar()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API local HTTP/JSON del recetario para terminales y pantallas de cocina.")
+    parser.add_argument("--bd", default="db_recetario.db", help="Ruta a la base de datos")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--lectores", type=int, default=8, help="Conexiones de lectura (hilos)")
+    args = parser.parse_args(argv)
+    try: asyncio.run(servir(args.bd, args.host, args.puerto, args.lectores))
+    except KeyboardInterrupt: pass
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import sqlite3
+import pytest
+from database import DataBase
+from recetario import CacheRecetas, datos_receta, renderizar_receta
+
+# Menú mínimo con preparaciones anidadas: Jarabe (rinde 1000 ml) -> Base (rinde 500 ml, usa Jarabe) -> Latte Vainilla (usa Base y Jarabe);
+# Latte y Pastel solo usan insumos. Tamaños Chico, Grande y Extra; las recetas están en Chico
+
+@pytest.fixture
+def db(tmp_path):
+    return DataBase(str(tmp_path / "recetario.db"))
+
+@pytest.fixture
+def menu(db):
+    m = {}
+    ml = db.traer_datos("SELECT id FROM unidades WHERE nombre = 'Mililitro (ml)'")[0][0]
+    for t in ("Chico", "Grande", "Extra"): m[t] = db.ejecutar("INSERT INTO tamanos (nombre) VALUES (?)", (t,)).lastrowid
+    for nombre, precio in (("Leche", 0.02), ("Café", 0.5), ("Azúcar", 0.01), ("Vainilla", 0.3), ("Harina", 0.005)):
+        m[nombre] = db.ejecutar("INSERT INTO insumos (nombre, unidad_uso_id, costo_unitario) VALUES (?,?,?)", (nombre, ml, precio)).lastrowid
+    def receta(nombre, rendimiento=None, lineas=()):
+        p = db.ejecutar("INSERT INTO productos (nombre) VALUES (?)", (nombre,)).lastrowid; m["p_" + nombre] = p
+        rc = db.ejecutar("INSERT INTO receta_config (producto_id, tamano_id, rendimiento, unidad_rendimiento_id) VALUES (?,?,?,?)", (p, m["Chico"], rendimiento, ml if rendimiento else None)).lastrowid
+        db.ejecutar_lote("INSERT INTO receta_ingredientes (receta_config_id, insumo_id, subreceta_id, cantidad_necesaria) VALUES (?,?,?,?)",
+            [(rc, m.get(i), m.get(s), c) for i, s, c in lineas])
+        m[nombre] = rc
+    receta("Jarabe", 1000, [("Azúcar", None, 800), ("Vainilla", None, 20)])
+    receta("Base", 500, [("Leche", None, 450), (None, "Jarabe", 100)])
+    receta("Latte Vainilla", None, [("Café", None, 18), (None, "Base", 200), (None, "Jarabe", 15)])
+    receta("Latte", None, [("Café", None, 18), ("Leche", None, 250)])
+    receta("Pastel", None, [("Harina", None, 300), ("Azúcar", None, 120)])
+    return m
+
+def costo_ingenuo(db, rc):
+    # Recorre el árbol completo en cada llamada, sin memo ni costos guardados
+    filas = db.traer_datos('''SELECT ri.cantidad_necesaria, i.costo_unitario, ri.subreceta_id, sr.rendimiento FROM receta_ingredientes ri
+        LEFT JOIN insumos i ON i.id = ri.insumo_id LEFT JOIN receta_config sr ON sr.id = ri.subreceta_id WHERE ri.receta_config_id = ?''', (rc,))
+    return sum(c * (precio if sub is None else costo_ingenuo(db, sub) / rendimiento) for c, precio, sub, rendimiento in filas)
+
+def costos(db):
+    return dict(db.traer_datos("SELECT receta_config_id, costo FROM receta_costos"))
+
+def verificar_costos(db):
+    guardados = costos(db)
+    for (rc,) in db.traer_datos("SELECT id FROM receta_config"): assert guardados.get(rc, 0.0) == pytest.approx(costo_ingenuo(db, rc)), rc
+    assert not db.traer_datos("SELECT 1 FROM costos_pendientes")
+
+def foto(db):
+    return {t: db.traer_datos(f"SELECT * FROM {t} ORDER BY 1") for t in ("receta_config", "receta_ingredientes", "receta_costos", "costos_pendientes")}
+
+def test_ciclo_se_rechaza_al_confirmar_y_se_revierte(db, menu):
+    antes = foto(db)
+    for receta, sub in (("Jarabe", "Jarabe"), ("Jarabe", "Base"), ("Jarabe", "Latte Vainilla")):
+        assert db.crea_ciclo(menu[receta], menu[sub])
+        with pytest.raises(sqlite3.IntegrityError, match="Ciclo"):
+            with db.transaccion():
+                db.ejecutar("UPDATE insumos SET costo_unitario = 0.9 WHERE id = ?", (menu["Vainilla"],))
+                db.ejecutar("INSERT INTO receta_ingredientes (receta_config_id, subreceta_id, cantidad_necesaria) VALUES (?,?,1)", (menu[receta], menu[sub]))
+        assert foto(db) == antes
+        # Fuera de una transacción la sentencia suelta también se deshace
+        assert db.ejecutar("INSERT INTO receta_ingredientes (receta_config_id, subreceta_id, cantidad_necesaria) VALUES (?,?,1)", (menu[receta], menu[sub])) is None
+        assert foto(db) == antes
+    assert db.traer_datos("SELECT costo_unitario FROM insumos WHERE id = ?", (menu["Vainilla"],)) == [(0.3,)]
+    assert not db.crea_ciclo(menu["Latte Vainilla"], menu["Jarabe"])
+
+def test_propagacion_coincide_con_calculo_recursivo(db, menu):
+    verificar_costos(db)
+    assert db.costo_receta(menu["p_Latte Vainilla"], menu["Chico"]) == pytest.approx(13.37)
+    db.ejecutar("UPDATE insumos SET costo_unitario = 0.45 WHERE id = ?", (menu["Vainilla"],)); verificar_costos(db)
+    db.ejecutar("UPDATE receta_config SET rendimiento = 1250 WHERE id = ?", (menu["Jarabe"],)); verificar_costos(db)
+    db.ejecutar("UPDATE receta_ingredientes SET cantidad_necesaria = 300 WHERE receta_config_id = ? AND subreceta_id = ?", (menu["Base"], menu["Jarabe"])); verificar_costos(db)
+    db.ejecutar("DELETE FROM receta_ingredientes WHERE receta_config_id = ? AND insumo_id = ?", (menu["Base"], menu["Leche"])); verificar_costos(db)
+    db.ejecutar("DELETE FROM receta_ingredientes WHERE receta_config_id = ? AND subreceta_id = ?", (menu["Latte Vainilla"], menu["Base"])); verificar_costos(db)
+    db.ejecutar("DELETE FROM productos WHERE id = ?", (menu["p_Pastel"],)); verificar_costos(db)
+    assert menu["Pastel"] not in costos(db)
+    # Una receta que se usa como preparación no se puede borrar
+    antes = foto(db); assert db.ejecutar("DELETE FROM productos WHERE id = ?", (menu["p_Jarabe"],)) is None; assert foto(db) == antes
+    db.clonar_recetas(menu["Chico"], {menu["Grande"]: 1.5, menu["Extra"]: 2.0}, ajustes={menu["Café"]: 1.0}); verificar_costos(db)
+    db.ejecutar("UPDATE insumos SET costo_unitario = 0.04 WHERE id = ?", (menu["Azúcar"],)); verificar_costos(db)
+
+def test_cambio_de_precio_recalcula_solo_las_recetas_afectadas(db, menu):
+    # Se marca un costo que no depende de la Vainilla con un valor imposible: si se recalculara todo, desaparecería
+    db.cursor.execute("UPDATE receta_costos SET costo = -1 WHERE receta_config_id IN (?,?)", (menu["Latte"], menu["Pastel"])); db.conn.commit()
+    db.ejecutar("UPDATE insumos SET costo_unitario = 0.6 WHERE id = ?", (menu["Vainilla"],))
+    guardados = costos(db)
+    assert guardados[menu["Latte"]] == guardados[menu["Pastel"]] == -1
+    for r in ("Jarabe", "Base", "Latte Vainilla"): assert guardados[menu[r]] == pytest.approx(costo_ingenuo(db, menu[r]))
+
+def test_cambio_de_precio_se_ve_en_la_misma_transaccion(db, menu):
+    antes = db.costo_receta(menu["p_Latte Vainilla"], menu["Chico"])
+    with pytest.raises(RuntimeError):
+        with db.transaccion():
+            db.ejecutar("UPDATE insumos SET costo_unitario = 0.6 WHERE id = ?", (menu["Vainilla"],))
+            nuevo = db.costo_receta(menu["p_Latte Vainilla"], menu["Chico"])
+            assert nuevo == pytest.approx(costo_ingenuo(db, menu["Latte Vainilla"])) and nuevo > antes
+            raise RuntimeError()
+    assert db.costo_receta(menu["p_Latte Vainilla"], menu["Chico"]) == antes
+    verificar_costos(db)
+
+def test_clonado_simulado_no_deja_cambios(db, menu):
+    antes = foto(db); args = (menu["Chico"], {menu["Grande"]: 1.5, menu["Extra"]: 2.0}); kwargs = {"ajustes": {menu["Café"]: 1.0}}
+    simulado = db.clonar_recetas(*args, simular=True, **kwargs)
+    assert foto(db) == antes
+    assert len(simulado) == 10 and all(r[4] is None for r in simulado)
+    assert db.clonar_recetas(*args, **kwargs) == simulado
+    verificar_costos(db)
+    with pytest.raises(ValueError):
+        with db.transaccion(): db.clonar_recetas(*args, simular=True, **kwargs)
+
+def test_clonado_escala_el_rendimiento_de_una_receta_existente(db, menu):
+    # El destino ya existía con otro rendimiento: toma el del origen escalado
+    db.ejecutar("INSERT INTO receta_config (producto_id, tamano_id, rendimiento) VALUES (?,?,?)", (menu["p_Jarabe"], menu["Grande"], 10))
+    db.clonar_recetas(menu["Chico"], [menu["Grande"]], 2.0, productos=[menu["p_Jarabe"], menu["p_Latte"]])
+    assert db.traer_datos("SELECT rendimiento FROM receta_config WHERE producto_id = ? AND tamano_id = ?", (menu["p_Jarabe"], menu["Grande"])) == [(2000.0,)]
+    # Sin rendimiento en el origen se deja el del destino
+    db.ejecutar("UPDATE receta_config SET rendimiento = 300 WHERE producto_id = ? AND tamano_id = ?", (menu["p_Latte"], menu["Grande"]))
+    db.clonar_recetas(menu["Chico"], [menu["Grande"]], 2.0, productos=[menu["p_Latte"]], reemplazar=True)
+    assert db.traer_datos("SELECT rendimiento FROM receta_config WHERE producto_id = ? AND tamano_id = ?", (menu["p_Latte"], menu["Grande"])) == [(300.0,)]
+    verificar_costos(db)
+
+def test_importar_rendimiento_invalido_se_rechaza(db, menu, tmp_path):
+    from importacion import importar
+    antes = foto(db); ruta = tmp_path / "recetas.csv"
+    ruta.write_text("producto,tamano,rendimiento,unidad_rendimiento\nJarabe,Chico,0,\nBase,Chico,-5,\nJarabe,Chico,,\nBase,Chico,nan,\n", encoding="utf-8")
+    r = importar(db, "recetas", str(ruta))
+    assert len(r["errores"]) == 4 and r["actualizadas"] == r["insertadas"] == 0
+    assert foto(db) == antes
+    # Sin rendimiento solo se rechaza si otra receta la usa; válido se aplica
+    ruta.write_text("producto,tamano,rendimiento,unidad_rendimiento\nLatte,Chico,,\nJarabe,Chico,800,Mililitro (ml)\n", encoding="utf-8")
+    assert importar(db, "recetas", str(ruta)) == {"actualizadas": 2, "insertadas": 0, "omitidas": 0, "errores": []}
+    verificar_costos(db)
+    # Una línea con una subreceta sin rendimiento tampoco entra
+    ruta = tmp_path / "ingredientes.csv"
+    ruta.write_text("producto,tamano,insumo,cantidad,subreceta,subreceta_tamano\nLatte,Chico,,10,Pastel,Chico\nLatte,Chico,,10,Jarabe,Grande\n", encoding="utf-8")
+    r = importar(db, "ingredientes", str(ruta))
+    assert len(r["errores"]) == 2 and r["insertadas"] == 0
+    assert not db.traer_datos("SELECT 1 FROM receta_config WHERE producto_id = ? AND tamano_id = ?", (menu["p_Jarabe"], menu["Grande"]))
+    verificar_costos(db)
+
+def test_plan_de_compra_omite_lo_que_no_se_puede_convertir(db, menu):
+    from costeo import PlanCompra
+    db.ejecutar("UPDATE insumos SET factor_conversion = 1, cantidad_envase = 1000, costo_envase = 1000 * costo_unitario")
+    db.ejecutar("UPDATE insumos SET factor_conversion = NULL WHERE id = ?", (menu["Leche"],))
+    db.ejecutar("UPDATE receta_config SET rendimiento = NULL WHERE id = ?", (menu["Jarabe"],))
+    plan = PlanCompra.calcular(db, [(menu["p_Latte Vainilla"], menu["Chico"], 10), (menu["p_Latte"], menu["Chico"], 5)])
+    assert [(l[1], l[2], l[6]) for l in plan.lineas] == [("Café", 270, 1)]
+    assert plan.omitidas == [("Base (Chico)", "Jarabe (Chico)", "subreceta sin rendimiento"), ("Base (Chico)", "Leche", "insumo sin factor de conversión"),
+                             ("Latte (Chico)", "Leche", "insumo sin factor de conversión"), ("Latte Vainilla (Chico)", "Jarabe (Chico)", "subreceta sin rendimiento")]
+
+def test_costos_a_fecha_usan_el_precio_vigente(db, menu):
+    from costeo import costos_a_fecha
+    db.ejecutar("UPDATE insumo_precios SET fecha = '2024-01-10 09:00:00'")
+    db.ejecutar("INSERT INTO insumo_precios (insumo_id, fecha, costo_unitario) VALUES (?, '2024-02-01 12:00:00', 0.04)", (menu["Leche"],))
+    assert costos_a_fecha(db, "2024-01-31", [menu["Latte"]])[menu["Latte"]] == pytest.approx(14.0)
+    assert costos_a_fecha(db, "2024-02-01", [menu["Latte"]])[menu["Latte"]] == pytest.approx(19.0)
+    assert costos_a_fecha(db, "2024-02-01T11:59", [menu["Latte"]])[menu["Latte"]] == pytest.approx(14.0)
+    # Antes del historial se usa el precio más antiguo conocido
+    assert costos_a_fecha(db, "2023-06-01", [menu["Latte"]])[menu["Latte"]] == pytest.approx(14.0)
+    for fecha in ("basura", "2024-02-30", ""):
+        with pytest.raises(ValueError, match="Fecha inválida"): costos_a_fecha(db, fecha)
+
+def render(db, menu, nombre):
+    return renderizar_receta(*datos_receta(db, menu["p_" + nombre], menu["Chico"]))
+
+def ver(cache, menu, *nombres):
+    return {n: cache.obtener(menu["p_" + n], menu["Chico"]) for n in nombres}
+
+def test_cache_recetas_invalida_al_cambiar_un_precio_dentro_de_una_subreceta(db, menu):
+    cache = CacheRecetas(db); antes = ver(cache, menu, "Latte Vainilla", "Latte", "Pastel"); assert cache.fallos == 3
+    db.ejecutar("UPDATE insumos SET costo_unitario = 0.45 WHERE id = ?", (menu["Vainilla"],))
+    # La Vainilla está dentro del Jarabe, que está dentro de la Base: el Latte Vainilla cambia sin tener Vainilla entre sus líneas
+    despues = ver(cache, menu, "Latte Vainilla", "Latte", "Pastel")
+    assert despues["Latte Vainilla"] != antes["Latte Vainilla"] and despues["Latte Vainilla"] == render(db, menu, "Latte Vainilla")
+    assert "$13.37" not in despues["Latte Vainilla"]
+    assert despues["Latte"] is antes["Latte"] and despues["Pastel"] is antes["Pastel"]
+    assert (cache.aciertos, cache.fallos) == (2, 4)
+
+def test_cache_recetas_invalida_al_renombrar_unidad_o_tamano(db, menu):
+    cache = CacheRecetas(db); antes = ver(cache, menu, "Latte Vainilla", "Latte", "Pastel")
+    db.ejecutar("UPDATE tamanos SET nombre = 'Pequeño' WHERE id = ?", (menu["Chico"],))
+    # El tamaño se ve en el nombre de las preparaciones usadas: solo el Latte Vainilla lo muestra
+    despues = ver(cache, menu, "Latte Vainilla", "Latte", "Pastel")
+    assert "Jarabe (Pequeño)" in despues["Latte Vainilla"] and despues["Latte Vainilla"] == render(db, menu, "Latte Vainilla")
+    assert despues["Latte"] is antes["Latte"] and despues["Pastel"] is antes["Pastel"]
+    db.ejecutar("UPDATE unidades SET nombre = 'Mililitros' WHERE nombre = 'Mililitro (ml)'")
+    despues = ver(cache, menu, "Latte Vainilla", "Latte", "Pastel")
+    for nombre, html in despues.items(): assert "Mililitros" in html and html == render(db, menu, nombre), nombre
+
+def test_cache_recetas_ve_los_commits_de_otra_conexion(db, menu):
+    cache = CacheRecetas(db); antes = ver(cache, menu, "Latte Vainilla", "Latte", "Pastel")
+    otra = DataBase(db.db_name)
+    otra.ejecutar("UPDATE insumos SET costo_unitario = 0.8 WHERE id = ?", (menu["Café"],))
+    otra.ejecutar("UPDATE productos SET nombre = 'Torta' WHERE id = ?", (menu["p_Pastel"],))
+    # Esta conexión no escribió nada: sus contadores por tabla no cambiaron, el aviso llega por data_version y las versiones de la BD
+    despues = ver(cache, menu, "Latte Vainilla", "Latte", "Pastel")
+    for nombre in ("Latte Vainilla", "Latte", "Pastel"): assert despues[nombre] != antes[nombre] and despues[nombre] == render(db, menu, nombre), nombre
+    assert "Torta" in despues["Pastel"] and "$18.77" in despues["Latte Vainilla"]
+    assert ver(cache, menu, "Latte Vainilla", "Latte", "Pastel") == despues and cache.aciertos == 3